@@ -0,0 +1,165 @@
+"""Benchmark of the thread-pool and asyncio upload engines against a local S3 stand-in.
+
+Starts a small HTTP server, in its own process so it does not compete for the
+GIL, that speaks enough of the S3 API for uploads (PutObject and the multipart
+calls), with a fixed delay per request to stand in for S3's first-byte latency. Each engine then uploads the same folder of small
+files through the scheduler upload_folder would build. Encryption is switched off
+by default so the numbers show request handling, not PBKDF2; pass --encrypt to
+include it. The asyncio engine needs aiobotocore.
+
+    python benchmarks/bench_engines.py --files 2000 --file-size 16 --latency 50 --concurrency 64 256
+"""
+import os
+import sys
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+KB = 1024
+
+
+class StandInS3(BaseHTTPRequestHandler):
+    """Accepts uploads like S3 does and throws the bytes away."""
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status=200, body=b'', headers=None):
+        time.sleep(self.latency)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Trailers (aws-chunked checksums) end with a blank line
+                    while self.rfile.readline() not in (b'\r\n', b''):
+                        pass
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_PUT(self):
+        body = self._body()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self._reply(headers={'ETag': etag})
+
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+        self._body()
+        if 'uploads' in query:
+            xml = (f'<InitiateMultipartUploadResult><UploadId>{uuid.uuid4().hex}</UploadId>'
+                   f'</InitiateMultipartUploadResult>')
+        else:
+            xml = '<CompleteMultipartUploadResult><ETag>"done-1"</ETag></CompleteMultipartUploadResult>'
+        self._reply(body=xml.encode(), headers={'Content-Type': 'application/xml'})
+
+    def do_DELETE(self):
+        self._reply(status=204)
+
+
+def serve(latency):
+    StandInS3.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInS3)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+def start_server(latency):
+    process = subprocess.Popen([sys.executable, __file__, '--serve', str(latency)], stdout=subprocess.PIPE, text=True)
+    return process, f"http://127.0.0.1:{process.stdout.readline().strip()}"
+
+
+def make_folder(files, file_size):
+    folder = tempfile.mkdtemp()
+    for index in range(files):
+        with open(os.path.join(folder, f"file{index:06d}.bin"), 'wb') as file:
+            file.write(os.urandom(file_size))
+    return folder
+
+
+def run(engine, folder, endpoint, concurrency):
+    from dev import multi_part_async, multi_part_scan, multi_part_scheduler, multi_part_upload
+
+    bucket = "bench"
+    # Clients are built the way upload_folder builds them, connection pools included
+    if engine == 'threads':
+        s3 = multi_part_upload.create_upload_client(endpoint, 'us-east-1', concurrency)
+        scheduler = multi_part_scheduler.PartScheduler(s3, bucket, 'us-east-1', multi_part_upload.upload_part,
+                                                       multi_part_upload.put_file, max_concurrency=concurrency)
+    else:
+        client_factory = multi_part_async.default_client_factory('us-east-1', endpoint, concurrency)
+        scheduler = multi_part_async.AsyncPartScheduler(bucket, multi_part_upload.prepare_part,
+                                                        multi_part_upload.prepare_file, client_factory,
+                                                        max_concurrency=concurrency)
+
+    started = time.perf_counter()
+    for file_path, relative_path, stat in multi_part_scan.scan_files(folder):
+        scheduler.submit_file(file_path, relative_path, 8 * 1024 * KB, stat=stat)
+    uploads = scheduler.join()
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for upload in uploads if upload.failed)
+    return elapsed, len(uploads), failed, scheduler.peak_in_flight
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--file-size', type=int, default=16, help="Size of each file in KB")
+    parser.add_argument('--latency', type=float, default=50, help="Delay added to every request, in ms")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[64, 256])
+    parser.add_argument('--encrypt', action='store_true', help="Keep client-side encryption on")
+    parser.add_argument('--serve', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve)
+        return
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    from dev import multi_part_async, multi_part_upload
+    if not args.encrypt:
+        multi_part_upload.client_side_encryption = False
+
+    server, endpoint = start_server(args.latency / 1000)
+    folder = make_folder(args.files, args.file_size * KB)
+    engines = ['threads'] + (['asyncio'] if multi_part_async.available() else [])
+    if len(engines) == 1:
+        print("aiobotocore is not installed; only the thread engine is measured")
+
+    try:
+        print(f"{args.files} files of {args.file_size} KB, {args.latency:.0f} ms per request, "
+              f"encryption {'on' if args.encrypt else 'off'}")
+        print(f"{'engine':<8} {'limit':>6} {'seconds':>8} {'objects/s':>10} {'peak':>6} {'failed':>7}")
+        for concurrency in args.concurrency:
+            for engine in engines:
+                elapsed, count, failed, peak = run(engine, folder, endpoint, concurrency)
+                print(f"{engine:<8} {concurrency:>6} {elapsed:>8.2f} {count / elapsed:>10.0f} {peak:>6} {failed:>7}")
+    finally:
+        server.terminate()
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
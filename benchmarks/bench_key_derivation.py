@@ -0,0 +1,65 @@
+"""Benchmark of per-part encryption CPU time with and without per-part key derivation.
+
+Before, every part went through encrypt_data, running PBKDF2 (100,000 SHA-256
+iterations) again on top of Fernet. Now the key is derived once per file and every
+part is sealed as AES-GCM frames (multi_part_format). This encrypts the same parts
+each way, plus Fernet with a key derived once, and reports CPU time and bytes on
+the wire per part.
+
+    python benchmarks/bench_key_derivation.py --parts 50 --part-size 1024
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+KB = 1024
+
+
+def per_part(encrypt, parts):
+    started = time.process_time()
+    sent = sum(len(encrypt(part)) for part in parts)
+    return (time.process_time() - started) / len(parts), sent / len(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--parts', type=int, default=50)
+    parser.add_argument('--part-size', type=int, default=1024, help="Size of each part in KB")
+    args = parser.parse_args()
+
+    from cryptography.fernet import Fernet
+    from dev import multi_part_upload
+
+    parts = [os.urandom(args.part_size * KB) for _ in range(args.parts)]
+    encryption_key = multi_part_upload.generate_encryption_key()
+
+    fernet = []
+
+    def derive_every_part(part):
+        return multi_part_upload.encrypt_data(part, encryption_key)[0]
+
+    def fernet_derive_once(part):
+        if not fernet:
+            fernet.append(Fernet(multi_part_upload.derive_key(encryption_key)))
+        return fernet[0].encrypt(part)
+
+    def frames_derive_once(part):
+        return multi_part_upload.encrypt_for_file(part, "bench.bin", 0, len(part))
+
+    print(f"{args.parts} parts of {args.part_size} KB")
+    print(f"{'encryption':<28} {'ms/part':>8} {'total s':>8} {'sent/plain':>11}")
+    baseline = None
+    for name, encrypt in [("PBKDF2 + Fernet every part", derive_every_part),
+                          ("Fernet, derived once", fernet_derive_once),
+                          ("AES-GCM frames, derived once", frames_derive_once)]:
+        seconds, sent = per_part(encrypt, parts)
+        baseline = baseline or seconds
+        print(f"{name:<28} {seconds * 1000:>8.2f} {seconds * args.parts:>8.2f} {sent / (args.part_size * KB):>11.3f}"
+              f"  ({baseline / seconds:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark of the part read path used by upload_part.
+
+Compares the old path (open, seek and read() a fresh bytes object for every part)
+with the shared PartReader (one mmap per file, memoryview slices as request bodies).
+Each mode runs in its own subprocess so peak RSS is measured cleanly. The "upload"
+drains every body in 64 KB blocks the way http.client does and CRCs each block, so
+the data is really touched.
+
+With --encrypt every part is encrypted into the chunked format first, as
+upload_folder does, and a third mode, "stage", reads and encrypts in the
+EncryptionStage worker processes (--encryption-workers). Its peak RSS adds the
+largest worker's.
+
+    python benchmarks/bench_part_reader.py --file-size 512 --part-size 32 --workers 10
+    python benchmarks/bench_part_reader.py --file-size 512 --part-size 32 --workers 10 --encrypt
+"""
+import os
+import sys
+import json
+import base64
+import time
+import zlib
+import argparse
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+BLOCK_SIZE = 64 * 1024
+MB = 1024 * 1024
+
+
+def drain(body):
+    """Consume a request body like http.client does; return its CRC."""
+    crc = 0
+    if isinstance(body, (bytes, bytearray)):
+        view = memoryview(body)
+        for start in range(0, len(view), BLOCK_SIZE):
+            crc = zlib.crc32(view[start:start + BLOCK_SIZE], crc)
+        return crc
+    for block in iter(lambda: body.read(BLOCK_SIZE), b''):
+        crc = zlib.crc32(block, crc)
+    return crc
+
+
+def run_mode(mode, file_path, part_size, workers, encrypt=False):
+    from dev import multi_part_encryption, multi_part_format
+    from dev.multi_part_reader import PartReader
+
+    file_size = os.path.getsize(file_path)
+    num_parts = (file_size + part_size - 1) // part_size
+    copied = [0]
+    reader = PartReader(file_path) if mode == 'mmap' else None
+    key = base64.urlsafe_b64encode(os.urandom(32))
+    stage = multi_part_encryption.EncryptionStage(multi_part_format.encrypt_range) if mode == 'stage' else None
+
+    def send(part_number):
+        offset = part_size * (part_number - 1)
+        if stage is not None:
+            body, _ = stage.encrypt_range(file_path, offset, part_size, key)
+            # Read in the worker, then pickled across and unpickled here
+            copied[0] += len(body) * 2
+            return drain(body)
+        if reader is None:
+            with open(file_path, 'rb') as file:
+                file.seek(offset)
+                data = file.read(part_size)
+            copied[0] += len(data)
+        else:
+            data = reader.part(offset, part_size)
+        if encrypt:
+            data = multi_part_format.encrypt_range(data, key, offset, file_size)
+            copied[0] += len(data)
+        crc = drain(data if encrypt or reader is None else reader.body(offset, part_size))
+        if reader is not None:
+            reader.release(offset, part_size)
+        return crc
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(send, range(1, num_parts + 1)))
+    elapsed = time.perf_counter() - start
+    if reader is not None:
+        reader.close()
+    if stage is not None:
+        stage.close()
+
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak_rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return {'mode': mode, 'seconds': elapsed, 'bytes_copied': copied[0], 'peak_rss': peak_rss}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--file-size', type=int, default=512, help="Test file size in MB")
+    parser.add_argument('--part-size', type=int, default=32, help="Part size in MB")
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--encrypt', action='store_true', help="Encrypt every part, as upload_folder does")
+    parser.add_argument('--mode', choices=['read', 'mmap', 'stage'], help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        result = run_mode(args.mode, args.file, args.part_size * MB, args.workers, args.encrypt)
+        print(json.dumps(result))
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        for _ in range(args.file_size):
+            file.write(os.urandom(MB))
+        file_path = file.name
+
+    try:
+        print(f"{args.file_size} MB file, {args.part_size} MB parts, {args.workers} workers"
+              f"{', encrypted' if args.encrypt else ''}")
+        print(f"{'mode':<6} {'seconds':>8} {'copied MB':>10} {'peak RSS MB':>12}")
+        for mode in ('read', 'mmap', 'stage') if args.encrypt else ('read', 'mmap'):
+            output = subprocess.check_output([
+                sys.executable, __file__, '--mode', mode, '--file', file_path,
+                '--part-size', str(args.part_size), '--workers', str(args.workers),
+            ] + (['--encrypt'] if args.encrypt else []))
+            result = json.loads(output)
+            print(f"{mode:<6} {result['seconds']:>8.2f} {result['bytes_copied'] / MB:>10.0f} "
+                  f"{result['peak_rss'] / MB:>12.0f}")
+    finally:
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main()
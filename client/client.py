@@ -19,12 +19,21 @@ from boto3.exceptions import S3UploadFailedError
 
 # Importing functions from the 'dev' module
 from dev import multi_part_upload
+from dev import multi_part_async
+from dev import multi_part_checksum
+from dev import multi_part_concurrency
 from dev import multi_part_delete
 from dev import multi_part_download
+from dev import multi_part_fetch
 from dev import multi_part_list
 from dev import multi_part_hash
 from dev import multi_part_logs
 from dev import multi_part_new_folder_creation
+from dev import multi_part_ranged
+from dev import multi_part_reaper
+from dev import multi_part_retry
+from dev import multi_part_scheduler
+from dev import multi_part_sync
 
 session = boto3.Session()
 
@@ -333,6 +342,122 @@ def user():
             click.echo("Invalid choice. Please try again.")
 
 
+@cli.command()
+@click.option("--bucket", prompt="Enter the S3 bucket name", help="Name of the S3 bucket")
+@click.option("--target-part-size", default=None, type=int, help="Preferred size of each part in bytes")
+@click.option("--num-parts", default=None, type=int, help="Target number of parts for each file")
+@click.option("--max-concurrency", default=None, type=int,
+              help=f"Most S3 requests in flight across all files; defaults to "
+                   f"{multi_part_concurrency.DEFAULT_MAX_CONCURRENCY}, or "
+                   f"{multi_part_async.DEFAULT_ASYNC_CONCURRENCY} with --engine asyncio")
+@click.option("--adaptive/--no-adaptive", default=True,
+              help="Tune concurrency from observed throughput and throttling, or run fixed at --max-concurrency")
+@click.option("--multipart-threshold", default=multi_part_scheduler.DEFAULT_MULTIPART_THRESHOLD, type=int,
+              help="Files smaller than this many bytes are sent with a single PutObject")
+@click.option("--resume", is_flag=True, default=False, help="Continue interrupted uploads from the part journal")
+@click.option("--max-memory", default=None, help="Limit on bytes buffered by in-flight parts, e.g. 512M")
+@click.option("--plan-only", is_flag=True, default=False, help="Print the part plan for each file and exit")
+@click.option("--recursive", is_flag=True, default=False, help="Include files in subdirectories")
+@click.option("--prefix", default="", help="Destination prefix for the uploaded keys")
+@click.option("--dedup", is_flag=True, default=False,
+              help="Copy files whose content is already in the bucket on the server instead of uploading them")
+@click.option("--checksum", default=multi_part_checksum.DEFAULT_CHECKSUM_ALGORITHM, type=click.Choice(["CRC32", "CRC32C", "SHA256", "none"], case_sensitive=False),
+              help="Checksum sent with every part and verified when the upload completes")
+@click.option("--max-attempts", default=multi_part_retry.DEFAULT_MAX_ATTEMPTS, type=int, help="Times a failed part is tried before its file is aborted")
+@click.option("--engine", default="threads", type=click.Choice(multi_part_async.ENGINES),
+              help="Send requests from a thread pool or from one asyncio event loop (needs aiobotocore)")
+@click.option("--encryption-workers", default=0, type=int,
+              help="Processes that read and encrypt parts off the I/O threads; 0 (the default) encrypts on them")
+@click.option("--encrypt/--no-encrypt", default=True,
+              help="Encrypt every file on the client before it is sent, or send the files as they are")
+@click.argument("folder_path", type=click.Path(exists=True, file_okay=False))
+def upload(bucket, target_part_size, num_parts, max_concurrency, adaptive, multipart_threshold, resume,
+           max_memory, plan_only, recursive, prefix, dedup, checksum, max_attempts, engine, encryption_workers,
+           encrypt, folder_path):
+    """Upload every file in a folder to S3 using multipart uploads."""
+    multi_part_upload.upload_folder(folder_path, bucket, target_part_size=target_part_size,
+                                    num_parts=num_parts, max_concurrency=max_concurrency, adaptive=adaptive,
+                                    multipart_threshold=multipart_threshold, resume=resume,
+                                    max_memory=max_memory, plan_only=plan_only, recursive=recursive,
+                                    prefix=prefix, dedup=dedup, checksum_algorithm=checksum,
+                                    max_attempts=max_attempts, engine=engine,
+                                    encryption_workers=encryption_workers, encrypt=encrypt)
+    logging.info(f"Uploaded files from {folder_path} to S3 bucket {bucket}")
+
+
+@cli.command()
+@click.option("--bucket", prompt="Enter the S3 bucket name", help="Name of the S3 bucket")
+@click.option("--prefix", default="", help="Destination prefix for the synced keys")
+@click.option("--recursive/--no-recursive", default=True, help="Include files in subdirectories")
+@click.option("--delete", is_flag=True, default=False, help="Delete objects under the prefix that no longer exist locally")
+@click.option("--dry-run", is_flag=True, default=False, help="Show what would be uploaded or deleted and exit")
+@click.option("--max-concurrency", default=multi_part_concurrency.DEFAULT_MAX_CONCURRENCY, type=int,
+              help="Most S3 requests in flight across all files")
+@click.option("--adaptive/--no-adaptive", default=True,
+              help="Tune concurrency from observed throughput and throttling, or run fixed at --max-concurrency")
+@click.option("--max-memory", default=None, help="Limit on bytes buffered by in-flight parts, e.g. 512M")
+@click.argument("folder_path", type=click.Path(exists=True, file_okay=False))
+def sync(bucket, prefix, recursive, delete, dry_run, max_concurrency, adaptive, max_memory, folder_path):
+    """Upload only the files that are new or changed since the last sync."""
+    multi_part_sync.sync_folder(folder_path, bucket, prefix=prefix, recursive=recursive, delete=delete,
+                                dry_run=dry_run, max_concurrency=max_concurrency, adaptive=adaptive,
+                                max_memory=max_memory)
+    logging.info(f"Synced {folder_path} to S3 bucket {bucket}")
+
+
+@cli.command()
+@click.option("--bucket", prompt="Enter the S3 bucket name", help="Name of the S3 bucket")
+@click.option("--prefix", default="", help="Only reap uploads whose keys start with this prefix")
+@click.option("--older-than", default=multi_part_reaper.DEFAULT_REAP_AGE, show_default=True,
+              help="Only reap uploads started longer ago than this, e.g. 12h or 7d; 0 reaps every upload")
+@click.option("--dry-run", is_flag=True, default=False, help="Report what would be aborted and the bytes it would free")
+@click.option("--depth", default=1, type=int, help="Number of key path components to group the report by")
+@click.option("--max-concurrency", default=multi_part_reaper.DEFAULT_REAP_CONCURRENCY, type=int,
+              help="Most S3 requests in flight")
+def reap(bucket, prefix, older_than, dry_run, depth, max_concurrency):
+    """Abort incomplete multipart uploads left behind in a bucket."""
+    multi_part_reaper.reap_uploads(bucket, prefix=prefix, older_than_age=older_than, dry_run=dry_run, depth=depth,
+                                   max_concurrency=max_concurrency)
+    logging.info(f"Reaped incomplete multipart uploads in S3 bucket {bucket}")
+
+
+@cli.command()
+@click.option("--bucket", prompt="Enter the S3 bucket name", help="Name of the S3 bucket")
+@click.option("--max-concurrency", default=multi_part_ranged.DEFAULT_RANGE_CONCURRENCY, type=int,
+              help="Most ranged GETs in flight")
+@click.option("--adaptive/--no-adaptive", default=True,
+              help="Tune concurrency from observed throughput and throttling, or run fixed at --max-concurrency")
+@click.option("--range-size", default=multi_part_ranged.DEFAULT_RANGE_SIZE, type=str,
+              help="Bytes fetched by each ranged GET, e.g. 8M")
+@click.option("--engine", default="threads", type=click.Choice(multi_part_async.ENGINES),
+              help="Fetch ranges from a thread pool or from one asyncio event loop (needs aiobotocore)")
+@click.argument("key")
+@click.argument("local_directory", type=click.Path(file_okay=False))
+def download(bucket, max_concurrency, adaptive, range_size, engine, key, local_directory):
+    """Download an object with concurrent ranged GETs, decrypting it if it was encrypted on upload."""
+    concurrency = multi_part_concurrency.AdaptiveConcurrency(maximum=max_concurrency, adaptive=adaptive,
+                                                             name="download")
+    multi_part_download.download_file(bucket, key, local_directory, concurrency=concurrency, engine=engine,
+                                      range_size=range_size)
+    logging.info(f"Downloaded {key} from S3 bucket {bucket}")
+
+
+@cli.command(name="download-prefix")
+@click.option("--bucket", prompt="Enter the S3 bucket name", help="Name of the S3 bucket")
+@click.option("--prefix", default="", help="Download every object whose key is under this prefix")
+@click.option("--max-concurrency", default=multi_part_fetch.DEFAULT_FETCH_CONCURRENCY, type=int,
+              help="Most objects downloading at once")
+@click.option("--range-size", default=multi_part_ranged.DEFAULT_RANGE_SIZE, type=str,
+              help="Bytes fetched by each ranged GET of a large object, e.g. 8M")
+@click.option("--sync", is_flag=True, default=False, help="Skip objects the local files already match")
+@click.argument("local_directory", type=click.Path(file_okay=False))
+def download_prefix(bucket, prefix, max_concurrency, range_size, sync, local_directory):
+    """Download every object under a prefix, recreating its folders under LOCAL_DIRECTORY."""
+    multi_part_fetch.download_prefix(bucket, prefix, local_directory, max_concurrency=max_concurrency,
+                                     range_size=range_size, sync=sync)
+    logging.info(f"Downloaded {bucket}/{prefix} to {local_directory}")
+
+
 def get_file_state(directory, recursive):
     file_state = set()
     for root, dirs, files in os.walk(directory):
@@ -396,6 +521,11 @@ def watch(interval, recursive, directory):
 def help():
     """Display help information for your script."""
     click.echo("--user\t\tFor accessing to create a Bucket, Multi-part Upload, Delete File, and Listing files.")
+    click.echo("--upload\tFor uploading a folder with one shared pool of part uploads")
+    click.echo("--sync\t\tFor uploading only the files that changed since the last sync")
+    click.echo("--reap\t\tFor aborting incomplete multipart uploads left in a bucket")
+    click.echo("--download\tFor downloading an object with parallel ranged GETs")
+    click.echo("--download-prefix\tFor downloading every object under a prefix")
     click.echo("--watch\t\tFor Watching the change of directory")
     click.echo("--help\t\tTo get access to all commands")
     # Add more general options if needed
@@ -0,0 +1,455 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # The asyncio engine needs aiobotocore (pip install aiobotocore); the thread engine does not
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    AioConfig = get_session = None
+
+from dev import multi_part_checksum
+from dev import multi_part_concurrency
+from dev import multi_part_memory
+from dev import multi_part_ranged
+from dev import multi_part_reader
+from dev import multi_part_retry
+from dev import multi_part_scheduler
+
+# Requests in flight at once. Waiting on a socket costs a coroutine, not a thread,
+# so the event loop can hold far more of them than the thread pools can.
+DEFAULT_ASYNC_CONCURRENCY = 256
+
+# Ranged GETs for downloads are this big
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+ENGINES = ('threads', 'asyncio')
+
+
+def available():
+    return get_session is not None
+
+
+def require():
+    if not available():
+        raise RuntimeError("The asyncio engine needs the aiobotocore package: pip install aiobotocore")
+
+
+def default_client_factory(region_name=None, endpoint_url=None, max_pool_connections=DEFAULT_ASYNC_CONCURRENCY):
+    """
+    Return a callable that opens an aiobotocore S3 client as an async context manager.
+    Its pool holds ``max_pool_connections`` connections, one per request the engine keeps
+    in flight; aiobotocore's default of 10 would leave the rest waiting for a connection.
+    """
+    require()
+    config = AioConfig(max_pool_connections=max_pool_connections)
+
+    def create_client():
+        return get_session().create_client('s3', region_name=region_name, endpoint_url=endpoint_url, config=config)
+    return create_client
+
+
+def _request_body(body):
+    # A view of the mapped file is sent from the mapping, as on the thread engine, not copied to bytes
+    return multi_part_reader.PartBody(body) if isinstance(body, memoryview) else body
+
+
+def _error(part_number, e):
+    return {"PartNumber": part_number, "Error": str(e), "Code": multi_part_retry.error_code(e)}
+
+
+class _LoopThread:
+    """
+    An event loop on its own thread holding one open S3 client until stopped.
+    """
+    def __init__(self, client_factory):
+        self.client_factory = client_factory
+        self.loop = asyncio.new_event_loop()
+        self.s3 = None
+        self._ready = threading.Event()
+        self._startup_error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._startup_error is not None:
+            self._thread.join()
+            raise self._startup_error
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    async def _main(self):
+        self._stopped = asyncio.Event()
+        try:
+            async with self.client_factory() as client:
+                self.s3 = client
+                self._ready.set()
+                await self._stopped.wait()
+        except Exception as e:
+            self._startup_error = e
+            self._ready.set()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+
+
+class AsyncPartScheduler:
+    """
+    Drop-in counterpart of PartScheduler that sends every request from one event loop.
+
+    ``submit_file`` and ``join`` behave as they do on PartScheduler and the same
+    FileUpload objects come back, so upload_folder can use either engine. Reading
+    and encrypting stay on a small thread pool (``prepare_part``/``prepare_file``
+    from multi_part_upload); only the network waits move onto the loop, where
+    ``max_concurrency`` requests can be in flight without a thread for each.
+    Retries, checksums, the memory budget and aborting failed uploads follow the
+    thread engine.
+    """
+    def __init__(self, bucket, prepare_part, prepare_file, client_factory,
+                 max_concurrency=DEFAULT_ASYNC_CONCURRENCY,
+                 multipart_threshold=multi_part_scheduler.DEFAULT_MULTIPART_THRESHOLD,
+                 budget=None, part_cost=None, checksum_algorithm=None, retry=None, cpu_workers=None,
+                 metadata=None, part_reader=True):
+        self.bucket = bucket
+        self.prepare_part = prepare_part
+        self.prepare_file = prepare_file
+        self.max_concurrency = max_concurrency
+        self.multipart_threshold = multipart_threshold
+        self.budget = budget or multi_part_memory.MemoryBudget()
+        self.part_cost = part_cost or (lambda length: length)
+        self.checksum_algorithm = checksum_algorithm
+        self.retry = retry
+        self.metadata = metadata
+        self.part_reader = part_reader
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.uploads = []
+        self._futures = []
+
+        self._cpu = ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count() or 4)
+        # Blocking budget waits get their own threads so they never hold up reads and encryption
+        self._waiters = ThreadPoolExecutor(max_workers=max(4, max_concurrency // 8))
+        self._open_files = threading.Semaphore(max_concurrency * 2)
+        self._runner = _LoopThread(client_factory)
+        self._requests = self._runner.submit(self._make_semaphore()).result()
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def submit_file(self, file_path, key, part_size, stat=None):
+        """
+        Queue a file for upload. Blocks while too many files are already open.
+        """
+        self._open_files.acquire()
+        try:
+            upload = multi_part_scheduler.FileUpload(file_path, key, part_size, self.multipart_threshold, stat=stat)
+        except Exception:
+            self._open_files.release()
+            raise
+        upload.retry_budget = self.retry.budget_for(upload.num_parts) if self.retry else 0
+        self.uploads.append(upload)
+        future = self._runner.submit(self._upload(upload))
+        future.add_done_callback(lambda _: self._open_files.release())
+        self._futures.append(future)
+        return upload
+
+    def join(self):
+        for future in self._futures:
+            future.result()
+        self._runner.stop()
+        self._cpu.shutdown(wait=True)
+        self._waiters.shutdown(wait=True)
+        return self.uploads
+
+    async def _upload(self, upload):
+        try:
+            if upload.single_request:
+                await self._send_whole_file(upload)
+            else:
+                await self._multipart(upload)
+        except Exception as e:
+            logging.error(f"Error uploading {upload.key}: {str(e)}")
+            upload.errors.append({"PartNumber": None, "Error": str(e)})
+            await self._abort(upload)
+        finally:
+            if upload.reader is not None:
+                upload.reader.close()
+            upload.done.set()
+
+    async def _request(self, part_number, upload, cost, send):
+        """
+        Run ``send`` under the in-flight limit and memory budget, retrying as the retry policy allows.
+        """
+        attempt = 1
+        while True:
+            try:
+                return await self._send_once(cost, send)
+            except Exception as e:
+                error = _error(part_number, e)
+                if (self.retry is None or upload.failed or not multi_part_retry.is_retryable(error)
+                        or attempt >= self.retry.max_attempts or upload.retries >= upload.retry_budget):
+                    raise
+                upload.retries += 1
+                delay = self.retry.delay(attempt)
+                logging.info(f"Retrying {upload.key} part {part_number} in {delay:.2f}s: {error['Error']}")
+                attempt += 1
+                # The backoff holds neither a request slot nor any of the memory budget
+                await asyncio.sleep(delay)
+
+    async def _send_once(self, cost, send):
+        loop = asyncio.get_running_loop()
+        async with self._requests:
+            charge = await loop.run_in_executor(self._waiters, self.budget.acquire, cost) if cost else 0
+            self._track_in_flight(1)
+            try:
+                return await send()
+            finally:
+                self._track_in_flight(-1)
+                if charge:
+                    self.budget.release(charge)
+
+    def _track_in_flight(self, delta):
+        self.in_flight += delta
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def _send_whole_file(self, upload):
+        loop = asyncio.get_running_loop()
+        s3 = self._runner.s3
+
+        async def send():
+            body, file_checksum = await loop.run_in_executor(
+                self._cpu, self.prepare_file, upload.file_path, upload.key, self.checksum_algorithm)
+            put_args = {'Bucket': self.bucket, 'Key': upload.key, 'Body': _request_body(body)}
+            if self.metadata:
+                put_args['Metadata'] = await loop.run_in_executor(self._cpu, self.metadata, upload)
+            if file_checksum:
+                put_args['ChecksumAlgorithm'] = self.checksum_algorithm
+                put_args[multi_part_checksum.field(self.checksum_algorithm)] = file_checksum
+            response = await s3.put_object(**put_args)
+            return response, file_checksum
+
+        response, file_checksum = await self._request(None, upload, self.part_cost(upload.file_size), send)
+        mismatch = file_checksum and multi_part_checksum.mismatch(self.checksum_algorithm, file_checksum, response)
+        if mismatch:
+            upload.errors.append({"PartNumber": None, "Error": mismatch})
+            return
+        upload.etag = response['ETag']
+
+    async def _multipart(self, upload):
+        s3 = self._runner.s3
+        create_args = {'Bucket': self.bucket, 'Key': upload.key}
+        if self.checksum_algorithm:
+            create_args['ChecksumAlgorithm'] = self.checksum_algorithm
+        if self.metadata:
+            # Deriving the key for the metadata may run PBKDF2, so it stays off the loop
+            create_args['Metadata'] = await asyncio.get_running_loop().run_in_executor(self._cpu, self.metadata, upload)
+
+        async def create():
+            return await s3.create_multipart_upload(**create_args)
+        response = await self._request(None, upload, 0, create)
+        upload.upload_id = response['UploadId']
+        if self.part_reader:
+            upload.reader = multi_part_reader.PartReader(upload.file_path)
+
+        await asyncio.gather(*(self._send_part(upload, part_number)
+                               for part_number in range(1, upload.num_parts + 1)))
+        if upload.failed:
+            await self._abort(upload)
+            return
+
+        parts = [upload.parts[number] for number in sorted(upload.parts)]
+
+        async def complete():
+            return await s3.complete_multipart_upload(Bucket=self.bucket, Key=upload.key,
+                                                      UploadId=upload.upload_id, MultipartUpload={"Parts": parts})
+        response = await self._request(None, upload, 0, complete)
+        upload.etag = response.get('ETag')
+        if self.checksum_algorithm:
+            mismatch = multi_part_checksum.verify_completed(self.checksum_algorithm, parts, response)
+            if mismatch:
+                upload.errors.append({"PartNumber": None, "Error": mismatch})
+        logging.info(f"Completed multipart upload of {upload.key}")
+
+    async def _send_part(self, upload, part_number):
+        if upload.failed:
+            # Another part already failed for good, so this one is skipped and the upload aborted
+            return
+        loop = asyncio.get_running_loop()
+        s3 = self._runner.s3
+        offset = upload.part_size * (part_number - 1)
+        length = min(upload.part_size, upload.file_size - offset)
+
+        async def send():
+            body, part_checksum = await loop.run_in_executor(
+                self._cpu, self.prepare_part, upload.file_path, upload.key, offset, length, upload.reader,
+                self.checksum_algorithm)
+            part_args = {'Bucket': self.bucket, 'Key': upload.key, 'UploadId': upload.upload_id,
+                         'PartNumber': part_number, 'Body': _request_body(body)}
+            part = {"PartNumber": part_number}
+            if part_checksum:
+                part_args['ChecksumAlgorithm'] = self.checksum_algorithm
+                part_args[multi_part_checksum.field(self.checksum_algorithm)] = part_checksum
+                part[multi_part_checksum.field(self.checksum_algorithm)] = part_checksum
+            started = time.monotonic()
+            response = await s3.upload_part(**part_args)
+            logging.debug(f"{upload.key} part {part_number} sent in {time.monotonic() - started:.3f}s")
+            part["ETag"] = response['ETag']
+            return part
+
+        try:
+            upload.parts[part_number] = await self._request(part_number, upload, self.part_cost(length), send)
+        except Exception as e:
+            upload.errors.append(_error(part_number, e))
+        finally:
+            if upload.reader is not None:
+                upload.reader.release(offset, length)
+
+    async def _abort(self, upload):
+        if upload.upload_id is None or upload.aborted or upload.etag is not None:
+            return
+        try:
+            await self._runner.s3.abort_multipart_upload(Bucket=self.bucket, Key=upload.key,
+                                                         UploadId=upload.upload_id)
+        except Exception as e:
+            logging.error(f"Could not abort the multipart upload of {upload.key}: {str(e)}")
+            return
+        upload.aborted = True
+        logging.info(f"Aborted multipart upload of {upload.key}")
+
+
+async def _get_range(s3, bucket, key, start, end, **kwargs):
+    response = await s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}", **kwargs)
+    async with response['Body'] as stream:
+        return await stream.read(), response
+
+
+async def _probe(s3, bucket, key, length):
+    # multi_part_ranged.probe() on the loop
+    try:
+        return await _get_range(s3, bucket, key, 0, length)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        response = await s3.get_object(Bucket=bucket, Key=key)
+        async with response['Body'] as stream:
+            return await stream.read(), response
+
+
+async def _each(function, items, workers):
+    """
+    Await ``function(item)`` for every item with at most ``workers`` of them running at
+    once. After a failure no further item starts, and the first error is raised once
+    those already running have finished.
+    """
+    items = iter(items)
+    errors = []
+
+    async def worker():
+        for item in items:
+            if errors:
+                return
+            try:
+                await function(item)
+            except Exception as e:
+                errors.append(e)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    if errors:
+        raise errors[0]
+
+
+async def _measured(concurrency, waiters, fetch):
+    # multi_part_ranged._measured() on the loop; waiting for a slot blocks one of ``waiters``, not the loop
+    await asyncio.get_running_loop().run_in_executor(waiters, concurrency.acquire)
+    started = time.monotonic()
+    try:
+        data = await fetch()
+    except Exception as e:
+        if multi_part_concurrency.is_throttle(e):
+            concurrency.throttled()
+        raise
+    finally:
+        concurrency.release()
+    concurrency.record(len(data), time.monotonic() - started)
+    return data
+
+
+async def _download(s3, bucket, key, local_path, requests, chunk_size, max_concurrency, first=None,
+                    concurrency=None, waiters=None):
+    loop = asyncio.get_running_loop()
+    if first is None:
+        async with requests:
+            first = await _probe(s3, bucket, key, chunk_size)
+    data, response = first
+    size = multi_part_ranged.total_size(response)
+    # Every range must come from the object version the probe did
+    conditions = {'IfMatch': response['ETag']} if response.get('ETag') else {}
+    target = multi_part_ranged.RangeFile(local_path, size, range(0, size, chunk_size),
+                                         multi_part_ranged.range_version(response, chunk_size))
+    try:
+        async def fetch_and_write(start):
+            end = min(start + chunk_size, size)
+            if end <= len(data):
+                chunk = data[start:end]
+            else:
+                async def fetch():
+                    async with requests:
+                        return (await _get_range(s3, bucket, key, start, end, **conditions))[0]
+                chunk = await (fetch() if concurrency is None else _measured(concurrency, waiters, fetch))
+            await loop.run_in_executor(None, target.write, start, start, chunk)
+
+        await _each(fetch_and_write, target.pending,
+                    max_concurrency if concurrency is None else concurrency.maximum)
+    except BaseException as e:
+        target.abandon(e)
+        raise
+    target.finish()
+    return size
+
+
+def download_objects(objects, bucket, client_factory, max_concurrency=DEFAULT_ASYNC_CONCURRENCY,
+                     chunk_size=DOWNLOAD_CHUNK_SIZE, probes=None, concurrency=None):
+    """
+    Download (key, local_path) pairs with ranged GETs from one event loop, into a
+    temporary file and journal as multi_part_ranged.write_ranges does, so an
+    interrupted download resumes. ``probes`` maps keys to a probe() already made of
+    them; the others are probed on the loop. With a ``concurrency`` (an
+    AdaptiveConcurrency) each range holds one of its slots and reports to it.
+
+    Returns {key: bytes written or the error message}.
+    """
+    probes = probes or {}
+    results = {}
+
+    async def main():
+        requests = asyncio.Semaphore(max_concurrency)
+        waiters = ThreadPoolExecutor(max_workers=concurrency.maximum) if concurrency is not None else None
+        try:
+            async with client_factory() as s3:
+                async def one(item):
+                    key, local_path = item
+                    try:
+                        results[key] = await _download(s3, bucket, key, local_path, requests, chunk_size,
+                                                       max_concurrency, probes.get(key), concurrency, waiters)
+                    except Exception as e:
+                        results[key] = str(e)
+                await _each(one, objects, max_concurrency)
+        finally:
+            if waiters is not None:
+                waiters.shutdown(wait=True)
+
+    asyncio.run(main())
+    return results
@@ -0,0 +1,86 @@
+import zlib
+import base64
+import hashlib
+
+try:
+    # CRC32C needs the AWS CRT bindings (pip install awscrt); the others are in the standard library
+    from awscrt import checksums as crt_checksums
+except ImportError:
+    crt_checksums = None
+
+DEFAULT_CHECKSUM_ALGORITHM = 'CRC32'
+
+
+def _crc32(data):
+    return zlib.crc32(data).to_bytes(4, 'big')
+
+
+def _crc32c(data):
+    return crt_checksums.crc32c(data).to_bytes(4, 'big')
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+ALGORITHMS = {'CRC32': _crc32, 'SHA256': _sha256}
+if crt_checksums is not None:
+    ALGORITHMS['CRC32C'] = _crc32c
+
+
+def check_algorithm(algorithm):
+    """
+    Normalise a --checksum value; None or 'none' turns checksums off.
+    """
+    if algorithm is None or algorithm.lower() == 'none':
+        return None
+    algorithm = algorithm.upper()
+    if algorithm not in ALGORITHMS:
+        if algorithm == 'CRC32C':
+            raise ValueError("CRC32C checksums need the awscrt package")
+        raise ValueError(f"Unsupported checksum algorithm {algorithm}")
+    return algorithm
+
+
+def field(algorithm):
+    """
+    Name of the request/response field S3 uses for an algorithm, e.g. 'ChecksumSHA256'.
+    """
+    return f"Checksum{algorithm}"
+
+
+def raw_checksum(algorithm, data):
+    return ALGORITHMS[algorithm](data)
+
+
+def checksum(algorithm, data):
+    """
+    Base64 checksum of a buffer, the form S3 expects in Checksum* fields.
+    """
+    return base64.b64encode(raw_checksum(algorithm, data)).decode('ascii')
+
+
+def composite_checksum(algorithm, part_checksums):
+    """
+    The checksum S3 reports for a completed multipart upload: the checksum of the
+    concatenated binary part checksums, suffixed with the part count.
+    """
+    joined = b''.join(base64.b64decode(value) for value in part_checksums)
+    return f"{checksum(algorithm, joined)}-{len(part_checksums)}"
+
+
+def mismatch(algorithm, expected, response):
+    """
+    Error message if the checksum S3 reports in a response differs from ``expected``, else None.
+    """
+    stored = response.get(field(algorithm))
+    if stored is not None and stored != expected:
+        return f"{algorithm} checksum mismatch: expected {expected}, S3 stored {stored}"
+    return None
+
+
+def verify_completed(algorithm, parts, response):
+    """
+    Check a CompleteMultipartUpload response against the checksums of the parts sent.
+    """
+    return mismatch(algorithm, composite_checksum(algorithm, [part[field(algorithm)] for part in parts]), response)
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+
+# Error codes S3 uses to ask clients to slow down
+THROTTLE_CODES = {'SlowDown', 'ServiceUnavailable', '503', 'RequestLimitExceeded', 'Throttling',
+                  'ThrottlingException', 'RequestThrottled'}
+
+DEFAULT_INITIAL_CONCURRENCY = 10
+DEFAULT_MAX_CONCURRENCY = 64
+
+# Throughput has to beat the previous window by this much to earn another worker
+IMPROVEMENT = 1.05
+# Per-request throughput falling below this fraction of the best seen counts as rising latency
+LATENCY_TOLERANCE = 0.5
+
+
+def is_throttle(error):
+    """
+    True for an error dict or exception that S3 raised to throttle us.
+    """
+    if isinstance(error, dict):
+        return error.get('Code') in THROTTLE_CODES or 'SlowDown' in str(error.get('Error', ''))
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of requests in flight.
+
+    Requests hold a slot between ``acquire`` and ``release`` and report what they
+    moved through ``record``. Once per window (one window is ``limit`` completed
+    requests) the limit goes up by one while aggregate throughput keeps improving. It
+    is halved when S3 throttles and cut by a quarter when latency rises without a
+    gain in throughput. With ``adaptive=False`` the limit stays at ``maximum``.
+    """
+    def __init__(self, initial=DEFAULT_INITIAL_CONCURRENCY, minimum=1, maximum=DEFAULT_MAX_CONCURRENCY,
+                 adaptive=True, name="transfer"):
+        self.adaptive = adaptive
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum) if adaptive else maximum
+        self.name = name
+        self.in_use = 0
+        self.decisions = []
+
+        self._condition = threading.Condition()
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_requests = 0
+        self._window_throttled = False
+        self._previous_throughput = None
+        self._best_request_rate = 0.0
+        self._window_request_rate = 0.0
+
+    def acquire(self):
+        with self._condition:
+            while self.in_use >= self.limit:
+                self._condition.wait()
+            self.in_use += 1
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    def record(self, nbytes, seconds):
+        """
+        Report a finished request that moved ``nbytes`` in ``seconds``.
+        """
+        if not self.adaptive:
+            return
+        with self._condition:
+            self._window_bytes += nbytes
+            self._window_requests += 1
+            if seconds > 0:
+                rate = nbytes / seconds
+                self._window_request_rate += rate
+                self._best_request_rate = max(self._best_request_rate, rate)
+            if self._window_requests >= self.limit:
+                self._end_window()
+
+    def throttled(self):
+        """
+        Report a 503/SlowDown. Backs off at once, at most once per window.
+        """
+        if not self.adaptive:
+            return
+        with self._condition:
+            if not self._window_throttled:
+                self._set_limit(self.limit // 2, "throttled by S3")
+                self._reset_window()
+                self._window_throttled = True
+
+    def _end_window(self):
+        elapsed = max(time.monotonic() - self._window_start, 1e-9)
+        throughput = self._window_bytes / elapsed
+        request_rate = self._window_request_rate / self._window_requests
+        previous = self._previous_throughput
+
+        if request_rate < self._best_request_rate * LATENCY_TOLERANCE and \
+                previous is not None and throughput <= previous * IMPROVEMENT:
+            self._set_limit(self.limit * 3 // 4, "latency rising without more throughput")
+        elif previous is None or throughput > previous * IMPROVEMENT:
+            self._set_limit(self.limit + 1, f"throughput {throughput / 1024 / 1024:.1f} MB/s improving")
+
+        self._previous_throughput = throughput
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_requests = 0
+        self._window_request_rate = 0.0
+        self._window_throttled = False
+
+    def _set_limit(self, limit, reason):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit != self.limit:
+            logging.info(f"{self.name} concurrency {self.limit} -> {limit}: {reason}")
+            self.decisions.append((self.limit, limit, reason))
+            self.limit = limit
+            self._condition.notify_all()
@@ -0,0 +1,187 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from dev import multi_part_hash
+from dev import multi_part_planner
+from dev import multi_part_state
+
+DEFAULT_HASH_CACHE = os.path.join(multi_part_state.STATE_DIR, '.hash_cache.json')
+
+# CopyObject handles sources up to 5 GiB; anything larger is copied part by part
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+
+
+class HashCache:
+    """
+    SHA-256 of local files, and the bucket objects known to hold each hash.
+
+    A file's hash is keyed by device, inode, size and mtime, so it is computed
+    once and only again after the file changes. The object index maps a hash to
+    the key and ETag of the object it was uploaded as.
+    """
+    def __init__(self, path=DEFAULT_HASH_CACHE):
+        self.path = path
+        self.hashes = {}
+        self.objects = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            self.hashes = data.get('hashes', {})
+            self.objects = data.get('objects', {})
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring unreadable hash cache {self.path}")
+        return self
+
+    def save(self):
+        # Written to a temporary file first so an interrupted save never leaves half a cache
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({'hashes': self.hashes, 'objects': self.objects}, file)
+        os.replace(temporary_path, self.path)
+
+    def hash_for(self, file_path, stat):
+        identity = f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = self.hashes.get(identity)
+        if digest is None:
+            digest = multi_part_hash.calculate_file_hash(file_path)
+            self.hashes[identity] = digest
+        return digest
+
+    def lookup(self, bucket, digest):
+        return self.objects.get(bucket, {}).get(digest)
+
+    def remember(self, bucket, digest, key, etag):
+        self.objects.setdefault(bucket, {})[digest] = {'key': key, 'etag': etag}
+
+    def forget(self, bucket, digest):
+        self.objects.get(bucket, {}).pop(digest, None)
+
+
+def existing_size(s3_client, bucket, entry):
+    """
+    Size of the indexed object if it is still in the bucket unchanged, else None.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket, Key=entry['key'])
+    except ClientError:
+        return None
+    if response.get('ETag') != entry['etag']:
+        return None
+    return response['ContentLength']
+
+
+def copy_object(s3_client, bucket, source_key, key, size, max_workers=10):
+    """
+    Create ``key`` as a server-side copy of ``source_key`` and return its ETag.
+
+    No object bytes pass through this machine. Sources over 5 GiB are copied with
+    UploadPartCopy ranges, which is the only way S3 copies objects that large.
+    Either way the copy keeps the source's metadata, which says how to decrypt it.
+    """
+    source = {'Bucket': bucket, 'Key': source_key}
+    if size <= MAX_COPY_OBJECT_SIZE:
+        response = s3_client.copy_object(Bucket=bucket, Key=key, CopySource=source)
+        return response['CopyObjectResult']['ETag']
+
+    part_size = multi_part_planner.plan_part_size(size)
+    # CopyObject carries metadata over by itself; a multipart copy has to be given it
+    metadata = s3_client.head_object(Bucket=bucket, Key=source_key).get('Metadata', {})
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, Metadata=metadata)['UploadId']
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = s3_client.upload_part_copy(Bucket=bucket, Key=key, UploadId=upload_id,
+                                              PartNumber=part_number, CopySource=source,
+                                              CopySourceRange=f"bytes={start}-{end}")
+        return {"PartNumber": part_number, "ETag": response['CopyPartResult']['ETag']}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(copy_part,
+                                      range(1, multi_part_planner.number_of_parts(size, part_size) + 1)))
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    response = s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                   MultipartUpload={"Parts": parts})
+    return response['ETag']
+
+
+class Deduplicator:
+    """
+    Decides, file by file, whether content has to be uploaded or can be copied.
+
+    The first file with a given hash is uploaded unless the bucket already holds
+    that content. Every other file with the same hash becomes a server-side copy
+    once its source exists. ``can_copy(key)`` says whether the client still has
+    the encryption key of an existing object, without which a copy is unreadable.
+    """
+    def __init__(self, s3_client, bucket, cache, can_copy=lambda key: True):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.cache = cache
+        self.can_copy = can_copy
+        self.digests = {}
+        self.first_upload = {}
+        self.copies = []
+
+    def route(self, file_path, key, stat):
+        """
+        Return True if the file has to be uploaded, False if it will be copied.
+        """
+        digest = self.cache.hash_for(file_path, stat)
+        self.digests[key] = digest
+
+        if digest in self.first_upload:
+            self.copies.append((key, self.first_upload[digest], None, digest))
+            return False
+
+        entry = self.cache.lookup(self.bucket, digest)
+        if entry and entry['key'] != key and self.can_copy(entry['key']):
+            size = existing_size(self.s3_client, self.bucket, entry)
+            if size is not None:
+                self.copies.append((key, entry['key'], size, digest))
+                return False
+            self.cache.forget(self.bucket, digest)
+
+        self.first_upload[digest] = key
+        return True
+
+    def uploaded(self, upload):
+        if not upload.failed and upload.etag:
+            self.cache.remember(self.bucket, self.digests[upload.key], upload.key, upload.etag)
+
+    def copy_all(self):
+        """
+        Make every pending copy. Returns a list of (key, source_key, error or None).
+        """
+        results = []
+        sizes = {}
+        for key, source_key, size, digest in self.copies:
+            entry = self.cache.lookup(self.bucket, digest)
+            if entry is None or entry['key'] != source_key:
+                results.append((key, source_key, "source was not uploaded"))
+                continue
+            try:
+                if size is None:
+                    # Uploaded in this run; its stored size includes the encryption overhead
+                    if source_key not in sizes:
+                        sizes[source_key] = existing_size(self.s3_client, self.bucket, entry)
+                    size = sizes[source_key]
+                if size is None:
+                    results.append((key, source_key, "source is no longer in the bucket"))
+                    continue
+                copy_object(self.s3_client, self.bucket, source_key, key, size)
+                results.append((key, source_key, None))
+            except Exception as e:
+                results.append((key, source_key, str(e)))
+        return results
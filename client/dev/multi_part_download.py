@@ -1,37 +1,25 @@
 import click
 import boto3
 import os
+import time
 import base64
-import json
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
 from cryptography.fernet import Fernet
-from click import prompt
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from dev import multi_part_async
+from dev import multi_part_concurrency
+from dev import multi_part_fetch
+from dev import multi_part_format
+from dev import multi_part_keystore
+from dev import multi_part_memory
+from dev import multi_part_ranged
 
 session = boto3.Session()
 s3 = session.resource('s3')
 
-# Dictionary to store encryption keys for each file
-encryption_keys = {}
-
-
-def load_encryption_keys():
-    try:
-        with open('encryption_keys.json', 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-
-def save_encryption_keys():
-    try:
-        with open('encryption_keys.json', 'w') as file:
-            keys_dict = {key: encryption_keys[key].decode('latin1') for key in encryption_keys}
-            json.dump(keys_dict, file)
-    except Exception as e:
-        print(f"Error saving encryption keys: {e}")
+# Shared by every download in this process so what one transfer learns carries to the next
+download_concurrency = multi_part_concurrency.AdaptiveConcurrency(name="download")
 
 
 def enable_encryption_at_rest(bucket_name):
@@ -132,35 +120,79 @@ def decrypt_data(data, encryption_key):
         return b''  # Return an empty byte string in case of decryption failure
 
 
-def download_file(bucket, file_name, local_directory, decryption_key_name):
-    try:
-        s3 = boto3.client('s3')
-
-        # Ensure the local directory exists
-        os.makedirs(local_directory, exist_ok=True)
+def decrypt_file(local_path, decryption_key, scheme=multi_part_format.FERNET_SCHEME):
+    """
+    Decrypt a downloaded object in place, streaming it a block at a time into a
+    temporary file that replaces it once the whole object has authenticated. Memory
+    use is the same for any size of object. ``scheme`` is the object's, from
+    multi_part_format.scheme_of().
+    """
+    # Older objects are one Fernet token rather than frames
+    decrypt = (multi_part_format.decrypt_stream if scheme == multi_part_format.SCHEME
+               else multi_part_format.decrypt_fernet_stream)
 
-        local_path = os.path.join(local_directory, file_name)
-
-        # Download the file from S3
-        s3.download_file(bucket, file_name, local_path)
+    temporary_path = local_path + '.decrypting'
+    try:
+        with open(local_path, 'rb') as source, open(temporary_path, 'wb') as destination:
+            decrypt(source, destination, decryption_key)
+        os.replace(temporary_path, local_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
 
-        # Check if the file is encrypted (using server-side encryption)
-        encryption_info = s3.head_object(Bucket=bucket, Key=file_name).get('ServerSideEncryption', None)
 
-        if encryption_info:
-            # Check if a decryption key is available
-            decryption_key = encryption_keys.get(decryption_key_name)
+def download_file(bucket, file_name, local_directory, decryption_key_name=None, concurrency=None, engine='threads',
+                  range_size=multi_part_ranged.DEFAULT_RANGE_SIZE):
+    keystore = multi_part_keystore.KeyStore()
+    try:
+        concurrency = concurrency or download_concurrency
+        range_size = multi_part_memory.parse_size(range_size)
+        # One pooled connection per range in flight, however high the limit climbs
+        s3 = boto3.client('s3', config=Config(max_pool_connections=max(10, concurrency.maximum)))
+
+        # Keys with '/' land in subdirectories; keys that would escape local_directory are refused
+        local_path = multi_part_fetch.local_path_for(local_directory, '', file_name)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        find_key = lambda metadata: keystore.key_for(bucket, decryption_key_name or file_name, metadata)
+
+        # Download the file from S3, with as many ranged requests as the controller allows; every
+        # range reports to it, so the limit adapts during the transfer.
+        # The first range's response also tells the object's size, ETag and metadata.
+        started = time.monotonic()
+        first = multi_part_ranged.probe(s3, bucket, file_name, range_size)
+        # Client-side encrypted objects come down as frame-aligned ranges, decrypted as they arrive
+        decrypted_size = multi_part_ranged.download_decrypted(s3, bucket, file_name, local_path, find_key,
+                                                              first=first, concurrency=concurrency)
+        if decrypted_size is None:
+            if engine == 'asyncio':
+                # Ranged GETs from one event loop instead of a thread each, starting from the probe
+                result = multi_part_async.download_objects([(file_name, local_path)], bucket,
+                                                           multi_part_async.default_client_factory(),
+                                                           chunk_size=range_size, probes={file_name: first},
+                                                           concurrency=concurrency)[file_name]
+                if isinstance(result, str):
+                    raise Exception(result)
+            else:
+                multi_part_ranged.download_ranges(s3, bucket, file_name, local_path, range_size=range_size,
+                                                  first=first, concurrency=concurrency)
+        elapsed = time.monotonic() - started
+        size = os.path.getsize(local_path)
+        click.echo(f"{multi_part_memory.format_size(size)} in {elapsed:.2f}s "
+                   f"({multi_part_memory.format_size(size / max(elapsed, 1e-6))}/s, "
+                   f"up to {concurrency.limit} ranges at once)")
+
+        if decrypted_size is not None:
+            click.echo(f"{file_name} downloaded and decrypted to {local_path} successfully.")
+            return
 
+        data, response = first
+        if multi_part_format.scheme_of(response.get('Metadata', {}), data) == multi_part_format.FERNET_SCHEME:
+            # Objects uploaded as Fernet tokens are still decrypted after the download
+            decryption_key = find_key({})
             if decryption_key:
                 try:
                     # Decrypt the downloaded file
-                    with open(local_path, 'rb') as file:
-                        encrypted_data = file.read()
-                        decrypted_data = decrypt_data(encrypted_data, decryption_key)
-
-                    # Write the decrypted data back to the local file
-                    with open(local_path, 'wb') as file:
-                        file.write(decrypted_data)
+                    decrypt_file(local_path, decryption_key)
 
                     click.echo(f"{file_name} downloaded and decrypted to {local_path} successfully.")
                 except Exception as e:
@@ -174,6 +206,8 @@ def download_file(bucket, file_name, local_directory, decryption_key_name):
         click.echo("Credentials not available. Please set up your AWS credentials.")
     except Exception as e:
         click.echo(f"An error occurred: {str(e)}")
+    finally:
+        keystore.close()
 
 
 def download_from_s3(bucket):
@@ -200,9 +234,9 @@ def download_from_s3(bucket):
 
         file_to_download = click.prompt("Enter the file name to download")
         local_directory = click.prompt("Enter the local directory to save the file")
-        decryption_key_name = click.prompt("Enter the name of the encryption key: ")
 
-        download_file(bucket, file_to_download, local_directory, decryption_key_name)
+        # The key is found from the object's own metadata, so there is nothing to ask for
+        download_file(bucket, file_to_download, local_directory)
 
     except NoCredentialsError:
         click.echo("Credentials not available. Please set up your AWS credentials.")
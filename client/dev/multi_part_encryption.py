@@ -0,0 +1,58 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from dev import multi_part_checksum
+
+
+def _ready(_):
+    return os.getpid()
+
+
+def _encrypt_range(encrypt, file_path, offset, length, key, checksum_algorithm):
+    """
+    Runs in a worker process. Reads the range itself, so plaintext never crosses
+    the process boundary, and checksums the ciphertext while it is still hot.
+    """
+    with open(file_path, 'rb') as file:
+        total_size = os.fstat(file.fileno()).st_size
+        file.seek(offset)
+        data = file.read() if length is None else file.read(length)
+    encrypted_data = encrypt(data, key, offset, total_size)
+    encrypted_checksum = multi_part_checksum.checksum(checksum_algorithm, encrypted_data) if checksum_algorithm else None
+    return encrypted_data, encrypted_checksum
+
+
+class EncryptionStage:
+    """
+    Process pool that encrypts parts away from the threads sending them.
+
+    Encryption is CPU bound and holds the GIL, so running it on the I/O threads
+    stalls every other request. Here each part is read and encrypted in a worker
+    process; the calling thread only waits (without the GIL) and gets ciphertext
+    back ready to send. Throughput grows with the number of workers, up to the
+    number of cores.
+
+    ``encrypt(data, key, offset, total_size) -> ciphertext`` must be a module-level
+    function so it can be sent to the workers. ``key`` is already derived; workers
+    never run the KDF.
+    """
+    def __init__(self, encrypt, workers=None):
+        self.encrypt = encrypt
+        self.workers = workers or os.cpu_count() or 1
+        # Fork where available so workers start fast and inherit the loaded modules
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        # Start every worker now, before the caller creates its I/O threads, so none is forked mid-request
+        self.worker_pids = set(self.executor.map(_ready, range(self.workers)))
+
+    def encrypt_range(self, file_path, offset, length, key, checksum_algorithm=None):
+        """
+        Encrypt ``length`` bytes at ``offset`` (the rest of the file when None).
+        Returns (ciphertext, checksum of the ciphertext or None).
+        """
+        return self.executor.submit(_encrypt_range, self.encrypt, file_path, offset, length,
+                                    key, checksum_algorithm).result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,214 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import click
+from botocore.config import Config
+from botocore.exceptions import NoCredentialsError
+
+from dev import multi_part_dedup
+from dev import multi_part_keystore
+from dev import multi_part_memory
+from dev import multi_part_ranged
+from dev import multi_part_sync
+
+DEFAULT_FETCH_CONCURRENCY = 64
+# Ranges of large objects fetched at once, shared by all of them; the pool above already keeps many objects in flight
+DEFAULT_RANGE_WORKERS = 16
+
+
+def iter_objects(s3_client, bucket, prefix=""):
+    """
+    Yield every object under a prefix as its listing page arrives, so downloads start
+    while the rest of a large prefix is still being listed.
+    """
+    prefix = (prefix or '').strip('/')
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/" if prefix else ""):
+        yield from page.get('Contents', [])
+
+
+def local_path_for(local_directory, prefix, key):
+    """
+    Where ``key`` goes under ``local_directory``: its path below the prefix. Keys that
+    would land outside the directory (``..``, absolute paths) are refused.
+    """
+    prefix = (prefix or '').strip('/')
+    relative = key[len(prefix):].lstrip('/') if prefix and key.startswith(prefix) else key
+    root = os.path.abspath(local_directory)
+    path = os.path.abspath(os.path.join(root, *relative.split('/')))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"Key {key} does not map to a file under {local_directory}")
+    return path
+
+
+def file_md5(file_path, block_size=65536):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def is_identical(s3_client, bucket, entry, local_path, manifest, hash_cache):
+    """
+    True when the local file already holds the object in listing ``entry``.
+
+    A file the manifest recorded with the same size, mtime and ETag is taken as
+    is. Otherwise the contents are compared: a plain object's single-part ETag is
+    the MD5 of its bytes, and an encrypted one records its plaintext size and
+    SHA-256 in its metadata (one HeadObject). Files that match are recorded, so
+    the next run needs only a stat.
+    """
+    try:
+        stat = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    if multi_part_sync.is_unchanged(stat, manifest.entries.get(entry['Key']), entry):
+        return True
+
+    etag = entry['ETag'].strip('"')
+    if stat.st_size == entry['Size'] and '-' not in etag:
+        identical = file_md5(local_path) == etag
+    else:
+        metadata = s3_client.head_object(Bucket=bucket, Key=entry['Key']).get('Metadata', {})
+        identical = (metadata.get('plaintext-size') == str(stat.st_size) and 'plaintext-sha256' in metadata
+                     and hash_cache.hash_for(local_path, stat) == metadata['plaintext-sha256'])
+    if identical:
+        manifest.record(entry['Key'], stat, entry['ETag'])
+    return identical
+
+
+class FetchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = 0
+        self.bytes = 0
+        self.decrypted = 0
+        self.skipped = 0
+        self.errors = []
+
+    def done(self, size, decrypted):
+        with self.lock:
+            self.objects += 1
+            self.bytes += size
+            self.decrypted += decrypted
+
+    def unchanged(self):
+        with self.lock:
+            self.skipped += 1
+
+    def failed(self, key, error):
+        with self.lock:
+            self.errors.append((key, error))
+
+
+def fetch_all(s3_client, bucket, prefix, local_directory, objects, find_key_for,
+              max_concurrency=DEFAULT_FETCH_CONCURRENCY, range_size=multi_part_ranged.DEFAULT_RANGE_SIZE,
+              range_workers=DEFAULT_RANGE_WORKERS, skip=None, downloaded=None):
+    """
+    Download ``objects`` (listing entries) on a pool of ``max_concurrency`` threads.
+    At most twice that many are queued at once, so a listing of millions of keys is
+    consumed as fast as it downloads rather than held in memory. The remaining ranges
+    of large objects go to one shared pool of ``range_workers`` threads, so at most
+    ``max_concurrency + range_workers`` GETs are in flight.
+
+    ``skip(entry, local_path)`` returning True leaves an object alone, and
+    ``downloaded(entry, local_path)`` is called after each download. Both run on
+    the worker threads.
+    """
+    stats = FetchStats()
+    slots = threading.Semaphore(max_concurrency * 2)
+    made_directories = set()
+    directories_lock = threading.Lock()
+
+    def fetch(entry):
+        key = entry['Key']
+        try:
+            local_path = local_path_for(local_directory, prefix, key)
+            directory = os.path.dirname(local_path)
+            with directories_lock:
+                if directory not in made_directories:
+                    os.makedirs(directory, exist_ok=True)
+                    made_directories.add(directory)
+            if skip is not None and skip(entry, local_path):
+                stats.unchanged()
+                return
+            size, decrypted = multi_part_ranged.fetch_object(s3_client, bucket, key, local_path, find_key_for(key),
+                                                             range_size=range_size, executor=ranges)
+            if downloaded is not None:
+                downloaded(entry, local_path)
+            stats.done(size, decrypted)
+        except Exception as e:
+            stats.failed(key, str(e))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=range_workers) as ranges, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for entry in objects:
+            # Keys ending in '/' are folder markers; the folders are made for the files inside them
+            if entry['Key'].endswith('/'):
+                continue
+            slots.acquire()
+            executor.submit(fetch, entry)
+    return stats
+
+
+def download_prefix(bucket, prefix, local_directory, max_concurrency=DEFAULT_FETCH_CONCURRENCY,
+                    range_size=multi_part_ranged.DEFAULT_RANGE_SIZE, sync=False):
+    """
+    Download every object under ``prefix`` into ``local_directory``, recreating the key
+    hierarchy below the prefix. Encrypted objects are decrypted with their stored keys.
+
+    With ``sync``, objects the local files already match are skipped (see
+    is_identical). The sync manifest is the one the upload-side sync keeps for the
+    same folder and prefix, so files either side transferred are known to both.
+    """
+    keystore = multi_part_keystore.KeyStore()
+    manifest = multi_part_sync.SyncManifest(bucket, prefix, local_directory).load() if sync else None
+    hash_cache = multi_part_dedup.HashCache().load() if sync else None
+    try:
+        # Every worker shares one client, with a connection for each object and range thread
+        s3 = boto3.client('s3', config=Config(max_pool_connections=max_concurrency + DEFAULT_RANGE_WORKERS))
+        os.makedirs(local_directory, exist_ok=True)
+
+        def find_key_for(key):
+            return lambda metadata: keystore.key_for(bucket, key, metadata)
+
+        skip = downloaded = None
+        if sync:
+            skip = lambda entry, local_path: is_identical(s3, bucket, entry, local_path, manifest, hash_cache)
+            downloaded = lambda entry, local_path: manifest.record(entry['Key'], os.stat(local_path), entry['ETag'])
+
+        started = time.monotonic()
+        try:
+            stats = fetch_all(s3, bucket, prefix, local_directory, iter_objects(s3, bucket, prefix), find_key_for,
+                              max_concurrency=max_concurrency, range_size=multi_part_memory.parse_size(range_size),
+                              skip=skip, downloaded=downloaded)
+        finally:
+            # What did arrive is kept even if the listing failed part way
+            if sync:
+                manifest.save()
+                hash_cache.save()
+        elapsed = max(time.monotonic() - started, 1e-6)
+
+        for key, error in stats.errors:
+            click.echo(f"Error downloading {key}: {error}")
+        click.echo(f"Downloaded {stats.objects} objects ({multi_part_memory.format_size(stats.bytes)}, "
+                   f"{stats.decrypted} decrypted) from {bucket}/{prefix} to {local_directory} in {elapsed:.2f}s: "
+                   f"{stats.objects / elapsed:.0f} objects/s, {multi_part_memory.format_size(stats.bytes / elapsed)}/s")
+        if sync:
+            click.echo(f"{stats.skipped} objects were already up to date.")
+        if stats.errors:
+            raise Exception(f"{len(stats.errors)} objects failed to download.")
+        return stats
+    except NoCredentialsError:
+        click.echo("Credentials not available. Please set up your AWS credentials.")
+    except Exception as e:
+        click.echo(f"An error occurred: {str(e)}")
+    finally:
+        keystore.close()
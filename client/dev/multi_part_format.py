@@ -0,0 +1,294 @@
+import base64
+import os
+import struct
+
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.hazmat.primitives import hashes, hmac, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Object layout, version 1:
+#   header  magic 'S3CE', version, chunk size
+#   frames  nonce (12) + AES-256-GCM ciphertext of one chunk + tag (16), one per chunk
+# Every chunk but the last holds exactly chunk size bytes of plaintext, so the frame for
+# any plaintext offset is found by arithmetic and a byte range decrypts on its own.
+# The header, the chunk index and a last-chunk flag are bound into each tag, so frames
+# cannot be reordered, moved between objects of another chunk size, or cut off.
+MAGIC = b'S3CE'
+VERSION = 1
+# Recorded in object metadata as x-amz-meta-encryption
+SCHEME = 'aes256gcm-chunked-v1'
+DEFAULT_CHUNK_SIZE = 64 * 1024
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+_HEADER = struct.Struct('>4sBI')
+_CHUNK_AAD = struct.Struct('>QB')
+HEADER_SIZE = _HEADER.size
+
+# Objects uploaded before this format are one Fernet token: base64url of
+# version (0x80), timestamp (8), IV (16), AES-128-CBC ciphertext, HMAC-SHA256 (32)
+_FERNET_VERSION = 0x80
+_FERNET_HEADER_SIZE = 25
+_FERNET_HMAC_SIZE = 32
+# Never recorded in metadata; names what scheme_of() recognises a legacy token as
+FERNET_SCHEME = 'fernet'
+# The version byte and a timestamp's high bytes, base64url-encoded
+_FERNET_PREFIX = b'gAAAAA'
+
+
+class FormatError(ValueError):
+    pass
+
+
+def aead(key):
+    """
+    AES-256-GCM cipher for a stored file key (the urlsafe base64 of 32 derived bytes).
+    """
+    return AESGCM(base64.urlsafe_b64decode(key))
+
+
+def header(chunk_size=DEFAULT_CHUNK_SIZE):
+    return _HEADER.pack(MAGIC, VERSION, chunk_size)
+
+
+def is_framed(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def scheme_of(metadata, data):
+    """
+    How an object is encrypted, or None when it is not. x-amz-meta-encryption decides
+    when the object has it; only objects uploaded before it was recorded are recognised
+    by their first bytes ``data``, as the chunked format or a Fernet token.
+    """
+    if 'encryption' in metadata:
+        return metadata['encryption']
+    if is_framed(data):
+        return SCHEME
+    if bytes(data[:len(_FERNET_PREFIX)]) == _FERNET_PREFIX:
+        return FERNET_SCHEME
+    return None
+
+
+def parse_header(data):
+    """
+    Chunk size from an object's first HEADER_SIZE bytes.
+    """
+    if len(data) < HEADER_SIZE or not is_framed(data):
+        raise FormatError("Not an encrypted object")
+    magic, version, chunk_size = _HEADER.unpack(bytes(data[:HEADER_SIZE]))
+    if version != VERSION:
+        raise FormatError(f"Unsupported format version {version}")
+    return chunk_size
+
+
+def chunk_count(plaintext_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    # An empty file still gets one (empty) last chunk, so its emptiness is authenticated
+    return max(1, -(-plaintext_size // chunk_size))
+
+
+def frame_size(chunk_size):
+    return NONCE_SIZE + chunk_size + TAG_SIZE
+
+
+def encrypted_size(plaintext_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    return HEADER_SIZE + plaintext_size + chunk_count(plaintext_size, chunk_size) * (NONCE_SIZE + TAG_SIZE)
+
+
+def plaintext_size(size, chunk_size):
+    frames = -(-(size - HEADER_SIZE) // frame_size(chunk_size))
+    return size - HEADER_SIZE - max(frames, 1) * (NONCE_SIZE + TAG_SIZE)
+
+
+def _aad(head, index, last):
+    return head + _CHUNK_AAD.pack(index, last)
+
+
+def seal(cipher, head, index, last, chunk):
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, chunk, _aad(head, index, last))
+
+
+def open_frame(cipher, head, index, last, frame):
+    try:
+        return cipher.decrypt(frame[:NONCE_SIZE], frame[NONCE_SIZE:], _aad(head, index, last))
+    except InvalidTag:
+        raise FormatError(f"Chunk {index} failed authentication; the object is corrupt, truncated "
+                          f"or the key is wrong")
+
+
+def encrypt_range(data, key, offset, total_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Encrypt the plaintext at ``offset`` of a ``total_size`` byte file. Parts are encrypted
+    independently, so ``offset`` must fall on a chunk boundary; the part at offset 0
+    carries the header. Concatenating every part in order gives the whole object.
+    """
+    if offset % chunk_size:
+        raise ValueError(f"Offset {offset} is not a multiple of the {chunk_size} byte chunk size")
+    cipher = aead(key)
+    head = header(chunk_size)
+    view = memoryview(data)
+    first = offset // chunk_size
+    last = chunk_count(total_size, chunk_size) - 1
+    frames = [head] if offset == 0 else []
+    for start in range(0, max(len(view), 1), chunk_size):
+        index = first + start // chunk_size
+        frames.append(seal(cipher, head, index, index == last, view[start:start + chunk_size]))
+    return b''.join(frames)
+
+
+def ciphertext_range(start, end, chunk_size):
+    """
+    (first chunk index, first byte, end byte) of the frames holding plaintext [start, end).
+    """
+    first = start // chunk_size
+    last = max(first, -(-end // chunk_size) - 1)
+    size = frame_size(chunk_size)
+    return first, HEADER_SIZE + first * size, HEADER_SIZE + (last + 1) * size
+
+
+def decrypt_frames(data, key, head, first_index, last_index):
+    """
+    Decrypt a run of whole frames starting with chunk ``first_index`` of an object
+    whose final chunk is ``last_index``.
+    """
+    cipher = aead(key)
+    size = frame_size(parse_header(head))
+    view = memoryview(data)
+    chunks = []
+    for position in range(0, len(view), size):
+        index = first_index + position // size
+        chunks.append(open_frame(cipher, head, index, index == last_index, view[position:position + size]))
+    return b''.join(chunks)
+
+
+def decrypt_range(fetch, key, start, end, size):
+    """
+    Plaintext [start, end) of an object of ``size`` encrypted bytes, reading only the header
+    and the frames covering the range. ``fetch(first_byte, end_byte)`` returns those bytes,
+    e.g. with a ranged GET.
+    """
+    head = bytes(fetch(0, HEADER_SIZE))
+    chunk_size = parse_header(head)
+    end = min(end, plaintext_size(size, chunk_size))
+    if start >= end:
+        return b''
+    first, byte_start, byte_end = ciphertext_range(start, end, chunk_size)
+    last = chunk_count(plaintext_size(size, chunk_size), chunk_size) - 1
+    plaintext = decrypt_frames(fetch(byte_start, min(byte_end, size)), key, head, first, last)
+    skip = start - first * chunk_size
+    return plaintext[skip:skip + end - start]
+
+
+def read_full(source, size):
+    # Network bodies may return short reads; keep reading until size bytes or the end
+    data = source.read(size)
+    while data and len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def encrypt_stream(source, destination, key, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Encrypt a file object into another, holding two chunks at a time.
+    """
+    cipher = aead(key)
+    head = header(chunk_size)
+    destination.write(head)
+    index = 0
+    chunk = read_full(source, chunk_size)
+    while True:
+        following = read_full(source, chunk_size)
+        destination.write(seal(cipher, head, index, not following, chunk))
+        if not following:
+            return
+        chunk, index = following, index + 1
+
+
+def decrypt_stream(source, destination, key):
+    """
+    Decrypt a framed object read from ``source`` into ``destination``, one frame at a time.
+    Returns the number of plaintext bytes written.
+    """
+    cipher = aead(key)
+    head = read_full(source, HEADER_SIZE)
+    size = frame_size(parse_header(head))
+    written = 0
+    index = 0
+    frame = read_full(source, size)
+    while True:
+        following = read_full(source, size)
+        chunk = open_frame(cipher, head, index, not following, frame)
+        destination.write(chunk)
+        written += len(chunk)
+        if not following:
+            return written
+        frame, index = following, index + 1
+
+
+def _fernet_body(source, block_size, tail):
+    # Decoded token bytes, a block at a time, all but the HMAC at the end, which is left in tail
+    source.seek(0)
+    held = b''
+    while True:
+        text = read_full(source, block_size)
+        if not text:
+            break
+        held += base64.urlsafe_b64decode(text)
+        if len(held) > _FERNET_HMAC_SIZE:
+            yield held[:-_FERNET_HMAC_SIZE]
+            held = held[-_FERNET_HMAC_SIZE:]
+    tail.append(held)
+
+
+def decrypt_fernet_stream(source, destination, key, block_size=DEFAULT_CHUNK_SIZE):
+    """
+    Decrypt a single-token Fernet object from a seekable ``source`` into ``destination``
+    without holding it in memory: one pass checks the token's HMAC, a second decrypts.
+    Writes what Fernet(key).decrypt() would return and returns its length.
+    """
+    # Whole base64 quanta, so every block decodes on its own
+    block_size -= block_size % 4
+    raw_key = base64.urlsafe_b64decode(key)
+    signing_key, encryption_key = raw_key[:16], raw_key[16:]
+
+    signature = hmac.HMAC(signing_key, hashes.SHA256())
+    tail = []
+    signed = 0
+    for block in _fernet_body(source, block_size, tail):
+        signature.update(block)
+        signed += len(block)
+    if signed < _FERNET_HEADER_SIZE or len(tail[0]) != _FERNET_HMAC_SIZE:
+        raise FormatError("Truncated Fernet token")
+    try:
+        signature.verify(tail[0])
+    except InvalidSignature:
+        raise FormatError("Fernet token failed authentication; the object is corrupt or the key is wrong")
+
+    # Authenticated, so plaintext can now be released as it is decrypted
+    head = b''
+    decryptor = None
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    written = 0
+    for block in _fernet_body(source, block_size, []):
+        if decryptor is None:
+            head += block
+            if len(head) < _FERNET_HEADER_SIZE:
+                continue
+            if head[0] != _FERNET_VERSION:
+                raise FormatError(f"Unsupported Fernet version {head[0]}")
+            decryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(head[9:25])).decryptor()
+            block = head[_FERNET_HEADER_SIZE:]
+        chunk = unpadder.update(decryptor.update(block))
+        destination.write(chunk)
+        written += len(chunk)
+    try:
+        chunk = unpadder.update(decryptor.finalize()) + unpadder.finalize()
+    except ValueError:
+        raise FormatError("Fernet token has invalid padding")
+    destination.write(chunk)
+    return written + len(chunk)
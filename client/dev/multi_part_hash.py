@@ -22,11 +22,12 @@ def calculate_file_hash(file_path, block_size=65536):
             sha256.update(block)
     return sha256.hexdigest()
 
-# Example usage:
-file_path = r"D:\multipart_upload\client\client.py"
+if __name__ == '__main__':
+    # Example usage:
+    file_path = r"D:\multipart_upload\client\client.py"
 
-try:
-    hash_value = calculate_file_hash(file_path)
-    print(f"SHA-256 hash of {file_path}: {hash_value}")
-except Exception as e:
-    print(f"Error calculating hash: {e}")
+    try:
+        hash_value = calculate_file_hash(file_path)
+        print(f"SHA-256 hash of {file_path}: {hash_value}")
+    except Exception as e:
+        print(f"Error calculating hash: {e}")
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from dev import multi_part_state
+
+DEFAULT_JOURNAL_DIR = os.path.join(multi_part_state.STATE_DIR, '.upload_journal')
+
+
+class UploadJournal:
+    """
+    On-disk record of in-progress multipart uploads.
+
+    Each file gets its own JSON-lines journal. The first line holds the upload ID,
+    part size, the file's size and mtime, and the key-id of the key its parts are
+    encrypted with. Every later line is one {"PartNumber", "ETag"} result appended
+    as soon as that part finishes.
+    """
+    def __init__(self, directory=DEFAULT_JOURNAL_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, bucket, key):
+        digest = hashlib.sha256(f"{bucket}/{key}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.jsonl")
+
+    def start(self, bucket, upload, checksum_algorithm=None, key_id=None):
+        """
+        Begin a fresh journal for an upload that has just been created.
+        """
+        header = {
+            'bucket': bucket,
+            'key': upload.key,
+            'file_path': os.path.abspath(upload.file_path),
+            'file_size': upload.file_size,
+            'mtime_ns': upload.mtime_ns,
+            'upload_id': upload.upload_id,
+            'part_size': upload.part_size,
+            'checksum_algorithm': checksum_algorithm,
+            'key_id': key_id,
+        }
+        with self._lock:
+            with open(self.path_for(bucket, upload.key), 'w') as file:
+                file.write(json.dumps(header) + '\n')
+
+    def record_part(self, bucket, key, part):
+        with self._lock:
+            with open(self.path_for(bucket, key), 'a') as file:
+                file.write(json.dumps({'PartNumber': part['PartNumber'], 'ETag': part['ETag']}) + '\n')
+
+    def load(self, bucket, key):
+        """
+        Return (header, {part_number: etag}) for a journaled upload, or None.
+        """
+        try:
+            with open(self.path_for(bucket, key), 'r') as file:
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            return None
+
+        parts = {}
+        for line in lines[1:]:
+            try:
+                part = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave the last line half written
+                logging.warning(f"Ignoring truncated journal line for {key}")
+                continue
+            parts[part['PartNumber']] = part['ETag']
+        return header, parts
+
+    def remove(self, bucket, key):
+        with self._lock:
+            try:
+                os.remove(self.path_for(bucket, key))
+            except FileNotFoundError:
+                pass
+
+
+class DownloadJournal:
+    """
+    Sidecar record of the ranges already written into a partial download.
+
+    The journal sits next to the temporary file, named after it. The first line
+    identifies what is being downloaded (the object's ETag, its size and how it is
+    split into ranges); every later line is {"offset"} of one range already on disk.
+    """
+    def __init__(self, temporary_path):
+        self.path = temporary_path + '.journal'
+        self._lock = threading.Lock()
+
+    def start(self, version):
+        with self._lock:
+            with open(self.path, 'w') as file:
+                file.write(json.dumps(version) + '\n')
+
+    def record(self, offset):
+        with self._lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps({'offset': offset}) + '\n')
+
+    def load(self, version):
+        """
+        Offsets already written for ``version``, or None when the journal is missing
+        or was written for another version of the object.
+        """
+        try:
+            with open(self.path, 'r') as file:
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if json.loads(lines[0]) != version:
+                return None
+        except (IndexError, json.JSONDecodeError):
+            return None
+
+        offsets = set()
+        for line in lines[1:]:
+            try:
+                offsets.add(json.loads(line)['offset'])
+            except json.JSONDecodeError:
+                # A crash can leave the last line half written
+                logging.warning(f"Ignoring truncated journal line in {self.path}")
+        return offsets
+
+    def remove(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
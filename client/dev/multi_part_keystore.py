@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dev import multi_part_state
+
+DEFAULT_KEYSTORE_PATH = os.path.join(multi_part_state.STATE_DIR, 'encryption_keys.db')
+LEGACY_KEYS_PATH = os.path.join(multi_part_state.STATE_DIR, 'encryption_keys.json')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS encryption_keys (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    encryption_key BLOB NOT NULL,
+    created REAL NOT NULL,
+    key_id TEXT,
+    PRIMARY KEY (bucket, key, version)
+)
+"""
+
+
+def key_id(encryption_key):
+    """
+    Public name for a key, stored in object metadata so a download can find its key
+    without being told the object's name. A hash, so it reveals nothing about the key.
+    """
+    return hashlib.sha256(b'key-id:' + bytes(encryption_key)).hexdigest()[:32]
+
+
+class KeyStore:
+    """
+    Encryption keys in SQLite, one row per bucket, object key and version.
+
+    Rows are inserted as uploads finish and looked up one at a time, so a store with
+    hundreds of thousands of keys is never read or rewritten whole. The database runs
+    in WAL mode: readers never block, and a writer in another CLI process waits for
+    the lock (up to ``timeout`` seconds) instead of overwriting its keys.
+
+    ``version`` is the object's ETag when known. Lookups without a version, or for a
+    version that was never recorded, return the newest key for the object. Keys
+    imported from encryption_keys.json have no bucket and match any bucket.
+    """
+    def __init__(self, path=DEFAULT_KEYSTORE_PATH, timeout=30, legacy_path=LEGACY_KEYS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(_SCHEMA)
+        self._add_key_ids()
+        self.connection.execute("CREATE INDEX IF NOT EXISTS encryption_keys_by_id ON encryption_keys (key_id)")
+        if legacy_path and os.path.exists(legacy_path) and self.count() == 0:
+            self.import_json(legacy_path)
+
+    def put_many(self, bucket, entries):
+        """
+        Store (key, encryption_key, version) entries in one transaction.
+        """
+        now = time.time()
+        rows = [(bucket, key, version or '', bytes(encryption_key), now, key_id(encryption_key))
+                for key, encryption_key, version in entries]
+        if not rows:
+            return
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO encryption_keys VALUES (?, ?, ?, ?, ?, ?)", rows)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def put(self, bucket, key, encryption_key, version=None):
+        self.put_many(bucket, [(key, encryption_key, version)])
+
+    def get(self, bucket, key, version=None):
+        """
+        Key for an object, or None.
+        """
+        with self.lock:
+            if version:
+                row = self.connection.execute(
+                    "SELECT encryption_key FROM encryption_keys WHERE bucket = ? AND key = ? AND version = ?",
+                    (bucket, key, version)).fetchone()
+                if row:
+                    return bytes(row[0])
+            row = self.connection.execute(
+                "SELECT encryption_key FROM encryption_keys WHERE bucket IN (?, '') AND key = ? "
+                "ORDER BY bucket DESC, created DESC LIMIT 1", (bucket, key)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_by_id(self, encryption_key_id):
+        """
+        Key whose key_id() is ``encryption_key_id``, or None.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT encryption_key FROM encryption_keys WHERE key_id = ? LIMIT 1",
+                                          (encryption_key_id,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def key_for(self, bucket, key, metadata):
+        """
+        Key for an object from its x-amz-meta-* values: the key its key-id names, or for
+        objects uploaded without one, the newest key stored under the object's name.
+        """
+        if metadata.get('key-id'):
+            encryption_key = self.get_by_id(metadata['key-id'])
+            if encryption_key:
+                return encryption_key
+        return self.get(bucket, key)
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM encryption_keys").fetchone()[0]
+
+    def _add_key_ids(self):
+        # Stores created before key IDs were recorded get the column and their IDs filled in
+        if 'key_id' in self._columns():
+            return
+        with self.lock:
+            # Checked inside the write transaction so two processes cannot both add the column
+            self.connection.execute("BEGIN IMMEDIATE")
+            if 'key_id' not in self._columns():
+                self.connection.execute("ALTER TABLE encryption_keys ADD COLUMN key_id TEXT")
+                rows = self.connection.execute("SELECT rowid, encryption_key FROM encryption_keys").fetchall()
+                self.connection.executemany("UPDATE encryption_keys SET key_id = ? WHERE rowid = ?",
+                                            [(key_id(encryption_key), rowid) for rowid, encryption_key in rows])
+            self.connection.execute("COMMIT")
+
+    def _columns(self):
+        return [row[1] for row in self.connection.execute("PRAGMA table_info(encryption_keys)")]
+
+    def import_json(self, path):
+        """
+        Bring in keys from the old encryption_keys.json, which did not record the bucket.
+        """
+        try:
+            with open(path, 'r') as file:
+                keys = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+        self.put_many('', [(key, value.encode('latin1'), None) for key, value in keys.items()])
+        return len(keys)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,59 @@
+import re
+import threading
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """
+    Turn a size such as '512M', '2G' or '1048576' into a number of bytes.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class MemoryBudget:
+    """
+    Hard limit on the bytes buffered by parts that are being read, encrypted or sent.
+
+    ``acquire`` blocks until enough of the budget is free, which holds back reading
+    and encryption whenever the network stage falls behind. A limit of None never
+    blocks but still tracks the high-water mark.
+    """
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.in_use = 0
+        self.high_water = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """
+        Reserve ``size`` bytes and return the amount actually charged. A single
+        request larger than the whole budget is charged the full budget so it
+        can still run, alone.
+        """
+        if self.limit is not None:
+            size = min(size, self.limit)
+        with self._condition:
+            while self.limit is not None and self.in_use + size > self.limit:
+                self._condition.wait()
+            self.in_use += size
+            self.high_water = max(self.high_water, self.in_use)
+        return size
+
+    def release(self, size):
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
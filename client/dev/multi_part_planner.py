@@ -0,0 +1,74 @@
+import click
+from tabulate import tabulate
+
+from dev import multi_part_format
+from dev import multi_part_memory
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_OBJECT_SIZE = 5 * 1024 ** 4
+
+# Enough parts per file to keep the pool busy without drowning it in tiny requests
+DEFAULT_TARGET_PARTS = 16
+
+# Parts are rounded to whole MiB so they line up with encryption chunk boundaries
+PART_SIZE_ALIGNMENT = 1024 * 1024
+
+
+def _largest_plaintext_part():
+    # The cap applies to what is sent: an encrypted part gains a nonce and tag per chunk, and the first the header
+    size = MAX_PART_SIZE
+    while multi_part_format.encrypted_size(size) > MAX_PART_SIZE:
+        size -= PART_SIZE_ALIGNMENT
+    return size
+
+
+# Largest plaintext part whose ciphertext still fits in one S3 part
+MAX_PLAINTEXT_PART_SIZE = _largest_plaintext_part()
+
+
+def _round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+def plan_part_size(file_size, target_parts=None, part_size=None):
+    """
+    Choose a part size for one file.
+
+    Aims for ``target_parts`` parts, or honours a requested ``part_size``, then
+    clamps the result between 5 MiB and the largest part that is under 5 GiB once
+    encrypted, and grows it until the file fits in 10,000 parts.
+    """
+    if file_size > MAX_OBJECT_SIZE:
+        raise ValueError(f"{file_size} bytes exceeds the 5 TiB S3 object size limit")
+
+    if part_size is None:
+        part_size = -(-file_size // (target_parts or DEFAULT_TARGET_PARTS))
+    part_size = _round_up(max(part_size, 1), PART_SIZE_ALIGNMENT)
+
+    # The 10,000 part cap wins over everything except the 5 GiB ceiling
+    smallest_allowed = _round_up(-(-file_size // MAX_PARTS), PART_SIZE_ALIGNMENT)
+    return min(max(part_size, MIN_PART_SIZE, smallest_allowed), MAX_PLAINTEXT_PART_SIZE)
+
+
+def number_of_parts(file_size, part_size):
+    return max(1, -(-file_size // part_size))
+
+
+def show_plan(plans, multipart_threshold):
+    """
+    Print the plan for a list of (key, file_size, part_size) without uploading.
+    """
+    table_data = []
+    for index, (key, file_size, part_size) in enumerate(plans, start=1):
+        if file_size < multipart_threshold or file_size == 0:
+            table_data.append([str(index), key, multi_part_memory.format_size(file_size), "PutObject", "-", "1"])
+        else:
+            table_data.append([str(index), key, multi_part_memory.format_size(file_size), "Multipart",
+                               multi_part_memory.format_size(part_size),
+                               str(number_of_parts(file_size, part_size))])
+
+    headers = ["S.No", "File Name", "Size", "Method", "Part Size", "Parts"]
+    click.echo(tabulate(table_data, headers=headers, tablefmt="grid"))
@@ -0,0 +1,293 @@
+import os
+import time
+import logging
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+from dev import multi_part_concurrency
+from dev import multi_part_format
+from dev import multi_part_journal
+
+# Encrypted ranges are whole frames so each decrypts on its own; 128 frames of 64 KiB is 8 MiB
+DEFAULT_FRAMES_PER_RANGE = 128
+DEFAULT_RANGE_CONCURRENCY = 16
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+
+
+def get_range(s3_client, bucket, key, start, end, **kwargs):
+    """
+    Bytes [start, end) of an object, with the GET response they came from.
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}", **kwargs)
+    return response['Body'].read(), response
+
+
+def probe(s3_client, bucket, key, length=DEFAULT_RANGE_SIZE):
+    """
+    GET the first ``length`` bytes of an object. The response also carries the size,
+    ETag and metadata, so no HeadObject is needed, and an object smaller than ``length``
+    arrives whole in this one request.
+    """
+    try:
+        return get_range(s3_client, bucket, key, 0, length)
+    except ClientError as e:
+        # S3 refuses any range of an empty object
+        if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read(), response
+
+
+def total_size(response):
+    # A ranged GET reports the whole object's size after the slash: 'bytes 0-8/12345'
+    content_range = response.get('ContentRange')
+    if content_range:
+        return int(content_range.rsplit('/', 1)[1])
+    return response['ContentLength']
+
+
+def preallocate(path, size):
+    """
+    Open ``path`` for positional writes, already extended to its final size.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            # Reserve the blocks now: a full disk fails here, not halfway through, and the file is not fragmented
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+    return fd
+
+
+class RangeFile:
+    """
+    The preallocated temporary file a download writes its ranges into, and the journal
+    that lets an interrupted one resume (see write_ranges). ``pending`` lists the offsets
+    still to fetch; ``write`` stores one, ``finish`` renames the file to ``local_path``
+    and ``abandon`` closes it after a failure, keeping it only if it can be resumed.
+    """
+    def __init__(self, local_path, size, offsets, version=None):
+        self.local_path = local_path
+        self.temporary_path = local_path + '.downloading'
+        offsets = list(offsets)
+        # A single range has nothing to resume
+        self.journal = multi_part_journal.DownloadJournal(self.temporary_path) if version and len(offsets) > 1 else None
+        done = self.journal.load(version) if self.journal is not None else None
+        if done is not None and os.path.exists(self.temporary_path) and os.path.getsize(self.temporary_path) == size:
+            self.fd = os.open(self.temporary_path, os.O_WRONLY)
+            logging.info(f"Resuming {local_path}: {len(done)} of {len(offsets)} ranges already downloaded")
+        else:
+            done = set()
+            self.fd = preallocate(self.temporary_path, size)
+            if self.journal is not None:
+                self.journal.start(version)
+        self.pending = [offset for offset in offsets if offset not in done]
+
+    def write(self, offset, position, data):
+        os.pwrite(self.fd, data, position)
+        if self.journal is not None:
+            # The range must be on disk before the journal says it is
+            _sync(self.fd)
+            self.journal.record(offset)
+
+    def finish(self):
+        os.close(self.fd)
+        os.replace(self.temporary_path, self.local_path)
+        if self.journal is not None:
+            self.journal.remove()
+
+    def abandon(self, error):
+        os.close(self.fd)
+        # Ranges that failed authentication are not worth keeping; anything else can be resumed
+        if self.journal is None or isinstance(error, multi_part_format.FormatError):
+            os.remove(self.temporary_path)
+            if self.journal is not None:
+                self.journal.remove()
+
+
+def write_ranges(local_path, size, offsets, fetch, max_concurrency, version=None, executor=None, concurrency=None):
+    """
+    Run ``fetch(offset) -> (write offset, data)`` for every offset on a thread pool, writing
+    each result into a preallocated temporary file that replaces ``local_path`` once all
+    have succeeded. The pool is ``executor`` when one is given, so downloads running side
+    by side can share a bound on their ranges, and otherwise ``max_concurrency`` threads.
+
+    With a ``concurrency`` (an AdaptiveConcurrency), each fetch holds one of its slots and
+    reports its throughput or throttling, so the limit adapts during the transfer; the
+    pool then has a thread for every slot up to its maximum.
+
+    Without a ``version`` a failed run leaves no partial file behind. With one (a dict
+    naming the object's ETag and how it is split into ranges), an interrupted run keeps
+    its temporary file and a journal of the ranges in it, and the next run for the same
+    version fetches only the missing ranges. A journal for any other version, e.g. after
+    the object was overwritten, is discarded and the download starts over.
+    """
+    target = RangeFile(local_path, size, offsets, version)
+    try:
+        def fetch_and_write(offset):
+            position, data = fetch(offset) if concurrency is None else _measured(concurrency, fetch, offset)
+            target.write(offset, position, data)
+
+        pending = target.pending
+        if len(pending) == 1:
+            # Small objects, usually already in hand from the probe, skip starting a pool
+            fetch_and_write(pending[0])
+        elif executor is not None:
+            _run_all(executor, fetch_and_write, pending)
+        elif pending:
+            workers = max_concurrency if concurrency is None else concurrency.maximum
+            with ThreadPoolExecutor(max_workers=workers) as own_executor:
+                _run_all(own_executor, fetch_and_write, pending)
+    except BaseException as e:
+        target.abandon(e)
+        raise
+    target.finish()
+
+
+def _measured(concurrency, fetch, offset):
+    concurrency.acquire()
+    started = time.monotonic()
+    try:
+        position, data = fetch(offset)
+    except Exception as e:
+        if multi_part_concurrency.is_throttle(e):
+            concurrency.throttled()
+        raise
+    finally:
+        concurrency.release()
+    concurrency.record(len(data), time.monotonic() - started)
+    return position, data
+
+
+def _run_all(executor, function, items):
+    futures = [executor.submit(function, item) for item in items]
+    wait(futures, return_when=FIRST_EXCEPTION)
+    # After a failure, drop what has not started and let the rest finish before the file is closed
+    for future in futures:
+        future.cancel()
+    wait(futures)
+    for future in futures:
+        if not future.cancelled():
+            future.result()
+
+
+def _sync(fd):
+    # fdatasync skips the metadata flush, but macOS only has fsync
+    getattr(os, 'fdatasync', os.fsync)(fd)
+
+
+def check_metadata(metadata, chunk_size, plaintext_size):
+    """
+    Compare what the uploader recorded in x-amz-meta-* with what the object holds.
+    Objects uploaded before metadata was recorded have none and pass.
+
+    plaintext-sha256 is not checked here. Every frame is already authenticated,
+    together with its index and the last-chunk flag, so hashing the result would only
+    read the whole file a second time. The hash is there for sync comparisons
+    (multi_part_fetch) that run without downloading the object.
+    """
+    if metadata.get('encryption') not in (None, multi_part_format.SCHEME):
+        raise multi_part_format.FormatError(f"Unknown encryption scheme {metadata['encryption']}")
+    if metadata.get('chunk-size') not in (None, str(chunk_size)):
+        raise multi_part_format.FormatError(f"Chunk size {chunk_size} does not match the recorded "
+                                            f"{metadata['chunk-size']}")
+    if metadata.get('plaintext-size') not in (None, str(plaintext_size)):
+        raise multi_part_format.FormatError(f"Object holds {plaintext_size} bytes, but "
+                                            f"{metadata['plaintext-size']} were uploaded")
+
+
+def range_version(response, range_size):
+    """
+    What a plain object's download journal is keyed on, or None when the response has no ETag.
+    """
+    if not response.get('ETag'):
+        return None
+    return {'etag': response['ETag'], 'size': total_size(response), 'range_size': range_size}
+
+
+def download_ranges(s3_client, bucket, key, local_path, max_concurrency=DEFAULT_RANGE_CONCURRENCY,
+                    range_size=DEFAULT_RANGE_SIZE, first=None, executor=None, concurrency=None):
+    """
+    Download an object with concurrent ranged GETs of ``range_size`` bytes, each written
+    with pwrite at its offset in a file preallocated from the object's size. ``first`` is
+    a probe() of the object's start, reused as its first range(s). Returns the size.
+    """
+    data, response = first or probe(s3_client, bucket, key, range_size)
+    size = total_size(response)
+    conditions = {'IfMatch': response['ETag']} if response.get('ETag') else {}
+    version = range_version(response, range_size)
+
+    def fetch(start):
+        end = min(start + range_size, size)
+        if end <= len(data):
+            return start, data[start:end]
+        return start, get_range(s3_client, bucket, key, start, end, **conditions)[0]
+
+    write_ranges(local_path, size, range(0, size, range_size), fetch, max_concurrency, version, executor,
+                 concurrency)
+    return size
+
+
+def fetch_object(s3_client, bucket, key, local_path, find_key, max_concurrency=DEFAULT_RANGE_CONCURRENCY,
+                 range_size=DEFAULT_RANGE_SIZE, executor=None):
+    """
+    Download one object to ``local_path``, decrypting it if it is in the chunked format.
+    Its ranges run on ``executor`` when given (see write_ranges).
+    Returns (bytes written, whether it was decrypted).
+    """
+    first = probe(s3_client, bucket, key, range_size)
+    decrypted_size = download_decrypted(s3_client, bucket, key, local_path, find_key, max_concurrency, first=first,
+                                        executor=executor)
+    if decrypted_size is not None:
+        return decrypted_size, True
+    return download_ranges(s3_client, bucket, key, local_path, max_concurrency, range_size, first=first,
+                           executor=executor), False
+
+
+def download_decrypted(s3_client, bucket, key, local_path, find_key, max_concurrency=DEFAULT_RANGE_CONCURRENCY,
+                       frames_per_range=DEFAULT_FRAMES_PER_RANGE, first=None, executor=None, concurrency=None):
+    """
+    Download a client-side encrypted object straight to plaintext. Frames sit at fixed
+    offsets, so the object is fetched in frame-aligned ranges by concurrent GETs, each
+    range is decrypted by the thread that fetched it and written at its plaintext offset.
+
+    Everything needed comes from the first GET: the header, the object's size, and its
+    x-amz-meta-* values, which ``find_key(metadata)`` turns into the decryption key.
+    ``first`` is a probe() of the object's start, reused for any frames it already holds.
+    Returns the plaintext size, or None when the object is plain or a legacy Fernet token.
+    An object whose metadata names another scheme is refused with FormatError.
+    """
+    data, response = first or get_range(s3_client, bucket, key, 0, multi_part_format.HEADER_SIZE)
+    metadata = response.get('Metadata', {})
+    scheme = multi_part_format.scheme_of(metadata, data)
+    if scheme in (None, multi_part_format.FERNET_SCHEME):
+        return None
+    if scheme != multi_part_format.SCHEME:
+        raise multi_part_format.FormatError(f"Unknown encryption scheme {scheme}")
+    head = bytes(data[:multi_part_format.HEADER_SIZE])
+    chunk_size = multi_part_format.parse_header(head)
+    size = total_size(response)
+    plaintext_size = multi_part_format.plaintext_size(size, chunk_size)
+    check_metadata(metadata, chunk_size, plaintext_size)
+    decryption_key = find_key(metadata)
+    if decryption_key is None:
+        raise LookupError(f"No encryption key found for {key}")
+    last = multi_part_format.chunk_count(plaintext_size, chunk_size) - 1
+    frame_size = multi_part_format.frame_size(chunk_size)
+    # Every range must come from the object version the header did
+    conditions = {'IfMatch': response['ETag']} if response.get('ETag') else {}
+    version = ({'etag': response['ETag'], 'size': size, 'frames_per_range': frames_per_range}
+               if response.get('ETag') else None)
+
+    def fetch(index):
+        start = multi_part_format.HEADER_SIZE + index * frame_size
+        end = min(start + frames_per_range * frame_size, size)
+        frames = data[start:end] if end <= len(data) else get_range(s3_client, bucket, key, start, end, **conditions)[0]
+        return index * chunk_size, multi_part_format.decrypt_frames(frames, decryption_key, head, index, last)
+
+    write_ranges(local_path, plaintext_size, range(0, last + 1, frames_per_range), fetch, max_concurrency, version,
+                 executor, concurrency)
+    return plaintext_size
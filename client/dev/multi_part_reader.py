@@ -0,0 +1,91 @@
+import io
+import os
+import mmap
+
+
+class PartBody(io.RawIOBase):
+    """
+    Read-only file object over a memoryview, used as an S3 request body.
+
+    ``read`` hands out slices of the view rather than copies, so the socket
+    sends straight from the mapped file. Being an io.IOBase, aiohttp streams it
+    in blocks too, so the asyncio engine sends it without a copy as well.
+    """
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(self._position + size, len(self._view))
+        chunk = self._view[self._position:end]
+        self._position = end
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, min(offset, len(self._view)))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class PartReader:
+    """
+    One open file descriptor and one read-only mmap shared by every part of a file.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def part(self, offset, length):
+        """
+        Return a zero-copy memoryview of ``length`` bytes starting at ``offset``.
+        """
+        return self._view[offset:offset + length]
+
+    def body(self, offset, length):
+        return PartBody(self.part(offset, length))
+
+    def release(self, offset, length):
+        """
+        Drop a sent part's pages from this process's resident set. The data stays in
+        the page cache, so a retry simply faults it back in.
+        """
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        start = offset - offset % mmap.PAGESIZE
+        end = min(offset + length, self.size)
+        if end > start:
+            self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # A part is still being sent; the mapping goes away with its last view
+            pass
+        self._file.close()
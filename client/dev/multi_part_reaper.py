@@ -0,0 +1,153 @@
+import re
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, NoCredentialsError
+from tabulate import tabulate
+
+from dev import multi_part_memory
+
+DEFAULT_REAP_CONCURRENCY = 16
+# Younger uploads may still be running, or waiting for --resume; reaping everything takes an explicit --older-than 0
+DEFAULT_REAP_AGE = '1d'
+
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_age(text):
+    """
+    Parse an age such as '90m', '12h' or '7d' into a timedelta. Plain numbers are seconds.
+    """
+    if text is None:
+        return None
+    match = re.fullmatch(r'\s*(\d+)\s*([smhdw]?)\s*', str(text).lower())
+    if not match:
+        raise ValueError(f"Cannot parse age '{text}'; use a number with s, m, h, d or w")
+    number, unit = match.groups()
+    return datetime.timedelta(seconds=int(number) * AGE_UNITS[unit or 's'])
+
+
+def list_incomplete_uploads(s3_client, bucket, prefix=""):
+    """
+    Yield every in-progress multipart upload under a prefix, one page at a time.
+    """
+    paginator = s3_client.get_paginator('list_multipart_uploads')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix or ""):
+        for upload in page.get('Uploads', []):
+            yield upload
+
+
+def older_than(uploads, age, now=None):
+    """
+    Keep the uploads initiated more than ``age`` ago; every upload when ``age`` is None.
+    """
+    if age is None:
+        return list(uploads)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return [upload for upload in uploads if now - upload['Initiated'] > age]
+
+
+def stored_parts(s3_client, bucket, upload):
+    """
+    Return (parts, bytes) already stored for an upload, which is what aborting it frees.
+    """
+    parts = size = 0
+    paginator = s3_client.get_paginator('list_parts')
+    try:
+        for page in paginator.paginate(Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId']):
+            for part in page.get('Parts', []):
+                parts += 1
+                size += part['Size']
+    except ClientError as e:
+        # Finished or aborted since it was listed
+        logging.info(f"Cannot list parts of {upload['Key']}: {str(e)}")
+    return parts, size
+
+
+def prefix_of(key, depth=1):
+    """
+    The first ``depth`` path components of a key, e.g. 'logs/2024/' for depth 2.
+    """
+    components = key.split('/')[:-1][:depth]
+    return '/'.join(components) + '/' if components else '(root)'
+
+
+def summarize(uploads, sizes, depth=1):
+    """
+    Group uploads by prefix into table rows of [prefix, uploads, parts, bytes].
+    """
+    totals = {}
+    for upload, (parts, size) in zip(uploads, sizes):
+        row = totals.setdefault(prefix_of(upload['Key'], depth), [0, 0, 0])
+        row[0] += 1
+        row[1] += parts
+        row[2] += size
+    return [[prefix, count, parts, size] for prefix, (count, parts, size) in sorted(totals.items())]
+
+
+def abort_upload(s3_client, bucket, upload):
+    """
+    Abort one upload. Returns None on success or the error message.
+    """
+    try:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            return None
+        return str(e)
+    return None
+
+
+def show_table(uploads, sizes, depth, bytes_header):
+    rows = summarize(uploads, sizes, depth)
+    table_data = [[prefix, str(count), str(parts), multi_part_memory.format_size(size)]
+                  for prefix, count, parts, size in rows]
+    table_data.append(["Total", str(len(uploads)), str(sum(parts for parts, _ in sizes)),
+                       multi_part_memory.format_size(sum(size for _, size in sizes))])
+    click.echo(tabulate(table_data, headers=["Prefix", "Uploads", "Parts", bytes_header], tablefmt="grid"))
+
+
+def reap_uploads(bucket, prefix="", older_than_age=DEFAULT_REAP_AGE, dry_run=False, depth=1,
+                 max_concurrency=DEFAULT_REAP_CONCURRENCY):
+    """
+    Abort incomplete multipart uploads under a prefix started longer than ``older_than_age`` ago.
+    """
+    try:
+        age = parse_age(older_than_age)
+        # One pooled connection per worker thread
+        s3 = boto3.client('s3', config=Config(max_pool_connections=max_concurrency))
+        uploads = older_than(list_incomplete_uploads(s3, bucket, prefix), age)
+        if not uploads:
+            click.echo("No incomplete multipart uploads found.")
+            return
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            sizes = list(executor.map(lambda upload: stored_parts(s3, bucket, upload), uploads))
+
+        if dry_run:
+            show_table(uploads, sizes, depth, "Bytes Reclaimable")
+            click.echo(f"Dry run: {len(uploads)} uploads would be aborted.")
+            return
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            errors = list(executor.map(lambda upload: abort_upload(s3, bucket, upload), uploads))
+
+        for upload, error in zip(uploads, errors):
+            if error:
+                click.echo(f"Could not abort {upload['Key']} ({upload['UploadId']}): {error}")
+        # Only the uploads that were actually aborted freed their parts
+        aborted = [(upload, size) for upload, size, error in zip(uploads, sizes, errors) if error is None]
+        if aborted:
+            show_table([upload for upload, _ in aborted], [size for _, size in aborted], depth, "Bytes Reclaimed")
+        click.echo(f"Aborted {len(aborted)} of {len(uploads)} incomplete multipart uploads.")
+
+    except ValueError as e:
+        click.echo(str(e))
+    except NoCredentialsError:
+        click.echo("Credentials not available. Please provide valid AWS access key and secret access key.")
+    except Exception as e:
+        click.echo(f"An error occurred: {str(e)}")
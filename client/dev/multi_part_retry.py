@@ -0,0 +1,67 @@
+import random
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+from dev import multi_part_concurrency
+
+# Code given to requests that failed on the way to S3: a connection reset, refused or timed out
+CONNECTION_ERROR = 'ConnectionError'
+
+# Errors worth another attempt besides throttling: transient server faults, timeouts,
+# a body that arrived damaged, and failed connections. Anything else, such as a
+# local error reading the file, would only fail the same way again.
+RETRYABLE_CODES = multi_part_concurrency.THROTTLE_CODES | {
+    'InternalError', 'RequestTimeout', 'RequestTimeoutException', 'BadDigest', 'XAmzContentSHA256Mismatch',
+    '500', '502', '504', CONNECTION_ERROR,
+}
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+DEFAULT_RETRY_BUDGET = 10
+
+
+def error_code(error):
+    """
+    S3's error code for a failed request, CONNECTION_ERROR when it never got an answer,
+    or None for any other exception.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError, ConnectionError, TimeoutError)):
+        return CONNECTION_ERROR
+    return None
+
+
+def is_retryable(error):
+    """
+    True for an error dict from upload_part/put_file that may succeed if sent again.
+    """
+    return error.get('Code') in RETRYABLE_CODES
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, bounded per request and per file.
+
+    A request is tried at most ``max_attempts`` times, waiting a random time
+    between 0 and ``base_delay * 2 ** n`` (capped at ``max_delay``) before retry n.
+    Each file may spend ``retry_budget`` retries plus one per ten parts, so a run of
+    failures on one file gives up instead of retrying every part to the limit.
+    """
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, retry_budget=DEFAULT_RETRY_BUDGET):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+
+    def budget_for(self, num_parts):
+        return self.retry_budget + num_parts // 10
+
+    def delay(self, attempt):
+        """
+        Seconds to wait before retry number ``attempt`` (1 for the first retry).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
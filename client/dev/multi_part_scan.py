@@ -0,0 +1,34 @@
+import os
+
+
+def scan_files(folder_path, recursive=False):
+    """
+    Yield (file_path, relative_path, stat) for every regular file under a folder.
+
+    Built on os.scandir and yields each file as soon as it is seen, so uploads can
+    start before the whole tree has been walked. The stat result comes from the
+    directory entry, which on Windows costs no extra system call. Relative paths
+    always use '/' so they can be used as S3 keys directly. Symlinked directories
+    are not followed, which keeps a link cycle from looping forever.
+    """
+    pending = [(folder_path, '')]
+    while pending:
+        directory, relative_dir = pending.pop()
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirectories.append((entry.path, f"{relative_dir}{entry.name}/"))
+                elif entry.is_file():
+                    yield entry.path, relative_dir + entry.name, entry.stat()
+        # Reversed so directories are visited in the order scandir returned them
+        pending.extend(reversed(subdirectories))
+
+
+def object_key(prefix, relative_path):
+    """
+    Place a relative path under a destination prefix, e.g. ('backups', 'a/b.txt') -> 'backups/a/b.txt'.
+    """
+    prefix = (prefix or '').strip('/')
+    return f"{prefix}/{relative_path}" if prefix else relative_path
@@ -0,0 +1,467 @@
+import os
+import itertools
+import logging
+import queue
+import time
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+from dev import multi_part_checksum
+from dev import multi_part_concurrency
+from dev import multi_part_memory
+from dev import multi_part_reader
+from dev import multi_part_retry
+
+# Dispatch order for queued work. Completing a file is cheap and releases its slot,
+# creating a file next gets its upload ID ready while the previous file's parts are
+# still in flight, and part uploads fill whatever workers remain.
+COMPLETE_PRIORITY = 0
+CREATE_PRIORITY = 1
+PART_PRIORITY = 2
+STOP_PRIORITY = 99
+
+# Files smaller than this go up as a single PutObject instead of a multipart upload
+DEFAULT_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+class FileUpload:
+    """
+    Progress of a single file moving through the scheduler.
+    """
+    def __init__(self, file_path, key, part_size, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, stat=None):
+        self.file_path = file_path
+        self.key = key
+        stat = stat or os.stat(file_path)
+        self.file_size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        # Empty files always take the single request path: a zero part size has no parts
+        self.single_request = self.file_size < multipart_threshold or self.file_size == 0
+        if self.single_request:
+            self.part_size = self.file_size
+            self.num_parts = 1
+        else:
+            self.part_size = min(part_size, self.file_size)
+            self.num_parts = (self.file_size + self.part_size - 1) // self.part_size
+        self.upload_id = None
+        self.reader = None
+        self.etag = None
+        self.resumed_parts = 0
+        self.parts = {}
+        self.errors = []
+        # Attempts made per part number (None for a single request), and retries left for the whole file
+        self.attempts = {}
+        self.retries = 0
+        self.retry_budget = 0
+        self.aborted = False
+        self.remaining = self.num_parts
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    @property
+    def failed(self):
+        return bool(self.errors)
+
+    def use_part_size(self, part_size):
+        self.part_size = part_size
+        self.num_parts = (self.file_size + part_size - 1) // part_size
+        self.remaining = self.num_parts
+
+
+class PartScheduler:
+    """
+    Feed the parts of many files into one bounded worker pool.
+
+    Every S3 call (create, upload part, complete) is a task on the same pool, so the
+    create/complete round trips of one file overlap with part uploads of the others.
+    Files under the multipart threshold skip all of that and are sent with one
+    PutObject through ``put_object``.
+
+    With a ``journal`` every finished part is recorded on disk, and ``resume``
+    picks a journaled upload back up, sending only the parts S3 does not have.
+    ``key_id(upload)`` names the key a file's parts are encrypted with, and is
+    journaled; a run that does not encrypt passes no ``key_id``. ``restore_key(upload,
+    key_id)`` makes a resumed upload use that key again. An upload whose key cannot be
+    restored is aborted and started over rather than finished with parts under two keys.
+
+    Reads are admitted against ``budget``: a part is only dispatched once
+    ``part_cost`` of its length fits, so at most that many bytes are buffered.
+
+    The number of requests in flight is governed by ``concurrency``, an
+    AdaptiveConcurrency fed with every request's size and duration. Without one the
+    pool runs at a fixed ``max_concurrency``.
+
+    With a ``checksum_algorithm`` every request carries a checksum of its body, and
+    each completed upload's checksum is checked against the one built from its parts.
+
+    A ``retry`` policy re-queues only the requests that failed with a retryable
+    error, after a jittered backoff. A multipart upload that still cannot finish is
+    aborted, so its parts do not linger in the bucket.
+    """
+    def __init__(self, s3_client, bucket, bucket_region, upload_part, put_object=None, max_concurrency=10,
+                 multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, journal=None, resume=False,
+                 budget=None, part_cost=None, concurrency=None, checksum_algorithm=None,
+                 retry=None, metadata=None, key_id=None, restore_key=None, part_reader=True):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.bucket_region = bucket_region
+        self.upload_part = upload_part
+        self.put_object = put_object
+        self.concurrency = concurrency or multi_part_concurrency.AdaptiveConcurrency(
+            maximum=max_concurrency, adaptive=False, name="upload")
+        self.max_concurrency = self.concurrency.maximum
+        # Without a put_object callable every file goes through the multipart path
+        self.multipart_threshold = multipart_threshold if put_object else 0
+        self.journal = journal
+        self.resume = resume
+        self.budget = budget or multi_part_memory.MemoryBudget()
+        self.part_cost = part_cost or (lambda length: length)
+        self.checksum_algorithm = checksum_algorithm
+        self.retry = retry
+        # metadata(upload) gives the x-amz-meta-* values each object is created with
+        self.metadata = metadata
+        self.key_id = key_id
+        self.restore_key = restore_key
+        # False when upload_part reads the file itself (the encryption stage's workers do), so nothing is mapped
+        self.part_reader = part_reader
+        # Only passed on when set, so upload callables without checksum support keep working
+        self._checksum_args = {'checksum_algorithm': checksum_algorithm} if checksum_algorithm else {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._stats_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self.uploads = []
+
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        # Cap the number of multipart uploads open at once so a large folder is not
+        # created up front before any of its parts have been sent.
+        self._open_files = threading.Semaphore(self.max_concurrency * 2)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit_file(self, file_path, key, part_size, stat=None):
+        """
+        Queue a file for upload. Blocks while too many files are already open.
+        Pass ``stat`` when the caller already has it to save another system call.
+        """
+        self._open_files.acquire()
+        try:
+            upload = FileUpload(file_path, key, part_size, self.multipart_threshold, stat=stat)
+        except Exception:
+            self._open_files.release()
+            raise
+        upload.retry_budget = self.retry.budget_for(upload.num_parts) if self.retry else 0
+        self.uploads.append(upload)
+        if upload.single_request:
+            self._put(PART_PRIORITY, self._send_whole_file, upload, cost=self.part_cost(upload.file_size))
+        else:
+            self._put(CREATE_PRIORITY, self._create, upload)
+        return upload
+
+    def join(self):
+        """
+        Wait for every submitted file to finish and shut the pool down.
+        """
+        for upload in self.uploads:
+            upload.done.wait()
+        self._put(STOP_PRIORITY, None)
+        self._dispatcher.join()
+        self.executor.shutdown(wait=True)
+        return self.uploads
+
+    def _put(self, priority, task, *args, cost=0):
+        self._queue.put((priority, next(self._counter), task, args, cost))
+
+    def _dispatch(self):
+        while True:
+            _, _, task, args, cost = self._queue.get()
+            if task is None:
+                break
+            self.concurrency.acquire()
+            # Blocks here, before the part is read, while the budget is spent
+            charge = self.budget.acquire(cost) if cost else 0
+            self._track_in_flight(1)
+            future = self.executor.submit(self._run, task, *args)
+            future.add_done_callback(lambda _, charge=charge: self._task_done(charge))
+
+    def _task_done(self, charge):
+        self._track_in_flight(-1)
+        if charge:
+            self.budget.release(charge)
+        self.concurrency.release()
+
+    def _observe(self, result, nbytes, started):
+        if 'Error' in result:
+            if multi_part_concurrency.is_throttle(result):
+                self.concurrency.throttled()
+        else:
+            self.concurrency.record(nbytes, time.monotonic() - started)
+
+    def _track_in_flight(self, delta):
+        with self._stats_lock:
+            self.in_flight += delta
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _run(self, task, upload, *args):
+        try:
+            task(upload, *args)
+        except Exception as e:
+            logging.error(f"Error uploading {upload.key}: {str(e)}")
+            with upload.lock:
+                upload.errors.append({"PartNumber": None, "Error": str(e)})
+            self._abort(upload)
+            self._finish(upload)
+
+    def _finish(self, upload):
+        if not upload.done.is_set():
+            if upload.reader is not None:
+                upload.reader.close()
+            upload.done.set()
+            self._open_files.release()
+
+    def _create(self, upload):
+        if self.journal is not None and self.resume and self._resume(upload):
+            return
+
+        create_args = {'Bucket': self.bucket, 'Key': upload.key}
+        if self.checksum_algorithm:
+            create_args['ChecksumAlgorithm'] = self.checksum_algorithm
+        metadata = self.metadata(upload) if self.metadata else None
+        if metadata:
+            create_args['Metadata'] = metadata
+        try:
+            response = self.s3.create_multipart_upload(**create_args)
+        except Exception as e:
+            if self._retry_call(upload, 'create', e):
+                return
+            raise
+        upload.upload_id = response['UploadId']
+        if self.journal is not None:
+            key_id = self.key_id(upload) if self.key_id else None
+            self.journal.start(self.bucket, upload, self.checksum_algorithm, key_id=key_id)
+        self._queue_parts(upload, range(1, upload.num_parts + 1))
+
+    def _queue_parts(self, upload, part_numbers):
+        part_numbers = list(part_numbers)
+        if part_numbers:
+            if self.part_reader:
+                # Every part of the file reads from one descriptor and one mapping
+                upload.reader = multi_part_reader.PartReader(upload.file_path)
+        else:
+            self._put(COMPLETE_PRIORITY, self._complete, upload)
+        for part_number in part_numbers:
+            self._put(PART_PRIORITY, self._send_part, upload, part_number, cost=self._part_cost(upload, part_number))
+
+    def _part_cost(self, upload, part_number):
+        length = min(upload.part_size, upload.file_size - upload.part_size * (part_number - 1))
+        return self.part_cost(length)
+
+    def _retry_later(self, upload, part_number, error):
+        """
+        Re-queue a failed request after a backoff. Call with ``upload.lock`` held.
+        ``part_number`` is the part, None for a single PutObject, or 'create' or
+        'complete' for those calls of a multipart upload. Returns False when the
+        error is final.
+        """
+        if self.retry is None or upload.failed or not multi_part_retry.is_retryable(error):
+            return False
+        attempt = upload.attempts.get(part_number, 1)
+        if attempt >= self.retry.max_attempts or upload.retries >= upload.retry_budget:
+            return False
+        upload.attempts[part_number] = attempt + 1
+        upload.retries += 1
+
+        if part_number is None:
+            priority, task, args = PART_PRIORITY, self._send_whole_file, (upload,)
+            cost = self.part_cost(upload.file_size)
+        elif part_number == 'create':
+            priority, task, args, cost = CREATE_PRIORITY, self._create, (upload,), 0
+        elif part_number == 'complete':
+            priority, task, args, cost = COMPLETE_PRIORITY, self._complete, (upload,), 0
+        else:
+            priority, task, args = PART_PRIORITY, self._send_part, (upload, part_number)
+            cost = self._part_cost(upload, part_number)
+        delay = self.retry.delay(attempt)
+        logging.info(f"Retrying {upload.key} part {part_number} in {delay:.2f}s "
+                     f"(attempt {attempt + 1} of {self.retry.max_attempts}): {error['Error']}")
+        # The wait happens on a timer, not a worker, so other files keep the pool busy
+        timer = threading.Timer(delay, self._put, args=(priority, task) + args, kwargs={'cost': cost})
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _retry_call(self, upload, call, e):
+        error = {"PartNumber": None, "Error": str(e), "Code": multi_part_retry.error_code(e)}
+        if multi_part_concurrency.is_throttle(error):
+            self.concurrency.throttled()
+        with upload.lock:
+            return self._retry_later(upload, call, error)
+
+    def _resume(self, upload):
+        """
+        Continue a journaled upload. Returns False when it has to start over.
+        """
+        entry = self.journal.load(self.bucket, upload.key)
+        if entry is None:
+            return False
+        header, journaled = entry
+
+        if (header['file_size'], header['mtime_ns']) != (upload.file_size, upload.mtime_ns):
+            logging.info(f"{upload.key} changed since it was journaled, starting a new upload")
+            return False
+        if header.get('checksum_algorithm') != self.checksum_algorithm:
+            logging.info(f"{upload.key} was journaled with another checksum algorithm, starting a new upload")
+            return False
+        if not self._restore_key(upload, header.get('key_id')):
+            logging.info(f"The key {upload.key} was encrypted with is not in the key store, starting a new upload")
+            self._abort_journaled(upload.key, header['upload_id'])
+            return False
+
+        try:
+            uploaded = self._list_parts(upload.key, header['upload_id'])
+        except ClientError as e:
+            logging.info(f"Cannot resume {upload.key}: {str(e)}")
+            return False
+
+        upload.upload_id = header['upload_id']
+        upload.use_part_size(header['part_size'])
+        for part_number, part in uploaded.items():
+            # ListParts is authoritative, but a part the journal saw with another ETag was overwritten
+            if journaled.get(part_number, part['ETag']) == part['ETag']:
+                upload.parts[part_number] = part
+
+        missing = [number for number in range(1, upload.num_parts + 1) if number not in upload.parts]
+        upload.resumed_parts = len(upload.parts)
+        upload.remaining = len(missing)
+        logging.info(f"Resuming {upload.key}: {upload.resumed_parts} of {upload.num_parts} parts already uploaded")
+        self._queue_parts(upload, missing)
+        return True
+
+    def _restore_key(self, upload, key_id):
+        """
+        Make the parts still to be sent use the key the journaled ones were encrypted with.
+        """
+        if key_id:
+            return self.restore_key is not None and self.restore_key(upload, key_id)
+        # Journaled parts went out unencrypted, or under a key that was never recorded. Only a run
+        # that does not encrypt either can finish them; asking key_id() would generate a key to compare.
+        return self.key_id is None
+
+    def _abort_journaled(self, key, upload_id):
+        # Its parts are encrypted under a lost key, so they are no use to anyone
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logging.error(f"Could not abort the journaled upload of {key}: {str(e)}")
+
+    def _list_parts(self, key, upload_id):
+        uploaded = {}
+        paginator = self.s3.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket, Key=key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                entry = {"PartNumber": part['PartNumber'], "ETag": part['ETag']}
+                if self.checksum_algorithm:
+                    field = multi_part_checksum.field(self.checksum_algorithm)
+                    if not part.get(field):
+                        # Without its checksum the part cannot be completed; send it again
+                        continue
+                    entry[field] = part[field]
+                uploaded[part['PartNumber']] = entry
+        return uploaded
+
+    def _send_part(self, upload, part_number):
+        if upload.failed:
+            # Another part already failed for good, so this one is skipped and the upload aborted
+            part = None
+        else:
+            args = (part_number, upload.upload_id, upload.file_path, self.bucket, upload.key, upload.part_size)
+            started = time.monotonic()
+            try:
+                part = self.upload_part(args, self.bucket_region, s3_client=self.s3, reader=upload.reader,
+                                        **self._checksum_args)
+            except Exception as e:
+                part = {"PartNumber": part_number, "Error": str(e), "Code": multi_part_retry.error_code(e)}
+            offset = upload.part_size * (part_number - 1)
+            self._observe(part, min(upload.part_size, upload.file_size - offset), started)
+            if upload.reader is not None:
+                upload.reader.release(offset, upload.part_size)
+
+        with upload.lock:
+            if part is None:
+                pass
+            elif 'Error' in part:
+                if self._retry_later(upload, part_number, part):
+                    return
+                upload.errors.append(part)
+            else:
+                upload.parts[part_number] = part
+                if self.journal is not None:
+                    self.journal.record_part(self.bucket, upload.key, part)
+            upload.remaining -= 1
+            last_part = upload.remaining == 0
+
+        if last_part:
+            self._put(COMPLETE_PRIORITY, self._complete, upload)
+
+    def _send_whole_file(self, upload):
+        args = (upload.file_path, self.bucket, upload.key)
+        started = time.monotonic()
+        metadata_args = {'metadata': self.metadata(upload)} if self.metadata else {}
+        response = self.put_object(args, self.bucket_region, s3_client=self.s3, **self._checksum_args, **metadata_args)
+        self._observe(response, upload.file_size, started)
+        if 'Error' in response:
+            with upload.lock:
+                if self._retry_later(upload, None, response):
+                    return
+                upload.errors.append({"PartNumber": None, "Error": response['Error']})
+        else:
+            upload.etag = response['ETag']
+        self._finish(upload)
+
+    def _complete(self, upload):
+        if not upload.failed:
+            parts = [upload.parts[number] for number in sorted(upload.parts)]
+            try:
+                response = self.s3.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=upload.key,
+                    UploadId=upload.upload_id,
+                    MultipartUpload={"Parts": parts}
+                )
+            except Exception as e:
+                # The parts are all in S3; a transient failure here must not abort them
+                if self._retry_call(upload, 'complete', e):
+                    return
+                raise
+            upload.etag = response.get('ETag')
+            if self.journal is not None:
+                self.journal.remove(self.bucket, upload.key)
+            if self.checksum_algorithm:
+                self._verify_checksum(upload, parts, response)
+            logging.info(f"Completed multipart upload of {upload.key}")
+        else:
+            self._abort(upload)
+        self._finish(upload)
+
+    def _abort(self, upload):
+        """
+        Abort a multipart upload that cannot complete so S3 frees its parts.
+        """
+        if upload.upload_id is None or upload.aborted or upload.etag is not None:
+            return
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=upload.key, UploadId=upload.upload_id)
+        except Exception as e:
+            logging.error(f"Could not abort the multipart upload of {upload.key}: {str(e)}")
+            return
+        upload.aborted = True
+        if self.journal is not None:
+            self.journal.remove(self.bucket, upload.key)
+        logging.info(f"Aborted multipart upload of {upload.key}")
+
+    def _verify_checksum(self, upload, parts, response):
+        mismatch = multi_part_checksum.verify_completed(self.checksum_algorithm, parts, response)
+        if mismatch:
+            with upload.lock:
+                upload.errors.append({"PartNumber": None, "Error": mismatch})
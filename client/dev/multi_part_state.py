@@ -0,0 +1,3 @@
+# Local state (the key store, upload journals, sync manifests and the hash cache) is kept
+# where encryption_keys.json always was: the directory the CLI is run from
+STATE_DIR = '.'
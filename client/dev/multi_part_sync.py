@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+import click
+import boto3
+from botocore.exceptions import NoCredentialsError
+
+from dev import multi_part_scan
+from dev import multi_part_state
+from dev import multi_part_upload
+
+DEFAULT_MANIFEST_DIR = os.path.join(multi_part_state.STATE_DIR, '.sync_manifest')
+
+# DeleteObjects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+def list_remote(s3_client, bucket, prefix=""):
+    """
+    Return {key: {"Size", "ETag"}} for every object under a prefix, one page of 1,000 at a time.
+    """
+    prefix = (prefix or '').strip('/')
+    remote = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/" if prefix else ""):
+        for obj in page.get('Contents', []):
+            remote[obj['Key']] = {'Size': obj['Size'], 'ETag': obj['ETag']}
+    return remote
+
+
+class SyncManifest:
+    """
+    What the last sync uploaded from a folder to a bucket prefix.
+
+    Maps each key to the local size and mtime it was uploaded from and the ETag S3
+    returned. Files are encrypted before upload, so the remote size never matches
+    the local one; the manifest is what lets an unchanged file be recognised
+    without reading it.
+    """
+    def __init__(self, bucket, prefix, folder_path, directory=DEFAULT_MANIFEST_DIR):
+        self.directory = directory
+        identity = f"{bucket}/{(prefix or '').strip('/')}:{os.path.abspath(folder_path)}"
+        digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+        self.path = os.path.join(directory, f"{digest}.json")
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            self.entries = {}
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring unreadable sync manifest {self.path}")
+            self.entries = {}
+        return self
+
+    def record(self, key, stat, etag):
+        self.entries[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'etag': etag}
+
+    def forget(self, key):
+        self.entries.pop(key, None)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first so an interrupted save never leaves half a manifest
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.path)
+
+
+def is_unchanged(stat, entry, remote):
+    """
+    True when a local file still matches what the last sync uploaded and the remote object is the one it created.
+    """
+    if remote is None or entry is None:
+        return False
+    return (entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+            and entry['etag'] == remote['ETag'])
+
+
+def plan_sync(files, remote, manifest, prefix="", recursive=True):
+    """
+    Split scanned files into (new, changed, unchanged) and find the remote orphans.
+
+    ``files`` yields (file_path, relative_path, stat) as from scan_files. Orphans are
+    keys under the prefix with no local file; without ``recursive`` only keys at the
+    top level of the prefix are candidates, since nested local files were never scanned.
+    """
+    new, changed, unchanged = [], [], []
+    seen = set()
+    for file_path, relative_path, stat in files:
+        key = multi_part_scan.object_key(prefix, relative_path)
+        seen.add(key)
+        remote_object = remote.get(key)
+        if remote_object is None:
+            new.append((file_path, relative_path, stat))
+        elif is_unchanged(stat, manifest.entries.get(key), remote_object):
+            unchanged.append((file_path, relative_path, stat))
+        else:
+            changed.append((file_path, relative_path, stat))
+
+    base = multi_part_scan.object_key(prefix, '')
+    orphans = sorted(key for key in remote
+                     if key not in seen and not key.endswith('/')
+                     and (recursive or '/' not in key[len(base):]))
+    return new, changed, unchanged, orphans
+
+
+def delete_orphans(s3_client, bucket, keys):
+    """
+    Delete keys with DeleteObjects in batches of 1,000. Returns the keys S3 refused to delete.
+    """
+    errors = []
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        response = s3_client.delete_objects(Bucket=bucket,
+                                            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        errors.extend(error['Key'] for error in response.get('Errors', []))
+    return errors
+
+
+def sync_folder(folder_path, bucket, prefix="", recursive=True, delete=False, dry_run=False, **upload_options):
+    """
+    Upload only the files in a folder that are new or changed since the last sync.
+
+    Remaining keyword arguments are passed through to upload_folder.
+    """
+    try:
+        if not os.path.isdir(folder_path):
+            raise FileNotFoundError(folder_path)
+
+        started = time.monotonic()
+        s3 = boto3.client('s3')
+        remote = list_remote(s3, bucket, prefix)
+        manifest = SyncManifest(bucket, prefix, folder_path).load()
+        new, changed, unchanged, orphans = plan_sync(multi_part_scan.scan_files(folder_path, recursive=recursive),
+                                                     remote, manifest, prefix=prefix, recursive=recursive)
+
+        click.echo(f"{len(new)} new, {len(changed)} changed, {len(unchanged)} unchanged, "
+                   f"{len(orphans)} only in the bucket")
+        if dry_run:
+            for _, relative_path, _ in new:
+                click.echo(f"new: {relative_path}")
+            for _, relative_path, _ in changed:
+                click.echo(f"changed: {relative_path}")
+            if delete:
+                for key in orphans:
+                    click.echo(f"delete: {key}")
+            return
+
+        to_upload = new + changed
+        stats = {multi_part_scan.object_key(prefix, relative_path): stat for _, relative_path, stat in to_upload}
+        if to_upload:
+            uploads = multi_part_upload.upload_folder(folder_path, bucket, prefix=prefix, files=to_upload,
+                                                      list_contents=False, **upload_options)
+            for upload in uploads or []:
+                if not upload.failed and upload.etag:
+                    manifest.record(upload.key, stats[upload.key], upload.etag)
+
+        if delete and orphans:
+            refused = set(delete_orphans(s3, bucket, orphans))
+            for key in orphans:
+                if key not in refused:
+                    manifest.forget(key)
+            click.echo(f"Deleted {len(orphans) - len(refused)} objects missing locally.")
+            for key in sorted(refused):
+                click.echo(f"Could not delete {key}")
+
+        # Keys that vanished from both sides have nothing left to track
+        for key in list(manifest.entries):
+            if key not in remote and key not in stats:
+                manifest.forget(key)
+        manifest.save()
+
+        click.echo(f"Sync finished in {time.monotonic() - started:.1f}s.")
+
+    except FileNotFoundError:
+        click.echo(f"The folder '{folder_path}' does not exist.")
+    except NoCredentialsError:
+        click.echo("Credentials not available. Please provide valid AWS access key and secret access key.")
+    except Exception as e:
+        click.echo(f"An error occurred: {str(e)}")
@@ -1,25 +1,29 @@
 import click
 import boto3
 import os
-import time
-import math
-import datetime
-import uuid
-import logging
-import hashlib
-import sys
-import cryptography
+import threading
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from click import prompt
-from tabulate import tabulate
-from boto3.s3.transfer import TransferConfig
 from cryptography.fernet import Fernet
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
-import json
+
+from dev import multi_part_async
+from dev import multi_part_checksum
+from dev import multi_part_concurrency
+from dev import multi_part_dedup
+from dev import multi_part_encryption
+from dev import multi_part_format
+from dev import multi_part_journal
+from dev import multi_part_keystore
+from dev import multi_part_memory
+from dev import multi_part_planner
+from dev import multi_part_reader
+from dev import multi_part_retry
+from dev import multi_part_scan
+from dev import multi_part_scheduler
 
 session = boto3.Session()
 s3 = session.resource('s3')
@@ -27,20 +31,32 @@ s3 = session.resource('s3')
 # Dictionary to store encryption keys for each file
 encryption_keys = {}
 
+# Process pool that encrypts parts off the I/O threads; upload_folder sets it for the length of a run
+encryption_stage = None
 
-def load_encryption_keys():
-    try:
-        with open('encryption_keys.json', 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+# Key store and bucket that every new file key is written to before its first part is sent;
+# upload_folder sets them for the length of a run
+key_store = None
+key_store_bucket = None
+
+# Whether files are encrypted on the client; upload_folder sets it for the length of a run
+client_side_encryption = True
+
+# Derived key per (bucket, file) for the length of a run, so PBKDF2 runs once per file instead of once per part
+file_keys = {}
+derive_locks = {}
+derive_locks_guard = threading.Lock()
+
+
+def uploaded_keys(uploads):
+    # (key, encryption key, version) of each finished upload; the ETag tells versions of a key apart
+    return [(upload.key, encryption_keys[upload.key], upload.etag)
+            for upload in uploads if not upload.failed and upload.key in encryption_keys]
 
 
-def save_encryption_keys():
+def save_encryption_keys(keystore, bucket, entries):
     try:
-        with open('encryption_keys.json', 'w') as file:
-            keys_dict = {key: encryption_keys[key].decode('latin1') for key in encryption_keys}
-            json.dump(keys_dict, file)
+        keystore.put_many(bucket, entries)
     except Exception as e:
         print(f"Error saving encryption keys: {e}")
 
@@ -59,7 +75,7 @@ def calculate_number_of_parts(file_size, part_size):
     return (file_size + part_size - 1) // part_size
 
 
-def encrypt_data(data, encryption_key):
+def derive_key(encryption_key):
     salt = b'salt_123'  # Change this to a unique value
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -68,7 +84,11 @@ def encrypt_data(data, encryption_key):
         length=32,
         backend=default_backend()
     )
-    key = base64.urlsafe_b64encode(kdf.derive(encryption_key))
+    return base64.urlsafe_b64encode(kdf.derive(encryption_key))
+
+
+def encrypt_data(data, encryption_key):
+    key = derive_key(encryption_key)
     cipher = Fernet(key)
     encrypted_data = cipher.encrypt(data)
     return encrypted_data, key  # Return the encrypted data along with the key
@@ -88,146 +108,439 @@ def generate_encryption_key():
     return os.urandom(32)
 
 
-def upload_part(args, bucket_region='us-east-1'):
-    part_number, upload_id, file_path, bucket, file_name, part_size = args
+def buffered_bytes(length):
+    """
+    Memory held while a part of this length is encrypted and sent: the plaintext
+    and its framed ciphertext.
+    """
+    return length + multi_part_format.encrypted_size(length)
+
+
+def staged_bytes(length):
+    """
+    Memory held while the encryption stage prepares a part of this length: the
+    worker's plaintext and ciphertext, the pickled ciphertext in the pipe, and the
+    copy unpickled here that is sent.
+    """
+    return length + 3 * multi_part_format.encrypted_size(length)
+
+
+def file_key(file_name):
+    """
+    Derived key for a file, or None when client-side encryption is off. The first part
+    to ask derives it from the file's encryption key and writes it to ``key_store``;
+    every later part, on any thread, reuses it, so all parts of an object are encrypted
+    with the one key that ends up in encryption_keys.
+    """
+    if not client_side_encryption:
+        return None
+    cache_key = (key_store_bucket, file_name)
+    with derive_locks_guard:
+        lock = derive_locks.setdefault(cache_key, threading.Lock())
+    with lock:
+        if cache_key not in file_keys:
+            # Retrieve or generate encryption key for the file
+            encryption_key = encryption_keys.get(file_name) or generate_encryption_key()
+            key = derive_key(encryption_key)
+            # Stored before anything is encrypted with it, so a run that dies still leaves it readable
+            if key_store is not None:
+                key_store.put(key_store_bucket, file_name, key)
+            encryption_keys[file_name] = key
+            file_keys[cache_key] = key
+        return file_keys[cache_key]
+
+
+def file_key_id(file_name):
+    key = file_key(file_name)
+    return multi_part_keystore.key_id(key) if key else None
+
+
+def restore_file_key(file_name, encryption_key_id):
+    """
+    Use the stored key named ``encryption_key_id`` for a file whose upload is being
+    resumed. Returns False when the key store does not have it.
+    """
+    key = key_store.get_by_id(encryption_key_id) if key_store is not None else None
+    if key is None:
+        return False
+    cache_key = (key_store_bucket, file_name)
+    with derive_locks_guard:
+        lock = derive_locks.setdefault(cache_key, threading.Lock())
+    with lock:
+        encryption_keys[file_name] = key
+        file_keys[cache_key] = key
+    return True
+
+
+def encrypt_for_file(data, file_name, offset=0, total_size=None):
+    """
+    Encrypt the bytes at ``offset`` of a file into the chunked object format; see multi_part_format.
+    """
+    key = file_key(file_name)
+    if key is None:
+        return data
+    if total_size is None:
+        total_size = offset + len(data)
+    return multi_part_format.encrypt_range(data, key, offset, total_size)
+
+
+def object_metadata(file_name, file_size, plaintext_sha256=None):
+    """
+    x-amz-meta-* values that let a download decrypt the object from its GET response
+    alone: the scheme, which key, the chunk size and what the plaintext should be.
+    Empty when client-side encryption is off.
+    """
+    key = file_key(file_name)
+    if key is None:
+        return {}
+    metadata = {
+        'encryption': multi_part_format.SCHEME,
+        'key-id': multi_part_keystore.key_id(key),
+        'chunk-size': str(multi_part_format.DEFAULT_CHUNK_SIZE),
+        'plaintext-size': str(file_size),
+    }
+    if plaintext_sha256:
+        metadata['plaintext-sha256'] = plaintext_sha256
+    return metadata
+
+
+def create_upload_client(endpoint_url, region_name, max_concurrency):
+    """
+    Client shared by every request of a run, with one pooled connection per request in
+    flight; botocore's default of 10 would leave the rest waiting for a connection.
+    """
+    return boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name,
+                        config=Config(max_pool_connections=max_concurrency))
+
+
+def get_upload_client(bucket, bucket_region, s3_client=None):
+    # Reuse the caller's client when given one; boto3 clients are thread-safe
+    if s3_client is not None:
+        return s3_client
     s3_endpoint = get_s3_endpoint(bucket)
+    return boto3.client('s3', endpoint_url=s3_endpoint, region_name=bucket_region)
 
-    with open(file_path, 'rb') as file:
-        file.seek(part_size * (part_number - 1))
-        data = file.read(part_size)
-
-        # Retrieve or generate encryption key for the file
-        encryption_key = encryption_keys.get(file_name)
-        if not encryption_key:
-            encryption_key = generate_encryption_key()
-            encryption_keys[file_name] = encryption_key
-
-        # Check if client-side encryption is enabled
-        if encryption_key:
-            encrypted_data, key = encrypt_data(data, encryption_key)
-            encryption_keys[file_name] = key  # Update the key in case it was newly generated
-        else:
-            encrypted_data = data
-
-        # Specify the server-side encryption algorithm
-        s3 = boto3.client('s3', endpoint_url=s3_endpoint, region_name=bucket_region)
-
-        # Use 'Body' directly in the arguments
-        s3_upload_args = {
-            'Bucket': bucket,
-            'Key': file_name,
-            'UploadId': upload_id,
-            'PartNumber': part_number,
-            'Body': encrypted_data,
-        }
-
-        try:
-            response = s3.upload_part(**s3_upload_args)
-        except Exception as e:
-            click.echo(f"An error occurred: {str(e)}")
-            return {"PartNumber": part_number, "Error": str(e)}
 
-    etag = response["ETag"]
-    return {"PartNumber": part_number, "ETag": etag}
+def read_part(file_path, offset, length, reader=None):
+    # A shared PartReader hands out a view of its mmap instead of a fresh copy
+    if reader is not None:
+        return reader.part(offset, length)
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        return file.read(length)
+
+
+def prepare_part(file_path, file_name, offset, length, reader=None, checksum_algorithm=None):
+    """
+    Read and encrypt one part. Returns (body, checksum of the body or None).
+    """
+    key = file_key(file_name)
+    if encryption_stage is not None and key:
+        # Read and encrypted by a worker process; only the key derived here is sent to it
+        return encryption_stage.encrypt_range(file_path, offset, length, key, checksum_algorithm)
+
+    data = read_part(file_path, offset, length, reader)
+    # Parts are encrypted independently; the file size tells the part holding the last chunk
+    encrypted_data = encrypt_for_file(data, file_name, offset, os.path.getsize(file_path))
+    # Checksummed in memory, on exactly the bytes being sent, so the file is never read twice
+    part_checksum = multi_part_checksum.checksum(checksum_algorithm, encrypted_data) if checksum_algorithm else None
+    return encrypted_data, part_checksum
+
+
+def prepare_file(file_path, file_name, checksum_algorithm=None):
+    """
+    Read and encrypt a whole small file. Returns (body, checksum of the body or None).
+    """
+    key = file_key(file_name)
+    if encryption_stage is not None and key:
+        return encryption_stage.encrypt_range(file_path, 0, None, key, checksum_algorithm)
 
+    with open(file_path, 'rb') as file:
+        data = file.read()
 
-@click.option("--target-part-size", default=None, type=int, help="Size of each part in bytes")
-@click.option("--num-parts", default=None, type=int, help="Number of parts for each file")
-def upload_folder(folder_path, bucket, target_part_size=None, num_parts=None):
-    try:
-        # Get S3 bucket region
-        s3_bucket = boto3.resource('s3').Bucket(bucket)
-        bucket_region = s3_bucket.meta.client.meta.region_name
+    encrypted_data = encrypt_for_file(data, file_name)
+    file_checksum = multi_part_checksum.checksum(checksum_algorithm, encrypted_data) if checksum_algorithm else None
+    return encrypted_data, file_checksum
 
-        # Use the correct S3 endpoint for the specified region
-        s3_endpoint = get_s3_endpoint(bucket)
 
-        # Upload files in the folder
-        s3 = boto3.client('s3', endpoint_url=s3_endpoint, region_name=bucket_region)
-        parts_total = []
+def upload_part(args, bucket_region='us-east-1', s3_client=None, reader=None, checksum_algorithm=None):
+    part_number, upload_id, file_path, bucket, file_name, part_size = args
 
-        # Get a list of all files in the folder
-        file_paths = [os.path.join(folder_path, file) for file in os.listdir(folder_path) if
-                      os.path.isfile(os.path.join(folder_path, file))]
+    encrypted_data, part_checksum = prepare_part(file_path, file_name, part_size * (part_number - 1), part_size,
+                                                 reader, checksum_algorithm)
+    if isinstance(encrypted_data, memoryview):
+        encrypted_data = multi_part_reader.PartBody(encrypted_data)
+    s3 = get_upload_client(bucket, bucket_region, s3_client)
+
+    # Use 'Body' directly in the arguments
+    s3_upload_args = {
+        'Bucket': bucket,
+        'Key': file_name,
+        'UploadId': upload_id,
+        'PartNumber': part_number,
+        'Body': encrypted_data,
+    }
+    if part_checksum:
+        s3_upload_args['ChecksumAlgorithm'] = checksum_algorithm
+        s3_upload_args[multi_part_checksum.field(checksum_algorithm)] = part_checksum
 
-        # Prompt the user for the number of parts and part size
-        if target_part_size is None or num_parts is None:
-            total_file_size = sum(os.path.getsize(file) for file in file_paths)
+    try:
+        response = s3.upload_part(**s3_upload_args)
+    except Exception as e:
+        click.echo(f"An error occurred: {str(e)}")
+        return {"PartNumber": part_number, "Error": str(e), "Code": multi_part_retry.error_code(e)}
 
-            # Calculate the default part size based on file size
-            default_part_size = min(max(5 * 1024 * 1024, total_file_size // 100), 100 * 1024 * 1024)
-            click.echo(f"Default part size: {default_part_size} bytes")
+    etag = response["ETag"]
+    part = {"PartNumber": part_number, "ETag": etag}
+    if part_checksum:
+        # complete_multipart_upload needs every part's checksum
+        part[multi_part_checksum.field(checksum_algorithm)] = part_checksum
+    return part
 
-            # Prompt the user for part size if not provided
-            target_part_size = click.prompt("Enter part size (in bytes)", default=default_part_size, type=int)
 
-            # Ensure the part size meets the minimum requirement
-            target_part_size = max(target_part_size, 5 * 1024 * 1024)
+def put_file(args, bucket_region='us-east-1', s3_client=None, checksum_algorithm=None, metadata=None):
+    """
+    Upload a small file with a single PutObject request.
+    """
+    file_path, bucket, file_name = args
 
-            # Prompt the user for the number of parts if not provided
-            num_parts = click.prompt("Enter the number of parts for all files", default=num_parts, type=int)
+    encrypted_data, file_checksum = prepare_file(file_path, file_name, checksum_algorithm)
+    s3 = get_upload_client(bucket, bucket_region, s3_client)
 
-        for file_path in file_paths:
-            file_name = os.path.basename(file_path)
-            response = s3.create_multipart_upload(Bucket=bucket, Key=file_name)
-            upload_id = response['UploadId']
+    s3_put_args = {'Bucket': bucket, 'Key': file_name, 'Body': encrypted_data}
+    if metadata:
+        s3_put_args['Metadata'] = metadata
+    if file_checksum:
+        s3_put_args['ChecksumAlgorithm'] = checksum_algorithm
+        s3_put_args[multi_part_checksum.field(checksum_algorithm)] = file_checksum
 
-            # Calculate part size based on file size and user input
-            file_size = os.path.getsize(file_path)
+    try:
+        response = s3.put_object(**s3_put_args)
+    except Exception as e:
+        click.echo(f"An error occurred: {str(e)}")
+        return {"Error": str(e), "Code": multi_part_retry.error_code(e)}
+
+    if file_checksum:
+        mismatch = multi_part_checksum.mismatch(checksum_algorithm, file_checksum, response)
+        if mismatch:
+            # S3 stored other bytes than were sent, so sending them again may succeed
+            return {"Error": mismatch, "Code": 'BadDigest'}
+    return {"ETag": response["ETag"]}
+
+
+def upload_folder(folder_path, bucket, target_part_size=None, num_parts=None,
+                  max_concurrency=None, adaptive=True,
+                  multipart_threshold=multi_part_scheduler.DEFAULT_MULTIPART_THRESHOLD, resume=False,
+                  max_memory=None, plan_only=False, recursive=False, prefix="", files=None, list_contents=True,
+                  dedup=False, checksum_algorithm=multi_part_checksum.DEFAULT_CHECKSUM_ALGORITHM,
+                  max_attempts=multi_part_retry.DEFAULT_MAX_ATTEMPTS, engine='threads', encryption_workers=0,
+                  encrypt=True):
+    global encryption_stage, key_store, key_store_bucket, client_side_encryption
+    uploads = []
+    try:
+        if not os.path.isdir(folder_path):
+            raise FileNotFoundError(folder_path)
+        if resume and engine == 'asyncio':
+            raise ValueError("--resume needs the thread engine; uploads on the asyncio engine are not journaled")
+        if max_concurrency is None:
+            # A waiting coroutine is far cheaper than a waiting thread, so the event loop holds more requests
+            max_concurrency = (multi_part_async.DEFAULT_ASYNC_CONCURRENCY if engine == 'asyncio'
+                               else multi_part_concurrency.DEFAULT_MAX_CONCURRENCY)
+
+        # Files are discovered lazily; each one is keyed by its path relative to the folder.
+        # A caller that has already chosen the files (such as sync) passes them in instead.
+        if files is None:
+            files = multi_part_scan.scan_files(folder_path, recursive=recursive)
+
+        def plan(file_size):
+            # Pick a part size for each file from its size and the S3 part limits
+            return multi_part_planner.plan_part_size(file_size, target_parts=num_parts, part_size=target_part_size)
+
+        checksum_algorithm = multi_part_checksum.check_algorithm(checksum_algorithm)
+
+        if plan_only:
+            multi_part_planner.show_plan([(multi_part_scan.object_key(prefix, relative_path), stat.st_size,
+                                           plan(stat.st_size))
+                                          for file_path, relative_path, stat in files], multipart_threshold)
+            return
 
-            # Adjust part size based on file size
-            part_size = min(target_part_size, file_size)
+        # Get S3 bucket region
+        s3_bucket = boto3.resource('s3').Bucket(bucket)
+        bucket_region = s3_bucket.meta.client.meta.region_name
 
-            # Calculate the number of parts based on the adjusted part size
-            num_parts = calculate_number_of_parts(file_size, part_size)
+        # Use the correct S3 endpoint for the specified region
+        s3_endpoint = get_s3_endpoint(bucket)
 
-            # Use ThreadPoolExecutor for parallel uploads with increased workers
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                args_list = [(part_number, upload_id, file_path, bucket, file_name, part_size)
-                             for part_number in range(1, num_parts + 1)]
+        # Upload files in the folder
+        s3 = create_upload_client(s3_endpoint, bucket_region, max_concurrency)
+        parts_total = []
 
-                # Upload parts in parallel
-                parts = list(executor.map(lambda args: upload_part(args, bucket_region), args_list))
+        # One scheduler for the whole folder: parts of every file share a single pool
+        # Every finished part is journaled so an interrupted run can be resumed
+        journal = multi_part_journal.UploadJournal()
+        budget = multi_part_memory.MemoryBudget(multi_part_memory.parse_size(max_memory))
+        concurrency = multi_part_concurrency.AdaptiveConcurrency(maximum=max_concurrency, adaptive=adaptive,
+                                                                 name="upload")
+        retry = multi_part_retry.RetryPolicy(max_attempts=max_attempts)
+        deduplicator = None
+
+        def metadata(upload):
+            # A dedup run has already hashed the plaintext; otherwise it is not read an extra time to hash it
+            plaintext_sha256 = deduplicator.digests.get(upload.key) if deduplicator else None
+            return object_metadata(upload.key, upload.file_size, plaintext_sha256)
+
+        def key_id(upload):
+            return file_key_id(upload.key)
+
+        def restore_key(upload, encryption_key_id):
+            return restore_file_key(upload.key, encryption_key_id)
+
+        # Each file's key is inserted as soon as it is generated, before its first part is sent.
+        # Finished uploads add a row for the version (ETag) they created; the store is never rewritten.
+        keystore = multi_part_keystore.KeyStore()
+        key_store, key_store_bucket, client_side_encryption = keystore, bucket, encrypt
+        try:
+            # With dedup, content the bucket already holds is copied on the server instead of re-sent.
+            # A copy is only useful while we still have the source's encryption key.
+            if dedup:
+                hash_cache = multi_part_dedup.HashCache().load()
+                deduplicator = multi_part_dedup.Deduplicator(
+                    s3, bucket, hash_cache,
+                    can_copy=lambda key: key in encryption_keys or keystore.get(bucket, key) is not None)
+            # Started before the scheduler so the worker processes are forked before any I/O thread exists.
+            # Opt-in: the workers read each part themselves and send the ciphertext back through a pipe,
+            # copies the mmap PartReader otherwise avoids, so the part cost counts them instead.
+            if encryption_workers and encrypt:
+                encryption_stage = multi_part_encryption.EncryptionStage(multi_part_format.encrypt_range,
+                                                                         encryption_workers)
+            part_cost = staged_bytes if encryption_stage is not None else buffered_bytes
+            if engine == 'asyncio':
+                # Same scheduling interface, but requests wait on one event loop instead of a thread each
+                client_factory = multi_part_async.default_client_factory(bucket_region, s3_endpoint,
+                                                                         max_concurrency)
+                scheduler = multi_part_async.AsyncPartScheduler(bucket, prepare_part, prepare_file, client_factory,
+                                                                max_concurrency=max_concurrency,
+                                                                multipart_threshold=multipart_threshold,
+                                                                budget=budget, part_cost=part_cost,
+                                                                checksum_algorithm=checksum_algorithm, retry=retry,
+                                                                metadata=metadata,
+                                                                part_reader=encryption_stage is None)
+            else:
+                scheduler = multi_part_scheduler.PartScheduler(s3, bucket, bucket_region, upload_part, put_file,
+                                                               multipart_threshold=multipart_threshold,
+                                                               journal=journal, resume=resume,
+                                                               budget=budget, part_cost=part_cost,
+                                                               concurrency=concurrency,
+                                                               checksum_algorithm=checksum_algorithm, retry=retry,
+                                                               metadata=metadata,
+                                                               key_id=key_id if encrypt else None,
+                                                               restore_key=restore_key if encrypt else None,
+                                                               part_reader=encryption_stage is None)
+
+            try:
+                # Each file is queued as soon as the scan finds it, reusing the scan's stat
+                for file_path, relative_path, stat in files:
+                    key = multi_part_scan.object_key(prefix, relative_path)
+                    if deduplicator and not deduplicator.route(file_path, key, stat):
+                        continue
+                    scheduler.submit_file(file_path, key, plan(stat.st_size), stat=stat)
+            finally:
+                uploads = scheduler.join()
+                if deduplicator:
+                    for upload in uploads:
+                        deduplicator.uploaded(upload)
+                    hash_cache.save()
 
             # Check for errors in parts
-            errors = [part for part in parts if 'Error' in part]
-            if errors:
-                for error in errors:
-                    click.echo(f"Error uploading part {error['PartNumber']}: {error['Error']}")
+            retries = sum(upload.retries for upload in uploads)
+            if retries:
+                click.echo(f"{retries} failed requests were retried")
+
+            failed = [upload for upload in uploads if upload.failed]
+            if failed:
+                for upload in failed:
+                    for error in upload.errors:
+                        click.echo(f"Error uploading {upload.key} part {error['PartNumber']}: {error['Error']}")
+                    if upload.aborted:
+                        click.echo(f"Aborted the multipart upload of {upload.key}; no parts are left in the bucket.")
+                # Files that did upload still need their keys to be readable
+                save_encryption_keys(keystore, bucket, uploaded_keys(uploads))
                 raise Exception("Upload failed.")
 
-            s3.complete_multipart_upload(
-                Bucket=bucket,
-                Key=file_name,
-                UploadId=upload_id,
-                MultipartUpload={"Parts": parts}
-            )
-
-            parts_total.extend(parts)
-            click.echo(f"{file_name} uploaded successfully. Encryption Key: {encryption_keys[file_name]}")
-
-        click.echo("All files in the folder uploaded successfully.")
-
-        # Save the encryption keys at the end of the upload process
-        save_encryption_keys()
-
-        # List contents of the bucket
-        try:
-            s3_bucket = boto3.resource('s3').Bucket(bucket)
-            objects = s3_bucket.objects.all()
-
-            click.echo(f"Contents of bucket '{bucket}':")
-            for obj in objects:
-                click.echo(obj.key)
-
-        except NoCredentialsError:
-            click.echo("Credentials not available. Please set up your AWS credentials.")
-        except Exception as e:
-            click.echo(f"An error occurred: {str(e)}")
+            for upload in uploads:
+                parts_total.extend(upload.parts.values())
+                if upload.resumed_parts:
+                    click.echo(f"{upload.key} resumed with {upload.resumed_parts} of {upload.num_parts} parts already uploaded.")
+                encryption_key = encryption_keys.get(upload.key)
+                if encryption_key:
+                    click.echo(f"{upload.key} uploaded successfully. Encryption Key: {encryption_key}")
+                else:
+                    # Unencrypted, or resumed with every part already sent and no key to look up
+                    click.echo(f"{upload.key} uploaded successfully. No encryption key was used for it in this run.")
+
+            entries = uploaded_keys(uploads)
+            if deduplicator:
+                copied = 0
+                for key, source_key, error in deduplicator.copy_all():
+                    if error:
+                        click.echo(f"Error copying {source_key} to {key}: {error}")
+                        continue
+                    # The copy holds the same ciphertext, so it decrypts with the source's key
+                    encryption_keys[key] = encryption_keys.get(source_key) or keystore.get(bucket, source_key)
+                    entries.append((key, encryption_keys[key], None))
+                    copied += 1
+                    click.echo(f"{key} copied from identical {source_key} on the server.")
+                click.echo(f"Deduplication: {copied} of {len(deduplicator.copies)} duplicate files created "
+                           f"with server-side copies")
+
+            limit = multi_part_memory.format_size(budget.limit) if budget.limit else "unlimited"
+            click.echo(f"Memory high-water mark: {multi_part_memory.format_size(budget.high_water)} "
+                       f"(limit {limit}), at most {scheduler.peak_in_flight} requests in flight")
+            if adaptive and engine == 'threads':
+                click.echo(f"Concurrency finished at {concurrency.limit} after {len(concurrency.decisions)} adjustments")
+
+            if checksum_algorithm:
+                click.echo(f"Every part sent with a {checksum_algorithm} checksum and verified on completion")
+
+            single_request = sum(1 for upload in uploads if upload.single_request)
+            click.echo(f"Multipart threshold: {multipart_threshold} bytes "
+                       f"({single_request} files sent with PutObject, {len(uploads) - single_request} with multipart uploads)")
+            click.echo("All files in the folder uploaded successfully.")
+
+            # Save the encryption keys at the end of the upload process
+            save_encryption_keys(keystore, bucket, entries)
+
+            # List contents of the bucket
+            try:
+                if not list_contents:
+                    return uploads
+                s3_bucket = boto3.resource('s3').Bucket(bucket)
+                objects = s3_bucket.objects.all()
+
+                click.echo(f"Contents of bucket '{bucket}':")
+                for obj in objects:
+                    click.echo(obj.key)
+
+            except NoCredentialsError:
+                click.echo("Credentials not available. Please set up your AWS credentials.")
+            except Exception as e:
+                click.echo(f"An error occurred: {str(e)}")
+        finally:
+            # Whatever failed, the worker processes, the key store's connection and the run's keys go with the run
+            key_store = key_store_bucket = None
+            client_side_encryption = True
+            file_keys.clear()
+            derive_locks.clear()
+            encryption_keys.clear()
+            if encryption_stage is not None:
+                encryption_stage.close()
+                encryption_stage = None
+            keystore.close()
 
     except FileNotFoundError:
         click.echo(f"The folder '{folder_path}' does not exist.")
     except NoCredentialsError:
         click.echo("Credentials not available. Please provide valid AWS access key and secret access key.")
     except Exception as e:
-        click.echo(f"An error occurred: {str(e)}")
\ No newline at end of file
+        click.echo(f"An error occurred: {str(e)}")
+    return uploads
\ No newline at end of file
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+
+def write_random(path, size):
+    with open(path, 'wb') as file:
+        file.write(os.urandom(size))
+    return path
+
+
+@pytest.fixture
+def make_files(tmpdir):
+    """Write files of random bytes, file_0.bin, file_1.bin, ..., with the given sizes; returns their paths."""
+    def make(sizes):
+        return [write_random(os.path.join(str(tmpdir), f"file_{index}.bin"), size)
+                for index, size in enumerate(sizes)]
+    return make
+
+
+@pytest.fixture
+def make_file(tmpdir):
+    """Write one file of random bytes, big.bin, of the given size; returns its path."""
+    return lambda size: write_random(os.path.join(str(tmpdir), "big.bin"), size)
@@ -0,0 +1,238 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from botocore.exceptions import ClientError
+
+from dev import multi_part_async
+from dev.multi_part_async import AsyncPartScheduler, download_objects
+from dev.multi_part_checksum import checksum, composite_checksum
+from dev.multi_part_concurrency import AdaptiveConcurrency
+from dev.multi_part_reader import PartBody
+from dev.multi_part_retry import RetryPolicy
+
+
+def prepare_part(file_path, file_name, offset, length, reader=None, checksum_algorithm=None):
+    from dev.multi_part_checksum import checksum
+    data = bytes(reader.part(offset, length))
+    return data, checksum(checksum_algorithm, data) if checksum_algorithm else None
+
+
+def prepare_file(file_path, file_name, checksum_algorithm=None):
+    with open(file_path, 'rb') as file:
+        return file.read(), None
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def read(self):
+        return self.data
+
+
+class FakeAsyncS3:
+    """Just enough of an aiobotocore client, recording calls and how many ran at once."""
+    def __init__(self, objects=None, fail_parts=None, fail_ranges=()):
+        self.objects = objects or {}
+        self.fail_parts = dict(fail_parts or {})
+        self.fail_ranges = set(fail_ranges)
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def _call(self, name, **kwargs):
+        self.calls.append((name, kwargs))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+    async def put_object(self, **kwargs):
+        await self._call('put_object', **kwargs)
+        return {'ETag': '"put"'}
+
+    async def create_multipart_upload(self, **kwargs):
+        await self._call('create_multipart_upload', **kwargs)
+        return {'UploadId': 'u1'}
+
+    async def upload_part(self, **kwargs):
+        await self._call('upload_part', **kwargs)
+        if self.fail_parts.get(kwargs['PartNumber']):
+            self.fail_parts[kwargs['PartNumber']] -= 1
+            raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Reduce your request rate'}}, 'UploadPart')
+        return {'ETag': f'"etag-{kwargs["PartNumber"]}"'}
+
+    async def complete_multipart_upload(self, **kwargs):
+        await self._call('complete_multipart_upload', **kwargs)
+        parts = kwargs['MultipartUpload']['Parts']
+        return {'ETag': '"done"', 'ChecksumCRC32': composite_checksum('CRC32', [part['ChecksumCRC32'] for part in parts])}
+
+    async def abort_multipart_upload(self, **kwargs):
+        await self._call('abort_multipart_upload', **kwargs)
+
+    async def get_object(self, **kwargs):
+        await self._call('get_object', **kwargs)
+        data = self.objects[kwargs['Key']]
+        start, end = (int(bound) for bound in kwargs['Range'][len('bytes='):].split('-'))
+        if start in self.fail_ranges:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'Try again'}}, 'GetObject')
+        return {'Body': FakeBody(data[start:end + 1]), 'ETag': '"v1"',
+                'ContentRange': f"bytes {start}-{min(end, len(data) - 1)}/{len(data)}"}
+
+
+def test_many_small_files_share_one_loop(make_files):
+    s3 = FakeAsyncS3()
+    scheduler = AsyncPartScheduler("bucket", prepare_part, prepare_file, lambda: s3, max_concurrency=50,
+                                   multipart_threshold=1000)
+    for path in make_files([10] * 200):
+        scheduler.submit_file(path, os.path.basename(path), 100)
+    uploads = scheduler.join()
+
+    assert all(upload.etag == '"put"' for upload in uploads)
+    assert len(s3.calls) == 200
+    # Far more requests in flight than the thread engine would give threads for, but never over the limit
+    assert 20 < s3.peak <= 50
+    assert scheduler.peak_in_flight <= 50
+
+
+def test_multipart_retries_failed_parts_and_verifies_checksum(make_files):
+    s3 = FakeAsyncS3(fail_parts={2: 1})
+    scheduler = AsyncPartScheduler("bucket", prepare_part, prepare_file, lambda: s3, max_concurrency=4,
+                                   multipart_threshold=0, checksum_algorithm='CRC32',
+                                   retry=RetryPolicy(base_delay=0.001))
+    path, = make_files([40])
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert not upload.failed
+    assert upload.etag == '"done"'
+    assert upload.retries == 1
+    sent = sorted(kwargs['PartNumber'] for name, kwargs in s3.calls if name == 'upload_part')
+    assert sent == [1, 2, 2, 3, 4]
+
+
+def test_parts_are_sent_from_the_mapping(make_files):
+    s3 = FakeAsyncS3()
+    sent = {}
+
+    async def upload_part(**kwargs):
+        # Read while the request is in flight, as aiohttp would, before the view is released
+        sent[kwargs['PartNumber']] = (kwargs['Body'], bytes(kwargs['Body'].read()))
+        return {'ETag': '"etag"'}
+    s3.upload_part = upload_part
+
+    def prepare_view(file_path, file_name, offset, length, reader=None, checksum_algorithm=None):
+        view = reader.part(offset, length)
+        return view, checksum(checksum_algorithm, view)
+
+    scheduler = AsyncPartScheduler("bucket", prepare_view, prepare_file, lambda: s3, max_concurrency=4,
+                                   multipart_threshold=0, checksum_algorithm='CRC32')
+    path, = make_files([40])
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert upload.etag == '"done"'
+    with open(path, 'rb') as file:
+        content = file.read()
+    assert all(isinstance(body, PartBody) for body, _ in sent.values())
+    assert b''.join(sent[number][1] for number in sorted(sent)) == content
+
+
+def test_multipart_is_aborted_when_a_part_keeps_failing(make_files):
+    s3 = FakeAsyncS3(fail_parts={3: 100})
+    scheduler = AsyncPartScheduler("bucket", prepare_part, prepare_file, lambda: s3, max_concurrency=4,
+                                   multipart_threshold=0, retry=RetryPolicy(max_attempts=2, base_delay=0.001))
+    path, = make_files([40])
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert upload.failed and upload.aborted
+    assert [name for name, _ in s3.calls].count('complete_multipart_upload') == 0
+
+
+def test_ranged_download_reassembles_the_object(tmpdir):
+    data = os.urandom(100)
+    s3 = FakeAsyncS3(objects={'obj': data, 'missing': None})
+    local_path = str(tmpdir.join('obj'))
+    results = download_objects([('obj', local_path), ('missing', str(tmpdir.join('missing')))], "bucket",
+                               lambda: s3, chunk_size=30)
+
+    assert results['obj'] == 100
+    assert isinstance(results['missing'], str)
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    ranges = [kwargs for _, kwargs in s3.calls if kwargs['Key'] == 'obj']
+    # The probe is the first range; the other three are pinned to its ETag
+    assert len(ranges) == 4
+    assert 'IfMatch' not in ranges[0] and all(kwargs['IfMatch'] == '"v1"' for kwargs in ranges[1:])
+
+
+def test_ranged_download_starts_from_the_probe_and_bounds_its_ranges(tmpdir):
+    data = os.urandom(1000)
+    s3 = FakeAsyncS3(objects={'obj': data})
+    probe = (data[:10], {'ETag': '"v1"', 'ContentRange': "bytes 0-9/1000"})
+    local_path = str(tmpdir.join('obj'))
+    results = download_objects([('obj', local_path)], "bucket", lambda: s3, max_concurrency=4, chunk_size=10,
+                               probes={'obj': probe})
+
+    assert results['obj'] == 1000
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    # The probe was the first range, so only the other 99 were fetched, never more than 4 at once
+    assert [kwargs['Range'] for _, kwargs in s3.calls][0] == "bytes=10-19"
+    assert len(s3.calls) == 99
+    assert s3.peak == 4
+
+
+def test_ranged_download_holds_the_adaptive_limit(tmpdir):
+    data = os.urandom(200)
+    s3 = FakeAsyncS3(objects={'obj': data})
+    concurrency = AdaptiveConcurrency(maximum=3, adaptive=False)
+    results = download_objects([('obj', str(tmpdir.join('obj')))], "bucket", lambda: s3, chunk_size=10,
+                               concurrency=concurrency)
+
+    assert results['obj'] == 200
+    assert s3.peak == 3
+    assert concurrency.in_use == 0
+
+
+def test_interrupted_ranged_download_resumes(tmpdir):
+    data = os.urandom(100)
+    local_path = str(tmpdir.join('obj'))
+    s3 = FakeAsyncS3(objects={'obj': data}, fail_ranges={50})
+    results = download_objects([('obj', local_path)], "bucket", lambda: s3, chunk_size=10)
+
+    assert isinstance(results['obj'], str)
+    assert not os.path.exists(local_path)
+    assert os.path.exists(local_path + '.downloading')
+
+    s3 = FakeAsyncS3(objects={'obj': data})
+    assert download_objects([('obj', local_path)], "bucket", lambda: s3, chunk_size=10)['obj'] == 100
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    assert not os.path.exists(local_path + '.downloading')
+    # Only the probe and the range that failed went out again
+    assert [kwargs['Range'] for _, kwargs in s3.calls] == ["bytes=0-9", "bytes=50-59"]
+
+
+def test_engine_reports_missing_dependency(monkeypatch):
+    monkeypatch.setattr(multi_part_async, 'get_session', None)
+    with pytest.raises(RuntimeError, match="aiobotocore"):
+        multi_part_async.default_client_factory()
@@ -0,0 +1,79 @@
+import os
+import sys
+import zlib
+import base64
+import hashlib
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+
+from dev import multi_part_upload
+from dev.multi_part_checksum import check_algorithm, checksum, composite_checksum
+from dev.multi_part_scheduler import PartScheduler
+
+
+def test_checksums_match_s3_encoding():
+    assert checksum('CRC32', b'hello') == base64.b64encode(zlib.crc32(b'hello').to_bytes(4, 'big')).decode()
+    assert checksum('SHA256', memoryview(b'hello')) == base64.b64encode(hashlib.sha256(b'hello').digest()).decode()
+
+    parts = [checksum('SHA256', b'a'), checksum('SHA256', b'b')]
+    joined = hashlib.sha256(b'a').digest() + hashlib.sha256(b'b').digest()
+    assert composite_checksum('SHA256', parts) == base64.b64encode(hashlib.sha256(joined).digest()).decode() + "-2"
+
+
+def test_check_algorithm():
+    assert check_algorithm('sha256') == 'SHA256'
+    assert check_algorithm('none') is None
+    with pytest.raises(ValueError):
+        check_algorithm('MD5')
+
+
+def test_upload_part_checksums_the_bytes_it_sends(tmpdir, monkeypatch):
+    path = tmpdir.join('data.bin')
+    path.write_binary(os.urandom(100))
+    monkeypatch.setattr(multi_part_upload, 'encrypt_for_file', lambda data, file_name, *args: b'ciphertext' + bytes(data))
+    s3 = MagicMock()
+    s3.upload_part.return_value = {'ETag': '"e1"'}
+
+    part = multi_part_upload.upload_part((1, 'u1', str(path), 'bucket', 'data.bin', 100), s3_client=s3,
+                                         checksum_algorithm='SHA256')
+    sent = s3.upload_part.call_args.kwargs
+    assert sent['ChecksumAlgorithm'] == 'SHA256'
+    assert sent['ChecksumSHA256'] == checksum('SHA256', sent['Body'])
+    assert part == {"PartNumber": 1, "ETag": '"e1"', "ChecksumSHA256": sent['ChecksumSHA256']}
+
+
+def run_upload(tmpdir, stored_checksum):
+    path = tmpdir.join('big.bin')
+    path.write_binary(os.urandom(40))
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    part_checksums = {}
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None, checksum_algorithm=None):
+        part_checksums[args[0]] = checksum(checksum_algorithm, bytes(reader.part((args[0] - 1) * 10, 10)))
+        return {"PartNumber": args[0], "ETag": f"etag-{args[0]}", "ChecksumCRC32": part_checksums[args[0]]}
+
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", fake_upload_part, max_concurrency=2,
+                              multipart_threshold=0, checksum_algorithm='CRC32')
+    s3.complete_multipart_upload.side_effect = lambda **kwargs: {
+        'ETag': '"done"', 'ChecksumCRC32': stored_checksum or composite_checksum(
+            'CRC32', [part_checksums[number] for number in sorted(part_checksums)])}
+    scheduler.submit_file(str(path), "big.bin", 10)
+    upload, = scheduler.join()
+    assert s3.create_multipart_upload.call_args.kwargs['ChecksumAlgorithm'] == 'CRC32'
+    return upload
+
+
+def test_completed_upload_is_verified_against_its_parts(tmpdir):
+    upload = run_upload(tmpdir, None)
+    assert not upload.failed
+    assert upload.etag == '"done"'
+
+
+def test_checksum_mismatch_fails_the_upload(tmpdir):
+    upload = run_upload(tmpdir, "AAAAAA==-4")
+    assert upload.failed
+    assert "checksum mismatch" in upload.errors[0]['Error']
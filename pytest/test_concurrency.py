@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from botocore.exceptions import ClientError
+
+from dev.multi_part_concurrency import AdaptiveConcurrency, is_throttle
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_window(controller, clock, nbytes, seconds):
+    """Run one full window of parallel requests that each moved ``nbytes`` in ``seconds``."""
+    clock.now += seconds
+    for _ in range(controller.limit):
+        controller.record(nbytes, seconds)
+
+
+def test_additive_increase_while_throughput_improves(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    controller = AdaptiveConcurrency(initial=4, maximum=8)
+
+    run_window(controller, clock, 1000, 1.0)
+    assert controller.limit == 5
+    run_window(controller, clock, 2000, 1.0)
+    assert controller.limit == 6
+    # 6 x 1700 B/s is no real gain over 5 x 2000 B/s, so the limit holds
+    run_window(controller, clock, 1700, 1.0)
+    assert controller.limit == 6
+    # Requests slowing to a third of their best with no throughput gain backs off
+    run_window(controller, clock, 600, 1.0)
+    assert controller.limit == 4
+    assert controller.decisions[-1][2] == "latency rising without more throughput"
+
+
+def test_throttling_halves_once_per_window():
+    controller = AdaptiveConcurrency(initial=10, maximum=64)
+    controller.throttled()
+    controller.throttled()
+    assert controller.limit == 5
+    assert controller.decisions == [(10, 5, "throttled by S3")]
+
+
+def test_fixed_concurrency_never_moves():
+    controller = AdaptiveConcurrency(maximum=12, adaptive=False)
+    controller.throttled()
+    controller.record(10 ** 9, 0.1)
+    assert controller.limit == 12
+
+
+def test_is_throttle():
+    slow_down = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Reduce your request rate'}}, 'UploadPart')
+    denied = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'no'}}, 'UploadPart')
+    assert is_throttle(slow_down)
+    assert not is_throttle(denied)
+    assert is_throttle({"PartNumber": 1, "Error": "x", "Code": "503"})
+    assert not is_throttle({"PartNumber": 1, "Error": "x", "Code": None})
@@ -0,0 +1,99 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from botocore.exceptions import ClientError
+
+from dev import multi_part_dedup
+from dev.multi_part_dedup import Deduplicator, HashCache, copy_object
+
+
+def write(tmpdir, name, contents):
+    path = tmpdir.join(name)
+    path.write(contents)
+    return str(path), os.stat(str(path))
+
+
+def test_hash_is_computed_once_per_file_version(tmpdir, monkeypatch):
+    calls = []
+    real_hash = multi_part_dedup.multi_part_hash.calculate_file_hash
+    monkeypatch.setattr(multi_part_dedup.multi_part_hash, 'calculate_file_hash',
+                        lambda path: calls.append(path) or real_hash(path))
+    cache = HashCache(str(tmpdir.join('cache.json')))
+    path, stat = write(tmpdir, 'a.bin', 'same')
+
+    assert cache.hash_for(path, stat) == cache.hash_for(path, stat)
+    cache.save()
+    assert HashCache(cache.path).load().hash_for(path, stat) == cache.hash_for(path, stat)
+    assert len(calls) == 1
+
+    path, stat = write(tmpdir, 'a.bin', 'different')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.hash_for(path, os.stat(path))
+    assert len(calls) == 2
+
+
+def test_duplicates_in_one_run_become_copies(tmpdir):
+    s3 = MagicMock()
+    s3.head_object.return_value = {'ETag': '"e1"', 'ContentLength': 100}
+    cache = HashCache(str(tmpdir.join('cache.json')))
+    deduplicator = Deduplicator(s3, "bucket", cache)
+
+    first = write(tmpdir, 'a.bin', 'same')
+    second = write(tmpdir, 'b.bin', 'same')
+    other = write(tmpdir, 'c.bin', 'other')
+    assert deduplicator.route(first[0], 'a.bin', first[1])
+    assert not deduplicator.route(second[0], 'b.bin', second[1])
+    assert deduplicator.route(other[0], 'c.bin', other[1])
+
+    deduplicator.uploaded(MagicMock(key='a.bin', failed=False, etag='"e1"'))
+    assert deduplicator.copy_all() == [('b.bin', 'a.bin', None)]
+    s3.copy_object.assert_called_once_with(Bucket="bucket", Key='b.bin',
+                                           CopySource={'Bucket': "bucket", 'Key': 'a.bin'})
+
+
+def test_existing_object_is_reused_only_while_unchanged(tmpdir):
+    s3 = MagicMock()
+    cache = HashCache(str(tmpdir.join('cache.json')))
+    path, stat = write(tmpdir, 'new.bin', 'same')
+    cache.remember("bucket", cache.hash_for(path, stat), 'old.bin', '"e1"')
+
+    s3.head_object.return_value = {'ETag': '"e1"', 'ContentLength': 100}
+    deduplicator = Deduplicator(s3, "bucket", cache)
+    assert not deduplicator.route(path, 'new.bin', stat)
+    assert deduplicator.copies[0][:3] == ('new.bin', 'old.bin', 100)
+
+    # Overwritten since it was indexed
+    s3.head_object.return_value = {'ETag': '"e2"', 'ContentLength': 100}
+    assert Deduplicator(s3, "bucket", cache).route(path, 'new.bin', stat)
+    assert cache.lookup("bucket", cache.hash_for(path, stat)) is None
+
+
+def test_no_copy_without_the_source_encryption_key(tmpdir):
+    s3 = MagicMock()
+    s3.head_object.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+    cache = HashCache(str(tmpdir.join('cache.json')))
+    path, stat = write(tmpdir, 'new.bin', 'same')
+    cache.remember("bucket", cache.hash_for(path, stat), 'old.bin', '"e1"')
+
+    assert Deduplicator(s3, "bucket", cache, can_copy=lambda key: False).route(path, 'new.bin', stat)
+    s3.head_object.assert_not_called()
+
+
+def test_large_objects_are_copied_in_ranges(monkeypatch):
+    monkeypatch.setattr(multi_part_dedup, 'MAX_COPY_OBJECT_SIZE', 10 * 1024 * 1024)
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    s3.upload_part_copy.side_effect = lambda **kwargs: {'CopyPartResult': {'ETag': f'"{kwargs["PartNumber"]}"'}}
+    s3.complete_multipart_upload.return_value = {'ETag': '"done"'}
+
+    size = 40 * 1024 * 1024 + 7
+    assert copy_object(s3, "bucket", 'big', 'big-copy', size) == '"done"'
+    ranges = [call.kwargs['CopySourceRange'] for call in s3.upload_part_copy.call_args_list]
+    assert f"bytes=0-{5 * 1024 * 1024 - 1}" in ranges
+    assert f"bytes={8 * 5 * 1024 * 1024}-{size - 1}" in ranges
+    parts = s3.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+    assert [part['PartNumber'] for part in parts] == list(range(1, len(parts) + 1))
+    s3.copy_object.assert_not_called()
@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+from cryptography.fernet import Fernet
+
+from dev import multi_part_format, multi_part_upload
+from dev.multi_part_checksum import checksum
+from dev.multi_part_encryption import EncryptionStage
+from dev.multi_part_upload import prepare_file, prepare_part
+
+
+def decrypt(data, key):
+    return multi_part_format.decrypt_frames(data[multi_part_format.HEADER_SIZE:], key,
+                                            bytes(data[:multi_part_format.HEADER_SIZE]), 0, 0)
+
+
+@pytest.fixture
+def stage():
+    stage = EncryptionStage(multi_part_format.encrypt_range, workers=2)
+    yield stage
+    stage.close()
+
+
+def test_workers_run_in_other_processes(stage):
+    assert stage.worker_pids and os.getpid() not in stage.worker_pids
+
+
+def test_range_is_read_and_encrypted_in_a_worker(tmpdir, stage):
+    data = os.urandom(1000)
+    path = str(tmpdir.join('data.bin'))
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    key = Fernet.generate_key()
+    encrypted, encrypted_checksum = stage.encrypt_range(path, 0, None, key, 'CRC32')
+    assert decrypt(encrypted, key) == data
+    assert encrypted_checksum == checksum('CRC32', encrypted)
+
+    encrypted, encrypted_checksum = stage.encrypt_range(path, 0, None, key)
+    assert multi_part_format.decrypt_range(lambda start, end: encrypted[start:end], key, 100, 300,
+                                           len(encrypted)) == data[100:300]
+    assert encrypted_checksum is None
+
+
+def test_prepare_uses_the_stage_and_keeps_the_key(tmpdir, stage, monkeypatch):
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'encryption_stage', stage)
+    path = str(tmpdir.join('data.bin'))
+    with open(path, 'wb') as file:
+        file.write(b'abcdefgh')
+
+    body, body_checksum = prepare_part(path, 'data.bin', 0, 8, checksum_algorithm='SHA256')
+    assert decrypt(body, multi_part_upload.encryption_keys['data.bin']) == b'abcdefgh'
+    assert body_checksum == checksum('SHA256', body)
+
+    body, body_checksum = prepare_file(path, 'whole.bin')
+    assert decrypt(body, multi_part_upload.encryption_keys['whole.bin']) == b'abcdefgh'
+    assert body_checksum is None
+
+
+def test_key_is_derived_once_per_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+    derived = []
+    derive_key = multi_part_upload.derive_key
+    monkeypatch.setattr(multi_part_upload, 'derive_key', lambda key: derived.append(key) or derive_key(key))
+    chunk_size = multi_part_format.DEFAULT_CHUNK_SIZE
+    path = str(tmpdir.join('data.bin'))
+    with open(path, 'wb') as file:
+        file.write(os.urandom(3 * chunk_size + 10))
+
+    bodies = [prepare_part(path, 'data.bin', offset, chunk_size)[0] for offset in range(0, 4 * chunk_size, chunk_size)]
+    assert len(derived) == 1
+    # Every part decrypts with the single key that is saved for the file
+    output = io.BytesIO()
+    multi_part_format.decrypt_stream(io.BytesIO(b''.join(bodies)), output, multi_part_upload.encryption_keys['data.bin'])
+    with open(path, 'rb') as file:
+        assert output.getvalue() == file.read()
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+from botocore.exceptions import ClientError
+from cryptography.fernet import Fernet
+
+from dev import multi_part_download
+from dev.multi_part_dedup import HashCache
+from dev.multi_part_fetch import fetch_all, is_identical, iter_objects, local_path_for
+from dev.multi_part_format import encrypt_range
+from dev.multi_part_sync import SyncManifest
+
+KEY = Fernet.generate_key()
+
+
+class ListingS3:
+    """Lists and serves whole or ranged GETs of in-memory objects, one listing page per two keys."""
+    def __init__(self, objects, metadata=None):
+        self.objects = objects
+        self.metadata = metadata or {}
+        self.gets = []
+        self.heads = []
+
+    def etag(self, key):
+        return '"' + hashlib.md5(self.objects[key]).hexdigest() + '"'
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        for start in range(0, len(keys), 2):
+            yield {'Contents': [{'Key': key, 'Size': len(self.objects[key]), 'ETag': self.etag(key)}
+                                for key in keys[start:start + 2]]}
+
+    def head_object(self, Bucket, Key):
+        self.heads.append(Key)
+        return {'ETag': self.etag(Key), 'ContentLength': len(self.objects[Key]), 'Metadata': self.metadata.get(Key, {})}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        self.gets.append(Key)
+        data = self.objects[Key]
+        if Range is None:
+            return {'Body': io.BytesIO(data), 'ETag': '"v1"', 'Metadata': {}, 'ContentLength': len(data)}
+        start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+        if not data:
+            raise ClientError({'Error': {'Code': 'InvalidRange', 'Message': 'empty'}}, 'GetObject')
+        end = min(end, len(data) - 1)
+        return {'Body': io.BytesIO(data[start:end + 1]), 'ETag': '"v1"', 'Metadata': {},
+                'ContentRange': f"bytes {start}-{end}/{len(data)}"}
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_keys_map_below_the_prefix(tmpdir):
+    root = str(tmpdir)
+    assert local_path_for(root, 'photos/', 'photos/2024/a.jpg') == os.path.join(root, '2024', 'a.jpg')
+    assert local_path_for(root, '', 'a/b.txt') == os.path.join(root, 'a', 'b.txt')
+
+
+@pytest.mark.parametrize("key", ['photos/../../etc/passwd', 'photos/', '../outside'])
+def test_keys_outside_the_directory_are_refused(tmpdir, key):
+    with pytest.raises(ValueError):
+        local_path_for(str(tmpdir), 'photos', key)
+
+
+def test_listing_is_paged_under_the_prefix():
+    s3 = ListingS3({'p/a': b'', 'p/b': b'', 'p/c/d': b'', 'q/e': b''})
+    assert [entry['Key'] for entry in iter_objects(s3, 'bucket', 'p')] == ['p/a', 'p/b', 'p/c/d']
+
+
+def test_prefix_is_downloaded_as_a_tree(tmpdir):
+    plain = os.urandom(5000)
+    secret = os.urandom(3000)
+    s3 = ListingS3({
+        'p/': b'',
+        'p/empty': b'',
+        'p/small.txt': b'hello',
+        'p/deep/er/large.bin': plain,
+        'p/deep/secret.bin': encrypt_range(secret, KEY, 0, len(secret), 1024),
+    })
+    root = str(tmpdir.join('out'))
+
+    stats = fetch_all(s3, 'bucket', 'p', root, iter_objects(s3, 'bucket', 'p'), lambda key: lambda metadata: KEY,
+                      max_concurrency=3, range_size=1024, range_workers=2)
+
+    assert not stats.errors
+    assert (stats.objects, stats.decrypted) == (4, 1)
+    assert stats.bytes == len(plain) + len(secret) + 5
+    assert read(os.path.join(root, 'empty')) == b''
+    assert read(os.path.join(root, 'small.txt')) == b'hello'
+    assert read(os.path.join(root, 'deep', 'er', 'large.bin')) == plain
+    assert read(os.path.join(root, 'deep', 'secret.bin')) == secret
+
+
+def test_ranges_of_all_objects_share_one_bounded_pool(tmpdir):
+    class CountingS3(ListingS3):
+        def __init__(self, objects):
+            super().__init__(objects)
+            self.lock = threading.Lock()
+            self.in_flight = self.most_in_flight = 0
+
+        def get_object(self, **kwargs):
+            with self.lock:
+                self.in_flight += 1
+                self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            time.sleep(0.005)
+            try:
+                return super().get_object(**kwargs)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    s3 = CountingS3({f"large-{number}": os.urandom(8 * 1024) for number in range(6)})
+    root = str(tmpdir)
+
+    stats = fetch_all(s3, 'bucket', '', root, iter_objects(s3, 'bucket', ''), lambda key: lambda metadata: None,
+                      max_concurrency=4, range_size=1024, range_workers=2)
+
+    assert not stats.errors and stats.objects == 6
+    assert s3.most_in_flight <= 4 + 2
+    assert read(os.path.join(root, 'large-5')) == s3.objects['large-5']
+
+
+def test_failures_are_collected_and_the_rest_still_download(tmpdir):
+    secret = os.urandom(100)
+    s3 = ListingS3({'a': b'fine', 'b': encrypt_range(secret, KEY, 0, len(secret), 1024), 'c': b'also fine'})
+    root = str(tmpdir)
+
+    stats = fetch_all(s3, 'bucket', '', root, iter_objects(s3, 'bucket', ''), lambda key: lambda metadata: None,
+                      max_concurrency=2)
+
+    assert stats.objects == 2
+    assert [key for key, error in stats.errors] == ['b']
+    assert sorted(os.listdir(root)) == ['a', 'c']
+
+
+def sync_down(s3, root, manifest, hash_cache):
+    def skip(entry, local_path):
+        return is_identical(s3, 'bucket', entry, local_path, manifest, hash_cache)
+
+    def downloaded(entry, local_path):
+        manifest.record(entry['Key'], os.stat(local_path), entry['ETag'])
+
+    return fetch_all(s3, 'bucket', '', root, iter_objects(s3, 'bucket', ''), lambda key: lambda metadata: KEY,
+                     max_concurrency=2, skip=skip, downloaded=downloaded)
+
+
+def test_sync_fetches_only_what_changed(tmpdir):
+    s3 = ListingS3({'a': b'one', 'b/c': b'two', 'd': b'three'})
+    root = str(tmpdir.join('out'))
+    manifest = SyncManifest('bucket', '', root, directory=str(tmpdir.join('manifest')))
+    hash_cache = HashCache(str(tmpdir.join('hashes.json')))
+
+    assert sync_down(s3, root, manifest, hash_cache).objects == 3
+    s3.gets = []
+    stats = sync_down(s3, root, manifest, hash_cache)
+    assert (stats.objects, stats.skipped, s3.gets, s3.heads) == (0, 3, [], [])
+
+    s3.objects['b/c'] = b'TWO'
+    stats = sync_down(s3, root, manifest, hash_cache)
+    assert (stats.objects, stats.skipped, s3.gets) == (1, 2, ['b/c'])
+    assert read(os.path.join(root, 'b', 'c')) == b'TWO'
+
+
+def test_files_without_a_record_are_compared_by_content(tmpdir):
+    secret = os.urandom(3000)
+    encrypted = encrypt_range(secret, KEY, 0, len(secret), 1024)
+    s3 = ListingS3({'plain': b'same', 'stale': b'new', 'secret': encrypted},
+                   {'secret': {'plaintext-size': str(len(secret)),
+                               'plaintext-sha256': hashlib.sha256(secret).hexdigest()}})
+    root = str(tmpdir)
+    for name, data in [('plain', b'same'), ('stale', b'old'), ('secret', secret)]:
+        with open(os.path.join(root, name), 'wb') as file:
+            file.write(data)
+    manifest = SyncManifest('bucket', '', root, directory=str(tmpdir.join('manifest')))
+
+    stats = sync_down(s3, root, manifest, HashCache(str(tmpdir.join('hashes.json'))))
+
+    assert (stats.objects, stats.skipped) == (1, 2)
+    assert s3.gets == ['stale'] and s3.heads == ['secret']
+    assert sorted(manifest.entries) == ['plain', 'secret', 'stale']
+
+
+def test_download_file_keeps_keys_inside_the_directory(tmpdir, monkeypatch):
+    s3 = ListingS3({'photos/2024/a.jpg': b'jpeg', '../escape': b'nope'})
+    monkeypatch.setattr(multi_part_download.boto3, 'client', lambda *args, **kwargs: s3)
+    monkeypatch.chdir(str(tmpdir))
+    root = str(tmpdir.join('out'))
+
+    multi_part_download.download_file('bucket', 'photos/2024/a.jpg', root)
+    assert read(os.path.join(root, 'photos', '2024', 'a.jpg')) == b'jpeg'
+
+    multi_part_download.download_file('bucket', '../escape', root)
+    assert not os.path.exists(str(tmpdir.join('escape')))
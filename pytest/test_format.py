@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+from cryptography.fernet import Fernet
+
+from dev import multi_part_format
+from dev.multi_part_format import (FormatError, decrypt_range, decrypt_stream, encrypt_range, encrypt_stream,
+                                   encrypted_size, plaintext_size)
+
+KEY = Fernet.generate_key()
+CHUNK = 1024
+
+
+def encrypt_in_parts(data, part_size):
+    return b''.join(encrypt_range(data[offset:offset + part_size], KEY, offset, len(data), CHUNK)
+                    for offset in range(0, max(len(data), 1), part_size))
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK, 5 * CHUNK + 7])
+def test_parts_concatenate_into_one_streamable_object(size):
+    data = os.urandom(size)
+    encrypted = encrypt_in_parts(data, 2 * CHUNK)
+    # No base64: only the header and a nonce and tag per chunk are added
+    assert len(encrypted) == encrypted_size(size, CHUNK)
+    assert plaintext_size(len(encrypted), CHUNK) == size
+
+    output = io.BytesIO()
+    assert decrypt_stream(io.BytesIO(encrypted), output, KEY) == size
+    assert output.getvalue() == data
+
+    streamed = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), streamed, KEY, CHUNK)
+    output = io.BytesIO()
+    decrypt_stream(io.BytesIO(streamed.getvalue()), output, KEY)
+    assert output.getvalue() == data
+
+
+def test_any_range_decrypts_without_the_rest():
+    data = os.urandom(10 * CHUNK + 100)
+    encrypted = encrypt_in_parts(data, 4 * CHUNK)
+    fetched = []
+
+    def fetch(start, end):
+        fetched.append(end - start)
+        return encrypted[start:end]
+
+    for start, end in [(0, 10), (CHUNK - 1, CHUNK + 1), (3 * CHUNK + 5, 9 * CHUNK), (10 * CHUNK, 20 * CHUNK)]:
+        fetched.clear()
+        assert decrypt_range(fetch, KEY, start, end, len(encrypted)) == data[start:end]
+        assert sum(fetched) < len(encrypted)
+
+
+def test_tampering_is_detected():
+    data = os.urandom(3 * CHUNK)
+    encrypted = encrypt_in_parts(data, CHUNK)
+    frame = multi_part_format.frame_size(CHUNK)
+    header = multi_part_format.HEADER_SIZE
+
+    truncated = encrypted[:header + 2 * frame]
+    swapped = encrypted[:header] + encrypted[header + frame:header + 2 * frame] + \
+        encrypted[header:header + frame] + encrypted[header + 2 * frame:]
+    flipped = bytearray(encrypted)
+    flipped[header + 20] ^= 1
+    for corrupt in [truncated, swapped, bytes(flipped)]:
+        with pytest.raises(FormatError):
+            decrypt_stream(io.BytesIO(corrupt), io.BytesIO(), KEY)
+    with pytest.raises(FormatError):
+        decrypt_stream(io.BytesIO(encrypted), io.BytesIO(), Fernet.generate_key())
+
+
+def test_parts_must_start_on_a_chunk():
+    with pytest.raises(ValueError):
+        encrypt_range(b'x' * 10, KEY, 10, 100, CHUNK)
+
+
+class ReadSizes(io.BytesIO):
+    """BytesIO that remembers the largest read asked of it."""
+    largest = 0
+
+    def read(self, size=-1):
+        self.largest = max(self.largest, size if size >= 0 else len(self.getvalue()))
+        return super().read(size)
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 100, 5000])
+def test_fernet_tokens_decrypt_as_a_stream(size):
+    data = os.urandom(size)
+    source = ReadSizes(Fernet(KEY).encrypt(data))
+    destination = io.BytesIO()
+
+    assert multi_part_format.decrypt_fernet_stream(source, destination, KEY, block_size=64) == size
+    assert destination.getvalue() == data
+    assert source.largest == 64
+
+
+def test_metadata_decides_the_scheme_before_the_content():
+    framed = encrypt_range(b'data', KEY, 0, 4)
+    fernet = Fernet(KEY).encrypt(b'data')
+    assert multi_part_format.scheme_of({}, framed) == multi_part_format.SCHEME
+    assert multi_part_format.scheme_of({}, fernet) == multi_part_format.FERNET_SCHEME
+    assert multi_part_format.scheme_of({}, b'plain text') is None
+    # Plaintext that happens to start like a token is not taken for one when the metadata says otherwise
+    recorded = {'encryption': multi_part_format.SCHEME}
+    assert multi_part_format.scheme_of(recorded, b'gAAAAA...') == multi_part_format.SCHEME
+    assert multi_part_format.scheme_of({'encryption': 'other-v9'}, framed) == 'other-v9'
+
+
+def test_tampered_fernet_token_writes_nothing():
+    token = bytearray(Fernet(KEY).encrypt(os.urandom(500)))
+    token[100] = ord('A') if token[100] != ord('A') else ord('B')
+    destination = io.BytesIO()
+    with pytest.raises(FormatError):
+        multi_part_format.decrypt_fernet_stream(io.BytesIO(bytes(token)), destination, KEY, block_size=64)
+    assert destination.getvalue() == b''
+    with pytest.raises(FormatError):
+        multi_part_format.decrypt_fernet_stream(io.BytesIO(Fernet(KEY).encrypt(b'x')), io.BytesIO(),
+                                                Fernet.generate_key())
@@ -0,0 +1,142 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_journal import DownloadJournal, UploadJournal
+from dev.multi_part_scheduler import FileUpload, PartScheduler
+
+
+def test_journal_round_trip_ignores_truncated_line(tmpdir, make_file):
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    upload = FileUpload(make_file(40), "big.bin", 10, multipart_threshold=0)
+    upload.upload_id = "upload-1"
+
+    journal.start("test_bucket", upload)
+    journal.record_part("test_bucket", "big.bin", {"PartNumber": 1, "ETag": "etag-1"})
+    journal.record_part("test_bucket", "big.bin", {"PartNumber": 3, "ETag": "etag-3"})
+    with open(journal.path_for("test_bucket", "big.bin"), 'a') as file:
+        file.write('{"PartNumber": 4, "ET')
+
+    header, parts = journal.load("test_bucket", "big.bin")
+    assert header['upload_id'] == "upload-1"
+    assert header['part_size'] == 10
+    assert parts == {1: "etag-1", 3: "etag-3"}
+
+    journal.remove("test_bucket", "big.bin")
+    assert journal.load("test_bucket", "big.bin") is None
+
+
+def test_resume_only_sends_missing_parts(tmpdir, make_file):
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    path = make_file(40)
+    interrupted = FileUpload(path, "big.bin", 10, multipart_threshold=0)
+    interrupted.upload_id = "upload-1"
+    journal.start("test_bucket", interrupted)
+    journal.record_part("test_bucket", "big.bin", {"PartNumber": 1, "ETag": "etag-1"})
+    journal.record_part("test_bucket", "big.bin", {"PartNumber": 2, "ETag": "etag-2"})
+
+    s3 = MagicMock()
+    # Part 3 reached S3 but the process died before it was journaled
+    s3.get_paginator.return_value.paginate.return_value = [
+        {'Parts': [{'PartNumber': 1, 'ETag': 'etag-1'}, {'PartNumber': 2, 'ETag': 'etag-2'}]},
+        {'Parts': [{'PartNumber': 3, 'ETag': 'etag-3'}]},
+    ]
+    sent = []
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        sent.append(args[0])
+        return {"PartNumber": args[0], "ETag": f"etag-{args[0]}"}
+
+    # A different part size on the resumed run is ignored in favour of the journal
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, max_concurrency=2,
+                              journal=journal, resume=True)
+    scheduler.submit_file(path, "big.bin", 25)
+    upload, = scheduler.join()
+
+    assert sent == [4]
+    assert upload.resumed_parts == 3
+    s3.create_multipart_upload.assert_not_called()
+    completed = s3.complete_multipart_upload.call_args.kwargs
+    assert completed['UploadId'] == "upload-1"
+    assert [part['PartNumber'] for part in completed['MultipartUpload']['Parts']] == [1, 2, 3, 4]
+    assert journal.load("test_bucket", "big.bin") is None
+
+
+def interrupted_upload(path, journal, key_id):
+    interrupted = FileUpload(path, "big.bin", 10, multipart_threshold=0)
+    interrupted.upload_id = "upload-1"
+    journal.start("test_bucket", interrupted, key_id=key_id)
+    journal.record_part("test_bucket", "big.bin", {"PartNumber": 1, "ETag": "etag-1"})
+    s3 = MagicMock()
+    s3.get_paginator.return_value.paginate.return_value = [{'Parts': [{'PartNumber': 1, 'ETag': 'etag-1'}]}]
+    s3.create_multipart_upload.return_value = {'UploadId': 'upload-2'}
+    return path, s3
+
+
+def test_resumed_upload_restores_the_journaled_key(tmpdir, make_file):
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    path, s3 = interrupted_upload(make_file(40), journal, "key-1")
+    restored = []
+    upload_part = MagicMock(side_effect=lambda args, *rest, **kwargs: {"PartNumber": args[0], "ETag": "etag"})
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", upload_part, max_concurrency=2, journal=journal,
+                              resume=True, key_id=lambda upload: "key-1",
+                              restore_key=lambda upload, key_id: restored.append(key_id) or True)
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert restored == ["key-1"]
+    assert upload.resumed_parts == 1
+    s3.create_multipart_upload.assert_not_called()
+
+
+def test_upload_whose_key_is_lost_starts_over(tmpdir, make_file):
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    path, s3 = interrupted_upload(make_file(40), journal, "key-1")
+    upload_part = MagicMock(side_effect=lambda args, *rest, **kwargs: {"PartNumber": args[0], "ETag": "etag"})
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", upload_part, max_concurrency=2, journal=journal,
+                              resume=True, key_id=lambda upload: "key-2", restore_key=lambda upload, key_id: False)
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    # The parts under the lost key are dropped and every part is sent again under the new one
+    s3.abort_multipart_upload.assert_called_once_with(Bucket="test_bucket", Key="big.bin", UploadId="upload-1")
+    assert upload.upload_id == "upload-2" and upload.resumed_parts == 0
+    assert upload_part.call_count == 4
+
+
+def test_unencrypted_journal_is_not_resumed_by_an_encrypting_run(tmpdir, make_file):
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    path, s3 = interrupted_upload(make_file(40), journal, None)
+    key_id = MagicMock(return_value="key-2")
+    upload_part = MagicMock(side_effect=lambda args, *rest, **kwargs: {"PartNumber": args[0], "ETag": "etag"})
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", upload_part, max_concurrency=2, journal=journal,
+                              resume=True, key_id=key_id, restore_key=lambda upload, key_id: True)
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    # Deciding to start over needed no key; the only one asked for is the new upload's
+    assert key_id.call_count == 1
+    s3.abort_multipart_upload.assert_called_once_with(Bucket="test_bucket", Key="big.bin", UploadId="upload-1")
+    assert upload.resumed_parts == 0
+
+
+def test_download_journal_is_only_read_back_for_the_same_version(tmpdir):
+    journal = DownloadJournal(str(tmpdir.join('big.bin.downloading')))
+    version = {'etag': '"v1"', 'size': 300, 'range_size': 100}
+    assert journal.load(version) is None
+
+    journal.start(version)
+    journal.record(0)
+    journal.record(200)
+    with open(journal.path, 'a') as file:
+        file.write('{"offset": 10')
+    assert journal.load(version) == {0, 200}
+    assert journal.load(dict(version, etag='"v2"')) is None
+
+    journal.remove()
+    assert journal.load(version) is None
@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import sqlite3
+import multiprocessing
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev import multi_part_upload
+from dev.multi_part_keystore import KeyStore, key_id
+
+
+def test_lookup_by_version_falls_back_to_newest(tmpdir):
+    store = KeyStore(str(tmpdir.join('keys.db')))
+    store.put('bucket', 'a.bin', b'key-1', version='"etag-1"')
+    store.put('bucket', 'a.bin', b'key-2', version='"etag-2"')
+    store.put('other', 'a.bin', b'key-3')
+
+    assert store.get('bucket', 'a.bin', version='"etag-1"') == b'key-1'
+    assert store.get('bucket', 'a.bin') == b'key-2'
+    assert store.get('bucket', 'a.bin', version='"unknown"') == b'key-2'
+    assert store.get('other', 'a.bin') == b'key-3'
+    assert store.get('bucket', 'missing.bin') is None
+    store.close()
+
+
+def test_legacy_json_is_imported_once(tmpdir):
+    legacy = str(tmpdir.join('encryption_keys.json'))
+    with open(legacy, 'w') as file:
+        json.dump({'old.bin': 'legacy-key'}, file)
+
+    store = KeyStore(str(tmpdir.join('keys.db')), legacy_path=legacy)
+    # The old file had no bucket, so its keys answer for any bucket until replaced
+    assert store.get('any-bucket', 'old.bin') == b'legacy-key'
+    store.put('any-bucket', 'old.bin', b'new-key')
+    assert store.get('any-bucket', 'old.bin') == b'new-key'
+    store.close()
+    assert KeyStore(str(tmpdir.join('keys.db')), legacy_path=legacy).count() == 2
+
+
+def write_keys(path, writer, count):
+    store = KeyStore(path)
+    for batch in range(0, count, 100):
+        store.put_many('bucket', [(f"{writer}/{index}", os.urandom(32), None) for index in range(batch, batch + 100)])
+    store.close()
+
+
+def test_concurrent_processes_do_not_lose_keys(tmpdir):
+    path = str(tmpdir.join('keys.db'))
+    KeyStore(path).close()
+    writers = [multiprocessing.Process(target=write_keys, args=(path, writer, 1000)) for writer in range(3)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+
+    store = KeyStore(path)
+    assert store.count() == 3000
+    assert store.get('bucket', '2/999') is not None
+    store.close()
+
+
+def test_lookup_by_key_id_and_upgrade_of_older_stores(tmpdir):
+    path = str(tmpdir.join('keys.db'))
+    # A store written before key IDs were recorded
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE encryption_keys (bucket TEXT NOT NULL, key TEXT NOT NULL, version TEXT NOT NULL, "
+                       "encryption_key BLOB NOT NULL, created REAL NOT NULL, PRIMARY KEY (bucket, key, version))")
+    connection.execute("INSERT INTO encryption_keys VALUES ('bucket', 'old.bin', '', ?, 0)", (b'old-key',))
+    connection.commit()
+    connection.close()
+
+    store = KeyStore(path)
+    store.put('bucket', 'new.bin', b'new-key')
+    assert store.get_by_id(key_id(b'old-key')) == b'old-key'
+    assert store.get_by_id(key_id(b'new-key')) == b'new-key'
+    assert store.get_by_id(key_id(b'other')) is None
+    store.close()
+
+
+def test_file_keys_are_stored_before_they_are_used(tmpdir, monkeypatch):
+    store = KeyStore(str(tmpdir.join('keys.db')))
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'key_store', store)
+    monkeypatch.setattr(multi_part_upload, 'key_store_bucket', 'bucket')
+
+    key = multi_part_upload.file_key('a.bin')
+    assert store.get('bucket', 'a.bin') == key
+    assert store.get_by_id(key_id(key)) == key
+    # Every later part reuses the stored key
+    assert multi_part_upload.file_key('a.bin') == key
+    assert store.count() == 1
+    store.close()
+
+
+def test_file_keys_are_kept_per_bucket(tmpdir, monkeypatch):
+    store = KeyStore(str(tmpdir.join('keys.db')))
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'key_store', store)
+    monkeypatch.setattr(multi_part_upload, 'key_store_bucket', 'first')
+    first = multi_part_upload.file_key('a.bin')
+
+    # A second run into another bucket stores the key it uses there too
+    monkeypatch.setattr(multi_part_upload, 'key_store_bucket', 'second')
+    second = multi_part_upload.file_key('a.bin')
+    assert store.get('first', 'a.bin') == first
+    assert store.get('second', 'a.bin') == second
+    store.close()
+
+
+def test_resumed_files_get_their_stored_key_back(tmpdir, monkeypatch):
+    store = KeyStore(str(tmpdir.join('keys.db')))
+    store.put('bucket', 'a.bin', b'stored-key')
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'key_store', store)
+    monkeypatch.setattr(multi_part_upload, 'key_store_bucket', 'bucket')
+
+    assert not multi_part_upload.restore_file_key('a.bin', key_id(b'some-other-key'))
+    assert multi_part_upload.restore_file_key('a.bin', key_id(b'stored-key'))
+    assert multi_part_upload.file_key('a.bin') == b'stored-key'
+    assert multi_part_upload.file_key_id('a.bin') == key_id(b'stored-key')
+    store.close()
+
+
+def test_a_failed_run_still_closes_the_stage_and_the_key_store(tmpdir, monkeypatch):
+    closed = []
+
+    class Closes:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def close(self):
+            closed.append(type(self).__name__)
+
+    class FakeKeyStore(Closes):
+        pass
+
+    class FakeStage(Closes):
+        pass
+
+    def broken_scheduler(*args, **kwargs):
+        raise RuntimeError("no scheduler")
+
+    monkeypatch.setattr(multi_part_upload.boto3, 'resource', MagicMock())
+    monkeypatch.setattr(multi_part_upload, 'get_s3_endpoint', lambda bucket: None)
+    monkeypatch.setattr(multi_part_upload, 'create_upload_client', MagicMock())
+    monkeypatch.setattr(multi_part_upload.multi_part_journal, 'UploadJournal', MagicMock())
+    monkeypatch.setattr(multi_part_upload.multi_part_keystore, 'KeyStore', FakeKeyStore)
+    monkeypatch.setattr(multi_part_upload.multi_part_encryption, 'EncryptionStage', FakeStage)
+    monkeypatch.setattr(multi_part_upload.multi_part_scheduler, 'PartScheduler', broken_scheduler)
+    # Keys from an earlier run are not carried into the next one
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {('bucket', 'old.bin'): b'old-key'})
+
+    multi_part_upload.upload_folder(str(tmpdir), 'bucket', encryption_workers=2, list_contents=False)
+
+    assert sorted(closed) == ['FakeKeyStore', 'FakeStage']
+    assert multi_part_upload.encryption_stage is None and multi_part_upload.key_store is None
+    assert not multi_part_upload.file_keys and not multi_part_upload.derive_locks
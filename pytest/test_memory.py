@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_memory import MemoryBudget, parse_size
+from dev.multi_part_scheduler import PartScheduler
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 * 1024 * 1024
+    assert parse_size("2GiB") == 2 * 1024 ** 3
+    assert parse_size("1.5k") == 1536
+    assert parse_size("4096") == 4096
+    assert parse_size(None) is None
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_budget_blocks_until_released():
+    budget = MemoryBudget(100)
+    assert budget.acquire(60) == 60
+    # Larger than the whole budget: charged the full budget, so it waits for everything
+    acquired = threading.Event()
+
+    def take_everything():
+        budget.acquire(500)
+        acquired.set()
+
+    thread = threading.Thread(target=take_everything)
+    thread.start()
+    assert not acquired.wait(0.05)
+    budget.release(60)
+    assert acquired.wait(1)
+    thread.join()
+    assert budget.in_use == 100
+    assert budget.high_water == 100
+
+
+def test_scheduler_never_buffers_more_than_the_budget(tmpdir):
+    path = str(tmpdir.join('big.bin'))
+    with open(path, 'wb') as file:
+        file.write(os.urandom(100))
+
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'mock_upload_id'}
+    lock = threading.Lock()
+    buffered = {'now': 0, 'peak': 0}
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        with lock:
+            buffered['now'] += 20
+            buffered['peak'] = max(buffered['peak'], buffered['now'])
+        time.sleep(0.01)
+        with lock:
+            buffered['now'] -= 20
+        return {"PartNumber": args[0], "ETag": "etag"}
+
+    # Ten workers, but 10-byte parts cost 20 bytes each against a 45 byte budget
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, max_concurrency=10,
+                              budget=MemoryBudget(45), part_cost=lambda length: 2 * length)
+    scheduler.submit_file(path, "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert not upload.failed
+    assert buffered['peak'] <= 40
+    assert scheduler.budget.high_water <= 40
+    assert scheduler.budget.in_use == 0
@@ -0,0 +1,46 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev import multi_part_upload
+from dev.multi_part_format import DEFAULT_CHUNK_SIZE, SCHEME
+from dev.multi_part_keystore import key_id
+from dev.multi_part_scheduler import PartScheduler
+
+
+def test_metadata_describes_the_encryption(monkeypatch):
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+
+    metadata = multi_part_upload.object_metadata('a.bin', 1234, plaintext_sha256='ab' * 32)
+    assert metadata == {'encryption': SCHEME, 'key-id': key_id(multi_part_upload.encryption_keys['a.bin']),
+                        'chunk-size': str(DEFAULT_CHUNK_SIZE), 'plaintext-size': '1234',
+                        'plaintext-sha256': 'ab' * 32}
+
+    monkeypatch.setattr(multi_part_upload, 'client_side_encryption', False)
+    assert multi_part_upload.object_metadata('plain.bin', 10) == {}
+
+
+def test_objects_are_created_with_metadata(tmpdir):
+    paths = []
+    for name, size in [('small.bin', 10), ('large.bin', 40)]:
+        path = str(tmpdir.join(name))
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        paths.append(path)
+
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    s3.complete_multipart_upload.return_value = {'ETag': '"done"'}
+    put_object = MagicMock(return_value={'ETag': '"put"'})
+    upload_part = MagicMock(side_effect=lambda args, *rest, **kwargs: {"PartNumber": args[0], "ETag": "etag"})
+    scheduler = PartScheduler(s3, 'bucket', 'us-east-1', upload_part, put_object, multipart_threshold=20,
+                              metadata=lambda upload: {'plaintext-size': str(upload.file_size)})
+    for path in paths:
+        scheduler.submit_file(path, os.path.basename(path), 10)
+    scheduler.join()
+
+    assert put_object.call_args.kwargs['metadata'] == {'plaintext-size': '10'}
+    assert s3.create_multipart_upload.call_args.kwargs['Metadata'] == {'plaintext-size': '40'}
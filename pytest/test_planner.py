@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_format import encrypted_size
+from dev.multi_part_planner import (MAX_PART_SIZE, MAX_PARTS, MAX_PLAINTEXT_PART_SIZE, MIN_PART_SIZE,
+                                    number_of_parts, plan_part_size, show_plan)
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+
+
+def test_small_files_get_the_minimum_part_size():
+    assert plan_part_size(0) == MIN_PART_SIZE
+    assert plan_part_size(12 * MiB) == MIN_PART_SIZE
+
+
+def test_target_part_count_drives_the_part_size():
+    assert plan_part_size(1 * GiB) == 64 * MiB
+    assert plan_part_size(1 * GiB, target_parts=4) == 256 * MiB
+    # Rounded up to whole MiB
+    assert plan_part_size(1000 * MiB + 1, target_parts=10) == 101 * MiB
+
+
+def test_requested_part_size_is_clamped():
+    assert plan_part_size(1 * GiB, part_size=1024) == MIN_PART_SIZE
+    assert plan_part_size(100 * GiB, part_size=10 * GiB) == MAX_PLAINTEXT_PART_SIZE
+
+
+def test_largest_part_still_fits_once_encrypted():
+    assert encrypted_size(MAX_PLAINTEXT_PART_SIZE) <= MAX_PART_SIZE
+    assert encrypted_size(MAX_PLAINTEXT_PART_SIZE + MiB) > MAX_PART_SIZE
+    assert MAX_PLAINTEXT_PART_SIZE % MiB == 0
+
+
+def test_large_files_stay_within_the_part_cap():
+    file_size = 200 * GiB
+    part_size = plan_part_size(file_size, target_parts=100000, part_size=5 * MiB)
+    assert number_of_parts(file_size, part_size) <= MAX_PARTS
+    assert part_size % MiB == 0
+
+    biggest = 5 * 1024 * GiB
+    assert number_of_parts(biggest, plan_part_size(biggest)) <= MAX_PARTS
+    with pytest.raises(ValueError):
+        plan_part_size(biggest + 1)
+
+
+def test_show_plan(capsys):
+    show_plan([("small.txt", 100, MIN_PART_SIZE), ("big.bin", 1 * GiB, 64 * MiB)], 8 * MiB)
+    output = capsys.readouterr().out
+    assert "PutObject" in output
+    assert "Multipart" in output
+    assert "64.0 MB" in output
+    assert "|      16 |" in output
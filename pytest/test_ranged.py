@@ -0,0 +1,194 @@
+import io
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+from botocore.exceptions import ClientError
+from cryptography.fernet import Fernet
+
+from dev.multi_part_concurrency import AdaptiveConcurrency
+from dev.multi_part_format import SCHEME, FormatError, encrypt_range
+from dev.multi_part_ranged import download_decrypted, download_ranges, probe
+
+KEY = Fernet.generate_key()
+CHUNK = 1024
+
+
+class RangedS3:
+    """Serves ranged GETs of in-memory objects, recording each range and honouring IfMatch."""
+    def __init__(self, objects, metadata=None, fail_from=None):
+        self.objects = objects
+        self.metadata = metadata or {}
+        self.etag = '"v1"'
+        # Ranges starting at or after this offset fail, as if the connection dropped
+        self.fail_from = fail_from
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        data = self.objects[Key]
+        if IfMatch not in (None, self.etag):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'changed'}}, 'GetObject')
+        if Range is None:
+            return {'Body': io.BytesIO(data), 'ETag': self.etag, 'Metadata': self.metadata, 'ContentLength': len(data)}
+        if not data:
+            raise ClientError({'Error': {'Code': 'InvalidRange', 'Message': 'empty'}}, 'GetObject')
+        start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+        if self.fail_from is not None and start >= self.fail_from:
+            raise ClientError({'Error': {'Code': 'RequestTimeout', 'Message': 'dropped'}}, 'GetObject')
+        end = min(end, len(data) - 1)
+        with self.lock:
+            self.ranges.append((start, end))
+        return {'Body': io.BytesIO(data[start:end + 1]), 'ETag': self.etag, 'Metadata': self.metadata,
+                'ContentRange': f"bytes {start}-{end}/{len(data)}"}
+
+
+def encrypted_object(data, part_size=4 * CHUNK):
+    return b''.join(encrypt_range(data[offset:offset + part_size], KEY, offset, len(data), CHUNK)
+                    for offset in range(0, max(len(data), 1), part_size))
+
+
+@pytest.mark.parametrize("size", [0, 10, 10 * CHUNK + 5])
+def test_encrypted_object_is_fetched_in_ranges_and_decrypted_in_place(tmpdir, size):
+    data = os.urandom(size)
+    s3 = RangedS3({'obj': encrypted_object(data)})
+    local_path = str(tmpdir.join('obj'))
+
+    assert download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: KEY, max_concurrency=4,
+                              frames_per_range=3) == size
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    # One GET for the header, then one per three frames
+    assert len(s3.ranges) == 1 + -(-max(1, -(-size // CHUNK)) // 3)
+    assert not os.path.exists(local_path + '.downloading')
+
+
+def test_plain_objects_are_left_to_the_caller(tmpdir):
+    s3 = RangedS3({'obj': b'gAAAAA fernet token'})
+    assert download_decrypted(s3, 'bucket', 'obj', str(tmpdir.join('obj')), lambda metadata: KEY) is None
+    assert not os.listdir(str(tmpdir))
+
+
+def test_failed_range_leaves_no_file(tmpdir):
+    s3 = RangedS3({'obj': encrypted_object(os.urandom(10 * CHUNK))})
+    local_path = str(tmpdir.join('obj'))
+    with pytest.raises(Exception):
+        download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: Fernet.generate_key(), frames_per_range=2)
+    assert not os.listdir(str(tmpdir))
+
+
+def test_key_and_sizes_come_from_the_get_response(tmpdir):
+    data = os.urandom(3 * CHUNK)
+    metadata = {'encryption': SCHEME, 'key-id': 'abc', 'chunk-size': str(CHUNK), 'plaintext-size': str(len(data))}
+    s3 = RangedS3({'obj': encrypted_object(data)}, metadata)
+    seen = []
+    local_path = str(tmpdir.join('obj'))
+
+    download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: seen.append(metadata) or KEY)
+    assert seen == [metadata]
+
+    s3.metadata = dict(metadata, **{'plaintext-size': '5'})
+    with pytest.raises(FormatError):
+        download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: KEY)
+    with pytest.raises(LookupError):
+        download_decrypted(RangedS3({'obj': encrypted_object(data)}), 'bucket', 'obj', local_path,
+                           lambda metadata: None)
+
+    s3.metadata = dict(metadata, encryption='other-v9')
+    with pytest.raises(FormatError):
+        download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: KEY)
+
+
+@pytest.mark.parametrize("size", [0, 100, 1000, 1001])
+def test_plain_object_is_fetched_in_ranges_into_a_preallocated_file(tmpdir, size):
+    data = os.urandom(size)
+    s3 = RangedS3({'obj': data})
+    local_path = str(tmpdir.join('obj'))
+
+    first = probe(s3, 'bucket', 'obj', 100)
+    assert download_ranges(s3, 'bucket', 'obj', local_path, max_concurrency=4, range_size=100, first=first) == size
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    # The probe doubles as the first range; an empty object is fetched without one
+    assert len(s3.ranges) == -(-size // 100)
+
+
+def test_every_range_feeds_the_concurrency_limit(tmpdir):
+    data = os.urandom(3000)
+    concurrency = AdaptiveConcurrency(initial=2, maximum=8)
+
+    download_ranges(RangedS3({'obj': data}), 'bucket', 'obj', str(tmpdir.join('obj')), range_size=100,
+                    concurrency=concurrency)
+
+    # One whole-file report could never end a window; thirty ranges end several
+    assert concurrency.decisions and concurrency.limit > 2
+    assert concurrency.in_use == 0
+
+
+def test_throttled_range_halves_the_limit(tmpdir):
+    class ThrottlingS3(RangedS3):
+        def get_object(self, **kwargs):
+            if kwargs.get('Range', '').startswith('bytes=500-'):
+                raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'slow down'}}, 'GetObject')
+            return super().get_object(**kwargs)
+
+    concurrency = AdaptiveConcurrency(initial=8, maximum=8)
+    with pytest.raises(ClientError):
+        download_ranges(ThrottlingS3({'obj': os.urandom(1000)}), 'bucket', 'obj', str(tmpdir.join('obj')),
+                        range_size=100, concurrency=concurrency)
+    assert (8, 4, "throttled by S3") in concurrency.decisions
+
+
+def test_interrupted_download_resumes_with_the_missing_ranges(tmpdir):
+    data = os.urandom(1000)
+    s3 = RangedS3({'obj': data}, fail_from=600)
+    local_path = str(tmpdir.join('obj'))
+
+    with pytest.raises(ClientError):
+        download_ranges(s3, 'bucket', 'obj', local_path, max_concurrency=1, range_size=100)
+    assert not os.path.exists(local_path)
+    assert os.path.exists(local_path + '.downloading.journal')
+
+    s3.fail_from, s3.ranges = None, []
+    assert download_ranges(s3, 'bucket', 'obj', local_path, max_concurrency=4, range_size=100) == 1000
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    # The probe, then only the four ranges the first run did not finish
+    assert sorted(s3.ranges) == [(0, 99), (600, 699), (700, 799), (800, 899), (900, 999)]
+    assert sorted(os.listdir(str(tmpdir))) == ['obj']
+
+
+def test_interrupted_download_starts_over_when_the_object_changed(tmpdir):
+    data = os.urandom(1000)
+    s3 = RangedS3({'obj': data}, fail_from=500)
+    local_path = str(tmpdir.join('obj'))
+    with pytest.raises(ClientError):
+        download_ranges(s3, 'bucket', 'obj', local_path, max_concurrency=1, range_size=100)
+
+    changed = os.urandom(1000)
+    s3.objects['obj'], s3.etag, s3.fail_from, s3.ranges = changed, '"v2"', None, []
+    download_ranges(s3, 'bucket', 'obj', local_path, max_concurrency=4, range_size=100)
+    with open(local_path, 'rb') as file:
+        assert file.read() == changed
+    assert len(s3.ranges) == 10
+
+
+def test_interrupted_decryption_resumes(tmpdir):
+    data = os.urandom(10 * CHUNK)
+    encrypted = encrypted_object(data)
+    frame = len(encrypted_object(os.urandom(CHUNK))) - 9
+    s3 = RangedS3({'obj': encrypted}, fail_from=9 + 6 * frame)
+    local_path = str(tmpdir.join('obj'))
+    with pytest.raises(ClientError):
+        download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: KEY, max_concurrency=1,
+                           frames_per_range=2)
+
+    s3.fail_from, s3.ranges = None, []
+    assert download_decrypted(s3, 'bucket', 'obj', local_path, lambda metadata: KEY, frames_per_range=2) == len(data)
+    with open(local_path, 'rb') as file:
+        assert file.read() == data
+    # The header, then frames 6-7 and 8-9
+    assert len(s3.ranges) == 3
@@ -0,0 +1,60 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_reader import PartReader
+from dev import multi_part_upload
+
+
+def test_part_body_reads_in_blocks_without_copying(tmpdir):
+    path = str(tmpdir.join('data.bin'))
+    content = os.urandom(10000)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+    reader = PartReader(path)
+    body = reader.body(4000, 4000)
+    assert len(body) == 4000
+
+    first = body.read(1500)
+    assert isinstance(first, memoryview)
+    assert bytes(first) == content[4000:5500]
+    assert bytes(body.read()) == content[5500:8000]
+    assert body.read(10) == b''
+
+    body.seek(0)
+    assert body.tell() == 0
+    assert bytes(body.read(10)) == content[4000:4010]
+
+    # The last part is shorter than the part size
+    assert bytes(reader.part(8000, 4000)) == content[8000:]
+
+    first.release()
+    reader.release(4000, 4000)
+    reader.close()
+
+
+def test_upload_part_sends_view_from_shared_reader(tmpdir, monkeypatch):
+    path = str(tmpdir.join('data.bin'))
+    with open(path, 'wb') as file:
+        file.write(os.urandom(300))
+
+    s3 = MagicMock()
+    s3.upload_part.return_value = {'ETag': 'etag-2'}
+    reader = PartReader(path)
+    # Without client-side encryption the part goes out unencrypted, straight from the mapping
+    monkeypatch.setattr(multi_part_upload, 'client_side_encryption', False)
+    monkeypatch.setattr(multi_part_upload, 'encryption_keys', {})
+    monkeypatch.setattr(multi_part_upload, 'file_keys', {})
+
+    part = multi_part_upload.upload_part((2, 'upload-1', path, 'test_bucket', 'data.bin', 100),
+                                         s3_client=s3, reader=reader)
+
+    assert part == {"PartNumber": 2, "ETag": "etag-2"}
+    body = s3.upload_part.call_args.kwargs['Body']
+    with open(path, 'rb') as file:
+        file.seek(100)
+        assert bytes(body.read()) == file.read(100)
+    reader.close()
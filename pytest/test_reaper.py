@@ -0,0 +1,110 @@
+import os
+import sys
+import datetime
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+import pytest
+from botocore.exceptions import ClientError
+
+from dev import multi_part_reaper
+from dev.multi_part_reaper import abort_upload, older_than, parse_age, prefix_of, summarize
+
+NOW = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_upload(key, days_old):
+    return {'Key': key, 'UploadId': f"id-{key}", 'Initiated': NOW - datetime.timedelta(days=days_old)}
+
+
+def test_parse_age():
+    assert parse_age("90m") == datetime.timedelta(minutes=90)
+    assert parse_age("7d") == datetime.timedelta(days=7)
+    assert parse_age("30") == datetime.timedelta(seconds=30)
+    assert parse_age(None) is None
+    with pytest.raises(ValueError):
+        parse_age("soon")
+
+
+def test_filter_by_age():
+    uploads = [make_upload("a", 10), make_upload("b", 1)]
+    assert [upload['Key'] for upload in older_than(uploads, parse_age("7d"), now=NOW)] == ["a"]
+    assert len(older_than(uploads, None, now=NOW)) == 2
+
+
+def test_summary_groups_bytes_by_prefix():
+    uploads = [make_upload("logs/2024/a", 1), make_upload("logs/2023/b", 1), make_upload("top.bin", 1)]
+    sizes = [(2, 100), (1, 50), (3, 7)]
+    assert prefix_of("logs/2024/a", depth=2) == "logs/2024/"
+    assert summarize(uploads, sizes) == [["(root)", 1, 3, 7], ["logs/", 2, 3, 150]]
+
+
+def test_abort_treats_missing_upload_as_done():
+    s3 = MagicMock()
+    s3.abort_multipart_upload.side_effect = ClientError({'Error': {'Code': 'NoSuchUpload', 'Message': 'x'}},
+                                                        'AbortMultipartUpload')
+    assert abort_upload(s3, "bucket", make_upload("a", 1)) is None
+    s3.abort_multipart_upload.side_effect = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'no'}},
+                                                        'AbortMultipartUpload')
+    assert "AccessDenied" in abort_upload(s3, "bucket", make_upload("a", 1))
+
+
+def fake_client(uploads, parts):
+    s3 = MagicMock()
+
+    def get_paginator(name):
+        paginator = MagicMock()
+        if name == 'list_multipart_uploads':
+            paginator.paginate.return_value = [{'Uploads': uploads[:1]}, {'Uploads': uploads[1:]}]
+        else:
+            paginator.paginate.side_effect = lambda **kwargs: [{'Parts': parts[kwargs['Key']]}]
+        return paginator
+    s3.get_paginator.side_effect = get_paginator
+    return s3
+
+
+def test_dry_run_reports_without_aborting(monkeypatch, capsys):
+    uploads = [make_upload("logs/a", 30), make_upload("logs/b", 30)]
+    s3 = fake_client(uploads, {"logs/a": [{'Size': 5 * 1024 * 1024}], "logs/b": [{'Size': 10}, {'Size': 10}]})
+    monkeypatch.setattr(multi_part_reaper.boto3, 'client', lambda *args, **kwargs: s3)
+
+    multi_part_reaper.reap_uploads("bucket", dry_run=True)
+    output = capsys.readouterr().out
+    assert "logs/" in output and "Dry run: 2 uploads would be aborted." in output
+    s3.abort_multipart_upload.assert_not_called()
+
+    multi_part_reaper.reap_uploads("bucket")
+    assert s3.abort_multipart_upload.call_count == 2
+    assert "Aborted 2 of 2" in capsys.readouterr().out
+
+
+def test_reclaimed_bytes_count_only_the_aborted_uploads(monkeypatch, capsys):
+    uploads = [make_upload("logs/a", 30), make_upload("data/b", 30)]
+    s3 = fake_client(uploads, {"logs/a": [{'Size': 1000}], "data/b": [{'Size': 2000}]})
+
+    def abort(**kwargs):
+        if kwargs['Key'] == "data/b":
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'AbortMultipartUpload')
+    s3.abort_multipart_upload.side_effect = abort
+    monkeypatch.setattr(multi_part_reaper.boto3, 'client', lambda *args, **kwargs: s3)
+
+    multi_part_reaper.reap_uploads("bucket")
+    output = capsys.readouterr().out
+    # The table follows the aborts and leaves out the one that failed
+    assert output.index("Could not abort data/b") < output.index("Bytes Reclaimed")
+    assert "logs/" in output and "data/" not in output.split("Bytes Reclaimed")[1]
+    assert "Aborted 1 of 2" in output
+
+
+def test_recent_uploads_are_left_alone_by_default(monkeypatch, capsys):
+    recent = dict(make_upload("logs/new", 0), Initiated=datetime.datetime.now(datetime.timezone.utc))
+    s3 = fake_client([make_upload("logs/old", 30), recent], {"logs/old": [], "logs/new": []})
+    monkeypatch.setattr(multi_part_reaper.boto3, 'client', lambda *args, **kwargs: s3)
+
+    multi_part_reaper.reap_uploads("bucket")
+    s3.abort_multipart_upload.assert_called_once()
+    assert s3.abort_multipart_upload.call_args.kwargs['Key'] == "logs/old"
+
+    multi_part_reaper.reap_uploads("bucket", older_than_age="0")
+    assert s3.abort_multipart_upload.call_count == 3
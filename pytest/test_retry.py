@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_journal import UploadJournal
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from dev.multi_part_retry import CONNECTION_ERROR, RetryPolicy, error_code, is_retryable
+from dev.multi_part_scheduler import PartScheduler
+
+
+def flaky_upload_part(failures, code='SlowDown'):
+    """Fail each part number in ``failures`` that many times before it succeeds."""
+    sent = []
+    lock = threading.Lock()
+
+    def upload_part(args, bucket_region, s3_client=None, reader=None):
+        part_number = args[0]
+        with lock:
+            sent.append(part_number)
+            if failures.get(part_number, 0):
+                failures[part_number] -= 1
+                return {"PartNumber": part_number, "Error": "Please reduce your request rate.", "Code": code}
+        return {"PartNumber": part_number, "ETag": f"etag-{part_number}"}
+    return upload_part, sent
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    for attempt in range(1, 10):
+        assert 0 <= policy.delay(attempt) <= min(4.0, 2 ** (attempt - 1))
+    assert len({policy.delay(3) for _ in range(20)}) > 1
+    assert policy.budget_for(100) == policy.retry_budget + 10
+
+
+def test_is_retryable():
+    assert is_retryable({"Error": "x", "Code": "SlowDown"})
+    assert is_retryable({"Error": "connection reset", "Code": CONNECTION_ERROR})
+    assert not is_retryable({"Error": "x", "Code": "AccessDenied"})
+    # Local failures, such as a file that vanished, would only fail again
+    assert not is_retryable({"Error": "No such file", "Code": None})
+
+
+def test_error_codes():
+    assert error_code(ClientError({'Error': {'Code': 'SlowDown', 'Message': 'x'}}, 'UploadPart')) == 'SlowDown'
+    assert error_code(EndpointConnectionError(endpoint_url='https://s3')) == CONNECTION_ERROR
+    assert error_code(ConnectionResetError()) == CONNECTION_ERROR
+    assert error_code(FileNotFoundError('big.bin')) is None
+    assert error_code(ValueError('bad')) is None
+
+
+def test_only_failed_parts_are_retried(make_file):
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    upload_part, sent = flaky_upload_part({2: 2})
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", upload_part, max_concurrency=2, multipart_threshold=0,
+                              retry=RetryPolicy(base_delay=0.001))
+    scheduler.submit_file(make_file(40), "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert not upload.failed
+    assert sorted(sent) == [1, 2, 2, 2, 3, 4]
+    assert upload.retries == 2
+    s3.complete_multipart_upload.assert_called_once()
+    s3.abort_multipart_upload.assert_not_called()
+
+
+def test_upload_is_aborted_when_retries_run_out(tmpdir, make_file):
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    journal = UploadJournal(str(tmpdir.join('journal')))
+    upload_part, sent = flaky_upload_part({3: 100})
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", upload_part, max_concurrency=1, multipart_threshold=0,
+                              journal=journal, retry=RetryPolicy(max_attempts=3, base_delay=0.001))
+    scheduler.submit_file(make_file(40), "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert upload.failed and upload.aborted
+    assert sent.count(3) == 3
+    s3.complete_multipart_upload.assert_not_called()
+    s3.abort_multipart_upload.assert_called_once_with(Bucket="bucket", Key="big.bin", UploadId="u1")
+    assert journal.load("bucket", "big.bin") is None
+
+
+def test_permanent_errors_abort_without_retrying(make_file):
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'u1'}
+    upload_part, sent = flaky_upload_part({1: 1}, code='AccessDenied')
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", upload_part, max_concurrency=1, multipart_threshold=0,
+                              retry=RetryPolicy(base_delay=0.001))
+    scheduler.submit_file(make_file(40), "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert upload.failed and upload.aborted
+    assert upload.retries == 0
+    # Parts queued behind the failure are skipped rather than sent to an upload about to be aborted
+    assert len(sent) < 4
+
+
+def test_whole_file_puts_are_retried(make_file):
+    s3 = MagicMock()
+    calls = []
+
+    def put_object(args, bucket_region, s3_client=None):
+        calls.append(args)
+        if len(calls) == 1:
+            return {"Error": "We encountered an internal error.", "Code": "InternalError"}
+        return {"ETag": "whole"}
+
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", None, put_object, max_concurrency=1,
+                              retry=RetryPolicy(base_delay=0.001))
+    scheduler.submit_file(make_file(40), "small.bin", 10)
+    upload, = scheduler.join()
+    assert upload.etag == "whole"
+    assert len(calls) == 2
+
+
+def test_create_and_complete_are_retried(make_file):
+    s3 = MagicMock()
+    unavailable = ClientError({'Error': {'Code': 'ServiceUnavailable', 'Message': 'Please try again.'}}, 'x')
+    s3.create_multipart_upload.side_effect = [unavailable, {'UploadId': 'u1'}]
+    s3.complete_multipart_upload.side_effect = [unavailable, {'ETag': '"done"'}]
+    upload_part, sent = flaky_upload_part({})
+    scheduler = PartScheduler(s3, "bucket", "us-east-1", upload_part, max_concurrency=2, multipart_threshold=0,
+                              retry=RetryPolicy(base_delay=0.001))
+    scheduler.submit_file(make_file(40), "big.bin", 10)
+    upload, = scheduler.join()
+
+    assert not upload.failed and upload.etag == '"done"'
+    assert upload.retries == 2
+    assert sorted(sent) == [1, 2, 3, 4]
+    s3.abort_multipart_upload.assert_not_called()
@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_scan import object_key, scan_files
+
+
+def build_tree(root):
+    for relative_path in ["top.txt", "photos/a.jpg", "photos/2024/a.jpg", "docs/readme.md"]:
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(relative_path)
+
+
+def test_scan_top_level_only_by_default(tmpdir):
+    build_tree(str(tmpdir))
+    found = list(scan_files(str(tmpdir)))
+    assert [relative_path for _, relative_path, _ in found] == ["top.txt"]
+    file_path, _, stat = found[0]
+    assert stat.st_size == os.path.getsize(file_path)
+
+
+def test_recursive_scan_keeps_relative_paths(tmpdir):
+    build_tree(str(tmpdir))
+    relative_paths = sorted(relative_path for _, relative_path, _ in scan_files(str(tmpdir), recursive=True))
+    assert relative_paths == ["docs/readme.md", "photos/2024/a.jpg", "photos/a.jpg", "top.txt"]
+
+
+def test_scan_is_lazy(tmpdir):
+    build_tree(str(tmpdir))
+    files = scan_files(str(tmpdir), recursive=True)
+    first = next(files)
+    assert len(first) == 3
+
+
+def test_symlinked_directories_are_not_followed(tmpdir):
+    build_tree(str(tmpdir))
+    os.symlink(str(tmpdir), str(tmpdir.join('loop')))
+    relative_paths = [relative_path for _, relative_path, _ in scan_files(str(tmpdir), recursive=True)]
+    assert len(relative_paths) == 4
+
+
+def test_object_key():
+    assert object_key("", "photos/a.jpg") == "photos/a.jpg"
+    assert object_key("backup", "photos/a.jpg") == "backup/photos/a.jpg"
+    assert object_key("/backup/", "a.jpg") == "backup/a.jpg"
@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev.multi_part_scheduler import PartScheduler
+
+
+def test_parts_from_all_files_share_one_bounded_pool(make_files):
+    paths = make_files([40, 25, 10])
+    s3 = MagicMock()
+    s3.create_multipart_upload.side_effect = lambda Bucket, Key: {'UploadId': f"id-{Key}"}
+
+    lock = threading.Lock()
+    in_flight = {'now': 0, 'peak': 0}
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        part_number, upload_id, file_path, bucket, file_name, part_size = args
+        with lock:
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+        time.sleep(0.01)
+        with lock:
+            in_flight['now'] -= 1
+        return {"PartNumber": part_number, "ETag": f"{file_name}-{part_number}"}
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, max_concurrency=3)
+    for path in paths:
+        scheduler.submit_file(path, os.path.basename(path), 10)
+    uploads = scheduler.join()
+
+    assert in_flight['peak'] <= 3
+    assert [upload.num_parts for upload in uploads] == [4, 3, 1]
+    assert not any(upload.failed for upload in uploads)
+
+    completed = {call.kwargs['Key']: call.kwargs for call in s3.complete_multipart_upload.call_args_list}
+    assert set(completed) == {"file_0.bin", "file_1.bin", "file_2.bin"}
+    parts = completed["file_0.bin"]['MultipartUpload']['Parts']
+    assert [part['PartNumber'] for part in parts] == [1, 2, 3, 4]
+    assert completed["file_0.bin"]['UploadId'] == "id-file_0.bin"
+
+
+def test_failed_part_marks_only_its_file(make_files):
+    paths = make_files([20, 20])
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'mock_upload_id'}
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        part_number, upload_id, file_path, bucket, file_name, part_size = args
+        if file_name == "file_1.bin" and part_number == 2:
+            return {"PartNumber": part_number, "Error": "boom"}
+        return {"PartNumber": part_number, "ETag": "etag"}
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, max_concurrency=2)
+    for path in paths:
+        scheduler.submit_file(path, os.path.basename(path), 10)
+    first, second = scheduler.join()
+
+    assert not first.failed
+    assert second.errors == [{"PartNumber": 2, "Error": "boom"}]
+    completed_keys = [call.kwargs['Key'] for call in s3.complete_multipart_upload.call_args_list]
+    assert completed_keys == ["file_0.bin"]
+
+
+def test_small_and_empty_files_use_a_single_put(make_files):
+    paths = make_files([0, 15, 50])
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'mock_upload_id'}
+    s3.complete_multipart_upload.return_value = {'ETag': 'multipart-etag'}
+    put_calls = []
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        return {"PartNumber": args[0], "ETag": "etag"}
+
+    def fake_put_object(args, bucket_region, s3_client=None):
+        file_path, bucket, file_name = args
+        put_calls.append(file_name)
+        return {"ETag": f"put-{file_name}"}
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, fake_put_object,
+                              max_concurrency=2, multipart_threshold=20)
+    for path in paths:
+        scheduler.submit_file(path, os.path.basename(path), 10)
+    empty, small, large = scheduler.join()
+
+    assert sorted(put_calls) == ["file_0.bin", "file_1.bin"]
+    assert empty.single_request and small.single_request and not large.single_request
+    assert small.etag == "put-file_1.bin"
+    assert large.etag == "multipart-etag"
+    assert large.num_parts == 5
+    s3.create_multipart_upload.assert_called_once_with(Bucket="test_bucket", Key="file_2.bin")
+
+
+def test_no_file_is_mapped_when_parts_are_read_elsewhere(make_files):
+    path, = make_files([30])
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {'UploadId': 'mock_upload_id'}
+    readers = []
+
+    def fake_upload_part(args, bucket_region, s3_client=None, reader=None):
+        readers.append(reader)
+        return {"PartNumber": args[0], "ETag": "etag"}
+
+    scheduler = PartScheduler(s3, "test_bucket", "us-east-1", fake_upload_part, max_concurrency=2, part_reader=False)
+    scheduler.submit_file(path, "file_0.bin", 10)
+    upload, = scheduler.join()
+
+    assert not upload.failed
+    assert readers == [None, None, None]
@@ -0,0 +1,114 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'client'))
+
+from dev import multi_part_sync
+from dev.multi_part_scan import scan_files
+from dev.multi_part_sync import SyncManifest, delete_orphans, list_remote, plan_sync
+
+
+def build_folder(root):
+    for relative_path in ["a.txt", "b.txt", "photos/c.jpg"]:
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(relative_path)
+
+
+def synced_state(root, manifest, prefix=""):
+    """A remote listing and manifest as left behind by a sync of every file under root."""
+    remote = {}
+    for _, relative_path, stat in scan_files(root, recursive=True):
+        key = f"{prefix}/{relative_path}" if prefix else relative_path
+        remote[key] = {'Size': stat.st_size + 100, 'ETag': f'"{relative_path}"'}
+        manifest.record(key, stat, f'"{relative_path}"')
+    return remote
+
+
+def test_unchanged_files_are_skipped(tmpdir):
+    build_folder(str(tmpdir))
+    manifest = SyncManifest("bucket", "", str(tmpdir), directory=str(tmpdir.join('manifests')))
+    remote = synced_state(str(tmpdir), manifest)
+
+    new, changed, unchanged, orphans = plan_sync(scan_files(str(tmpdir), recursive=True), remote, manifest)
+    assert (new, changed, orphans) == ([], [], [])
+    assert len(unchanged) == 3
+
+
+def test_new_changed_and_orphaned_files(tmpdir):
+    build_folder(str(tmpdir))
+    manifest = SyncManifest("bucket", "backup", str(tmpdir), directory=str(tmpdir.join('manifests')))
+    remote = synced_state(str(tmpdir), manifest, prefix="backup")
+
+    tmpdir.join('a.txt').write('edited and longer')
+    tmpdir.join('d.txt').write('new')
+    # Overwritten in the bucket by someone else
+    remote['backup/b.txt']['ETag'] = '"other"'
+    remote['backup/gone.txt'] = {'Size': 1, 'ETag': '"x"'}
+    remote['backup/photos/gone.jpg'] = {'Size': 1, 'ETag': '"x"'}
+
+    new, changed, unchanged, orphans = plan_sync(scan_files(str(tmpdir), recursive=True), remote, manifest,
+                                                 prefix="backup")
+    assert [relative_path for _, relative_path, _ in new] == ["d.txt"]
+    assert sorted(relative_path for _, relative_path, _ in changed) == ["a.txt", "b.txt"]
+    assert [relative_path for _, relative_path, _ in unchanged] == ["photos/c.jpg"]
+    assert orphans == ["backup/gone.txt", "backup/photos/gone.jpg"]
+
+    # Without recursion nested keys were never compared, so they are not orphans
+    _, _, _, orphans = plan_sync(scan_files(str(tmpdir)), remote, manifest, prefix="backup", recursive=False)
+    assert orphans == ["backup/gone.txt"]
+
+
+def test_manifest_round_trip(tmpdir):
+    build_folder(str(tmpdir))
+    directory = str(tmpdir.join('manifests'))
+    manifest = SyncManifest("bucket", "", str(tmpdir), directory=directory)
+    synced_state(str(tmpdir), manifest)
+    manifest.save()
+
+    reloaded = SyncManifest("bucket", "", str(tmpdir), directory=directory).load()
+    assert reloaded.entries == manifest.entries
+    assert SyncManifest("other", "", str(tmpdir), directory=directory).load().entries == {}
+
+
+def test_list_remote_reads_every_page():
+    s3 = MagicMock()
+    s3.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': 'p/a', 'Size': 1, 'ETag': '"1"'}]},
+        {'Contents': [{'Key': 'p/b', 'Size': 2, 'ETag': '"2"'}]},
+        {},
+    ]
+    assert list_remote(s3, "bucket", "/p/") == {'p/a': {'Size': 1, 'ETag': '"1"'}, 'p/b': {'Size': 2, 'ETag': '"2"'}}
+    s3.get_paginator.return_value.paginate.assert_called_once_with(Bucket="bucket", Prefix="p/")
+
+
+def test_delete_orphans_in_batches():
+    s3 = MagicMock()
+    s3.delete_objects.side_effect = [{}, {'Errors': [{'Key': 'k2001', 'Code': 'AccessDenied'}]}, {}]
+    keys = [f"k{index}" for index in range(2500)]
+    assert delete_orphans(s3, "bucket", keys) == ['k2001']
+    assert [len(call.kwargs['Delete']['Objects']) for call in s3.delete_objects.call_args_list] == [1000, 1000, 500]
+
+
+def test_noop_sync_uploads_nothing(tmpdir, monkeypatch):
+    # The manifest lives under STATE_DIR, the working directory
+    monkeypatch.chdir(tmpdir)
+    folder = tmpdir.mkdir('data')
+    build_folder(str(folder))
+    manifest = SyncManifest("bucket", "", str(folder))
+    remote = synced_state(str(folder), manifest)
+    manifest.save()
+
+    monkeypatch.setattr(multi_part_sync, 'list_remote', lambda s3, bucket, prefix: remote)
+    monkeypatch.setattr(multi_part_sync.boto3, 'client', MagicMock())
+    upload_folder = MagicMock()
+    monkeypatch.setattr(multi_part_sync.multi_part_upload, 'upload_folder', upload_folder)
+
+    multi_part_sync.sync_folder(str(folder), "bucket", delete=True)
+    upload_folder.assert_not_called()
+
+    folder.join('a.txt').write('changed contents')
+    multi_part_sync.sync_folder(str(folder), "bucket")
+    assert [relative_path for _, relative_path, _ in upload_folder.call_args.kwargs['files']] == ["a.txt"]